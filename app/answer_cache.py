@@ -0,0 +1,180 @@
+# =============================================
+# answer_cache.py
+# ---------------------------------------------
+# /chat の回答キャッシュ。
+# ・キー: (LLM モデル, 正規化した質問文, 検索で得たチャンク ID の集合)
+#   チャンク ID には内容ハッシュが含まれるので、文書が変われば自然にミスになる
+# ・オプション（ANSWER_CACHE_SIMILARITY > 0）: 言い換えの質問もヒットさせる。
+#   質問ベクトルのコサイン類似度が閾値以上で、かつ検索で得たチャンク ID の集合の重なり
+#   （Jaccard 係数）が ANSWER_CACHE_MIN_OVERLAP 以上のエントリのうち、最も似た質問の回答を返す
+#   （言い換えでは上位チャンクが完全には一致しないので、集合の一致までは求めない）
+# ・ヒットしても LLM を呼ばないだけで、検索（質問の埋め込みと Chroma への問い合わせ）は毎回行う
+#   （引用元の表示と、チャンクの重なりの確認に検索結果が要るため）
+# ・TTL と件数上限（LRU）で古いものから捨てる
+# ・取り込み / 削除 / リセットで、引用元のファイルが変わったエントリは無効化
+# =============================================
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import FrozenSet, Iterable, List, Optional, Set, Tuple
+
+import numpy as np
+
+from .config import settings
+
+def normalize_query(query: str) -> str:
+    """全角/半角・大小文字・空白・末尾の句読点の揺れを吸収する。"""
+    q = unicodedata.normalize("NFKC", query).lower()
+    q = re.sub(r"\s+", " ", q).strip()
+    return q.rstrip("?？。.!！ ")
+
+@dataclass
+class CachedAnswer:
+    answer: str
+    paths: Set[str]          # 引用元ファイル（無効化用）
+    created_at: float
+    query_vec: Optional[np.ndarray] = None
+
+_Key = Tuple[str, str, FrozenSet[str]]
+
+class AnswerCache:
+    def __init__(self, max_entries: int, ttl_seconds: float, similarity_threshold: float = 0.0,
+                 min_overlap: float = 0.5):
+        self.max_entries = max(1, max_entries)
+        self.ttl_seconds = ttl_seconds
+        self.similarity_threshold = similarity_threshold  # 0 以下なら類似検索しない
+        self.min_overlap = min_overlap                    # チャンク ID 集合の Jaccard 係数の下限
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[_Key, CachedAnswer]" = OrderedDict()
+        # 類似判定用の質問ベクトルの行列（エントリが増減したら次の類似判定で作り直す）
+        self._vec_keys: List[_Key] = []
+        self._vec_matrix: Optional[np.ndarray] = None
+        self._vec_dirty = False
+        self.hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _key(query: str, chunk_ids: Iterable[str]) -> _Key:
+        return (settings.llm_model, normalize_query(query), frozenset(chunk_ids))
+
+    def _drop(self, key: _Key):
+        entry = self._entries.pop(key, None)
+        if entry is not None and entry.query_vec is not None:
+            self._vec_dirty = True
+
+    def _vectors(self) -> Tuple[List[_Key], Optional[np.ndarray]]:
+        if self._vec_dirty:
+            keys = [k for k, e in self._entries.items() if e.query_vec is not None]
+            self._vec_keys = keys
+            self._vec_matrix = np.stack([self._entries[k].query_vec for k in keys]) if keys else None
+            self._vec_dirty = False
+        return self._vec_keys, self._vec_matrix
+
+    def _expired(self, entry: CachedAnswer, now: float) -> bool:
+        return self.ttl_seconds > 0 and now - entry.created_at > self.ttl_seconds
+
+    def get(self, query: str, chunk_ids: List[str], query_vec=None) -> Optional[CachedAnswer]:
+        key = self._key(query, chunk_ids)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self._expired(entry, now):
+                self._drop(key)
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry
+
+            if self.similarity_threshold > 0 and query_vec is not None:
+                best = self._most_similar(key, _unit(query_vec), now)
+                if best is not None:
+                    self._entries.move_to_end(best)
+                    self.hits += 1
+                    self.semantic_hits += 1
+                    return self._entries[best]
+
+            self.misses += 1
+            return None
+
+    def _most_similar(self, key: _Key, vec: np.ndarray, now: float) -> Optional[_Key]:
+        """類似度が閾値以上・チャンクの重なりが下限以上のうち、最も似た質問のキー。"""
+        keys, matrix = self._vectors()
+        if matrix is None or matrix.shape[1] != vec.shape[0]:
+            return None
+        sims = matrix @ vec
+        for i in np.argsort(-sims):
+            if sims[i] < self.similarity_threshold:
+                break
+            other = keys[i]
+            cand = self._entries.get(other)
+            if cand is None or other[0] != key[0]:
+                continue  # 捨てた・別のモデルの回答
+            if self._expired(cand, now):
+                self._drop(other)
+                continue
+            union = len(key[2] | other[2])
+            if union and len(key[2] & other[2]) / union >= self.min_overlap:
+                return other
+        return None
+
+    def put(self, query: str, chunk_ids: List[str], answer: str, paths: Iterable[str], query_vec=None):
+        key = self._key(query, chunk_ids)
+        entry = CachedAnswer(
+            answer=answer,
+            paths=set(paths),
+            created_at=time.time(),
+            query_vec=_unit(query_vec) if query_vec is not None else None,
+        )
+        with self._lock:
+            self._drop(key)
+            self._entries[key] = entry
+            if entry.query_vec is not None:
+                self._vec_dirty = True
+            while len(self._entries) > self.max_entries:
+                oldest = next(iter(self._entries))
+                self._drop(oldest)
+
+    def invalidate_paths(self, paths: Iterable[str]) -> int:
+        """指定ファイルを引用しているエントリを捨てる。捨てた件数を返す。"""
+        targets = set(paths)
+        if not targets:
+            return 0
+        with self._lock:
+            stale = [k for k, e in self._entries.items() if e.paths & targets]
+            for k in stale:
+                self._drop(k)
+        return len(stale)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._vec_keys, self._vec_matrix, self._vec_dirty = [], None, False
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "semantic_hits": self.semantic_hits,
+                "misses": self.misses,
+                "hit_rate": (self.hits / total) if total else 0.0,
+            }
+
+def _unit(vec) -> np.ndarray:
+    v = np.asarray(vec, dtype=np.float32)
+    n = float(np.linalg.norm(v))
+    return v / n if n > 0 else v
+
+# アプリ全体で共有する回答キャッシュ
+answer_cache = AnswerCache(
+    settings.answer_cache_max_entries,
+    settings.answer_cache_ttl_seconds,
+    settings.answer_cache_similarity,
+    settings.answer_cache_min_overlap,
+)
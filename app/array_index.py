@@ -0,0 +1,573 @@
+# =============================================
+# array_index.py
+# ---------------------------------------------
+# NumPy + メモリマップで持つベクトルインデックス（VECTOR_BACKEND=array）。
+# ・ベクトルは正規化した float32 を1行1件でファイルに並べ、全件総当たり（厳密）で上位 k 件を出す
+#   数万〜20万件なら HNSW を組むより速く、近似による取りこぼしもない
+# ・ARRAY_INDEX_DTYPE=float16 / int8 なら、総当たりには縮めた配列（量子化）を使う。
+#   候補を k × ARRAY_INDEX_RESCORE 件まで広く取り、float32 で採点し直して上位 k 件にする
+#   （float32 の配列はディスク上に置いたまま、候補の行だけをファイルから読む）
+# ・本文・メタデータは SQLite。メタデータ条件（where）は json_extract の SQL に直して絞る
+#   （結果が Chroma と同じになるように、型の扱い・キーの無い項目の扱いもそろえる）
+# ・削除した行は次の追加で使い回す。検索中に使い回された行は結果に出さない
+# =============================================
+import json
+import os
+import re
+import shutil
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from .vector_index import VectorIndex
+
+SUPPORTED_DTYPES = ("float32", "float16", "int8")
+
+_SCAN_BLOCK = 4096      # 量子化した配列を何行ずつ float32 に戻して計算するか（キャッシュに収まる大きさ）
+_SQL_BATCH = 500         # IN (...) に並べる件数
+_MASK_CACHE_SIZE = 8     # where → 行マスク を何通り覚えておくか（書き込みで捨てる）
+_KEY_RE = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*$")
+_COMPARE = {"$gt": ">", "$gte": ">=", "$lt": "<", "$lte": "<="}
+
+def _kind(value) -> str:
+    if isinstance(value, bool):
+        return "bool"
+    if isinstance(value, (int, float)):
+        return "number"
+    if isinstance(value, str):
+        return "str"
+    raise ValueError(f"Unsupported where value: {value!r}")
+
+def where_to_sql(where: dict) -> Tuple[str, list]:
+    """
+    Chroma 形式の where（$and / $or / $eq / $ne / $gt(e) / $lt(e) / $in / $nin）を SQL の条件式に直す。
+    Chroma と同じ結果になるように：
+    - 真偽値と数値は別物（JSON の true / false は json_extract では 1 / 0 になるので json_type で見分ける）
+    - $ne / $nin はそのキーが無い項目にも合う
+    - 大小比較は数値だけ。1つの dict に書ける条件は1つ（複数なら $and）。$in / $nin は空でない同じ型のリスト、
+      $and / $or は2つ以上。それ以外は（Chroma と同じく）ValueError
+    """
+    params: list = []
+
+    def key_path(key: str) -> str:
+        # 普通のキーは式に埋め込む（path の式インデックスが効くように）
+        if _KEY_RE.match(key):
+            return f"'$.{key}'"
+        params.append('$."' + key.replace('"', '\\"') + '"')
+        return "?"
+
+    def matches(key: str, op: str, values: list) -> str:
+        """キーがあり、型と値が合う（op が IN なら values のどれか）。"""
+        kinds = {_kind(v) for v in values}
+        if len(kinds) != 1:
+            raise ValueError(f"Where values for {key!r} must share one type: {values!r}")
+        kind = kinds.pop()
+        if kind == "bool":
+            names = sorted({"'true'" if v else "'false'" for v in values})
+            return f"json_type(metadata, {key_path(key)}) IN ({', '.join(names)})"
+        check = ""
+        if kind == "number":
+            check = f"json_type(metadata, {key_path(key)}) IN ('integer', 'real') AND "
+        expr = f"json_extract(metadata, {key_path(key)})"
+        params.extend(values)
+        if op == "IN":
+            test = f"{expr} IN ({','.join('?' * len(values))})"
+        else:
+            test = f"{expr} {op} ?"
+        return f"({check}{test})" if check else test
+
+    def compare(key: str, op: str, value) -> str:
+        if op in _COMPARE:
+            if _kind(value) != "number":
+                raise ValueError(f"Operator {op} needs an int or float, got {value!r}")
+            return matches(key, _COMPARE[op], [value])
+        if op in ("$eq", "$ne"):
+            test = matches(key, "=", [value])
+        elif op in ("$in", "$nin"):
+            values = list(value) if isinstance(value, (list, tuple)) else []
+            if not values:
+                raise ValueError(f"Operator {op} needs a non-empty list, got {value!r}")
+            test = matches(key, "IN", values)
+        else:
+            raise ValueError(f"Unsupported where operator: {op}")
+        if op in ("$eq", "$in"):
+            return test
+        # キーが無い（NULL）項目も合う
+        return f"NOT COALESCE({test}, 0)"
+
+    def cond(w: dict) -> str:
+        if len(w) != 1:
+            raise ValueError(f"Expected where to have exactly one operator, got {w!r}")
+        (key, value), = w.items()
+        if key in ("$and", "$or"):
+            if not isinstance(value, list) or len(value) < 2:
+                raise ValueError(f"{key} needs a list of at least two where expressions, got {value!r}")
+            return "(" + (" AND " if key == "$and" else " OR ").join(cond(c) for c in value) + ")"
+        if isinstance(value, dict):
+            if len(value) != 1:
+                raise ValueError(f"Expected one operator for {key!r}, got {value!r}")
+            (op, v), = value.items()
+            return compare(key, op, v)
+        return compare(key, "$eq", value)
+
+    return cond(where), params
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return (vectors / norms).astype(np.float32, copy=False)
+
+def _chunks(items: list, size: int = _SQL_BATCH):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+class ArrayIndex(VectorIndex):
+    """1フォルダ = 1インデックス。スレッドセーフ（総当たりの計算はロックの外で行う）。"""
+
+    def __init__(self, path: str, name: str, embedding_fn, dtype: str = "float32", rescore: int = 4):
+        if dtype not in SUPPORTED_DTYPES:
+            raise ValueError(f"ARRAY_INDEX_DTYPE must be one of {SUPPORTED_DTYPES}: {dtype}")
+        self.name = name
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self._embed = embedding_fn
+        self.dtype = np.dtype(dtype)
+        self.rescore = max(1, rescore)
+        self._lock = threading.Lock()
+
+        self._conn = sqlite3.connect(os.path.join(path, "items.sqlite3"), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        with self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS items ("
+                " id TEXT PRIMARY KEY,"
+                " row INTEGER NOT NULL UNIQUE,"
+                " document TEXT,"
+                " metadata TEXT NOT NULL)"
+            )
+            # パス単位の削除（where={"path": ...}）を全件走査にしない
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS items_path ON items(json_extract(metadata, '$.path'))"
+            )
+            self._conn.execute("CREATE TABLE IF NOT EXISTS meta (k TEXT PRIMARY KEY, v TEXT)")
+        row = self._conn.execute("SELECT v FROM meta WHERE k = 'dim'").fetchone()
+        self._dim: Optional[int] = int(row[0]) if row else None
+
+        rows = [r for (r,) in self._conn.execute("SELECT row FROM items")]
+        self._n = max(rows) + 1 if rows else 0          # 使ったことのある行数
+        self._free = sorted(set(range(self._n)) - set(rows), reverse=True)  # 末尾 = 小さい行
+        self._count = len(rows)
+        self._capacity = 0
+        self._vecs: Optional[np.memmap] = None     # float32（正規化済み）
+        self._codes = None                         # 総当たりに使う配列（float32 なら _vecs と同じ）
+        self._scales: Optional[np.memmap] = None   # int8 の行ごとの倍率
+        self._live = np.zeros(0, dtype=bool)
+        self._written_at = np.zeros(0, dtype=np.int64)
+        self._writes = 0
+        self._reader = None                        # 採点し直し用に float32 を読むファイル
+        self._read_lock = threading.Lock()
+        self._masks: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        if self._dim is not None:
+            self._open_arrays(max(self._n, self._stored_rows()))
+            self._live[rows] = True
+            self._sync_codes()
+
+    # ---- 配列（メモリマップ） ----
+
+    def _file(self, kind: str) -> str:
+        return os.path.join(self.path, f"vectors.{kind}")
+
+    def _stored_rows(self) -> int:
+        try:
+            return os.path.getsize(self._file("float32")) // (self._dim * 4)
+        except OSError:
+            return 0
+
+    @staticmethod
+    def _map(path: str, dtype, shape) -> np.memmap:
+        need = int(np.prod(shape)) * np.dtype(dtype).itemsize
+        with open(path, "ab") as f:
+            if f.tell() < need:
+                f.truncate(need)
+        return np.memmap(path, dtype=dtype, mode="r+", shape=shape)
+
+    def _open_arrays(self, capacity: int):
+        # 古い配列は捨てるだけ（検索中のスレッドが参照していても、その分は有効なまま）
+        for arr in (self._vecs, self._codes, self._scales):
+            if arr is not None:
+                arr.flush()
+        self._capacity = capacity
+        if capacity == 0:
+            self._vecs = self._codes = self._scales = None
+        else:
+            self._vecs = self._map(self._file("float32"), np.float32, (capacity, self._dim))
+            if self.dtype == np.float32:
+                self._codes, self._scales = self._vecs, None
+            else:
+                self._codes = self._map(self._file(self.dtype.name), self.dtype, (capacity, self._dim))
+                self._scales = (self._map(self._file("scales"), np.float32, (capacity,))
+                                if self.dtype == np.int8 else None)
+        live = np.zeros(capacity, dtype=bool)
+        live[:len(self._live)] = self._live[:capacity]
+        written_at = np.zeros(capacity, dtype=np.int64)
+        written_at[:len(self._written_at)] = self._written_at[:capacity]
+        self._live, self._written_at = live, written_at
+
+    def _ensure_capacity(self, n_rows: int):
+        if n_rows <= self._capacity:
+            return
+        self._open_arrays(max(n_rows, self._capacity * 2, 1024))
+
+    def _quantize(self, rows: np.ndarray, vectors: np.ndarray):
+        if self.dtype == np.int8:
+            scale = np.abs(vectors).max(axis=1) / 127.0
+            scale[scale == 0] = 1.0
+            self._codes[rows] = np.rint(vectors / scale[:, None]).astype(np.int8)
+            self._scales[rows] = scale
+        elif self.dtype == np.float16:
+            self._codes[rows] = vectors.astype(np.float16)
+
+    def _sync_codes(self):
+        """ARRAY_INDEX_DTYPE を変えて開いたときは、float32 から量子化し直す（取り込み直しは不要）。"""
+        row = self._conn.execute("SELECT v FROM meta WHERE k = 'codes'").fetchone()
+        if (row[0] if row else "float32") == self.dtype.name:
+            return
+        if self.dtype != np.float32 and self._n:
+            for start in range(0, self._n, _SCAN_BLOCK):
+                rows = np.arange(start, min(self._n, start + _SCAN_BLOCK))
+                self._quantize(rows, np.asarray(self._vecs[rows]))
+            self._codes.flush()
+            if self._scales is not None:
+                self._scales.flush()
+        with self._conn:
+            self._conn.execute("INSERT OR REPLACE INTO meta (k, v) VALUES ('codes', ?)", (self.dtype.name,))
+
+    def _read_vectors(self, rows: np.ndarray) -> np.ndarray:
+        """
+        float32 の行をファイルから読む（量子化時の採点し直し用。rows と同じ形 + 次元）。
+        メモリマップ越しに触ると、OS が周りのページまでまとめて載せてしまい、結局ほぼ全体が常駐する。
+        """
+        uniq, inverse = np.unique(rows, return_inverse=True)
+        out = np.empty((len(uniq), self._dim), dtype=np.float32)
+        size = self._dim * 4
+        with self._read_lock:
+            if self._reader is None:
+                self._reader = open(self._file("float32"), "rb", buffering=0)
+            for i, row in enumerate(uniq):
+                self._reader.seek(int(row) * size)
+                self._reader.readinto(memoryview(out[i]).cast("B"))
+        return out[inverse.reshape(-1)].reshape(rows.shape + (self._dim,))
+
+    def _flush_arrays(self):
+        for arr in (self._vecs, self._codes, self._scales):
+            if arr is not None:
+                arr.flush()
+
+    # ---- 行の絞り込み ----
+
+    def _rows(self, ids: Optional[List[str]] = None, where: Optional[dict] = None) -> List[int]:
+        """ID とメタデータ条件の両方に合う行（ロック内で呼ぶ）。"""
+        cond, params = where_to_sql(where) if where else ("1", [])
+        if ids is None:
+            return [r for (r,) in self._conn.execute(f"SELECT row FROM items WHERE {cond}", params)]
+        out: List[int] = []
+        for batch in _chunks(list(ids)):
+            marks = ",".join("?" * len(batch))
+            out.extend(r for (r,) in self._conn.execute(
+                f"SELECT row FROM items WHERE id IN ({marks}) AND {cond}", batch + params))
+        return out
+
+    def _mask(self, where: Optional[dict], ids: Optional[List[str]]) -> Optional[np.ndarray]:
+        """検索対象の行マスク（絞り込みが無ければ None）。where だけのものは書き込みまで覚えておく。"""
+        if not where and ids is None:
+            return None
+        key = None
+        if ids is None:
+            key = json.dumps(where, sort_keys=True, ensure_ascii=False)
+            cached = self._masks.get(key)
+            if cached is not None:
+                self._masks.move_to_end(key)
+                return cached
+        mask = np.zeros(self._n, dtype=bool)
+        mask[self._rows(ids, where)] = True
+        if key is not None:
+            self._masks[key] = mask
+            if len(self._masks) > _MASK_CACHE_SIZE:
+                self._masks.popitem(last=False)
+        return mask
+
+    def _touched(self):
+        """書き込みのたびに呼ぶ（ロック内）。"""
+        self._writes += 1
+        self._masks.clear()
+
+    # ---- 書き込み ----
+
+    def upsert(self, ids, documents=None, metadatas=None, embeddings=None):
+        if not ids:
+            return
+        if embeddings is None:
+            embeddings = self._embed.embed_array(list(documents))
+        vectors = _normalize(np.asarray(embeddings, dtype=np.float32))
+        # 同じ ID が重なっていたら後のものを使う
+        last = {id_: i for i, id_ in enumerate(ids)}
+        if len(last) != len(ids):
+            keep = sorted(last.values())
+            ids = [ids[i] for i in keep]
+            vectors = vectors[keep]
+            documents = [documents[i] for i in keep] if documents is not None else None
+            metadatas = [metadatas[i] for i in keep] if metadatas is not None else None
+        with self._lock:
+            if self._dim is None:
+                self._dim = int(vectors.shape[1])
+                with self._conn:
+                    self._conn.execute("INSERT OR REPLACE INTO meta (k, v) VALUES ('dim', ?)", (str(self._dim),))
+                    self._conn.execute("INSERT OR REPLACE INTO meta (k, v) VALUES ('codes', ?)",
+                                       (self.dtype.name,))
+            if vectors.shape[1] != self._dim:
+                raise ValueError(f"embedding dim mismatch: {vectors.shape[1]} != {self._dim}")
+
+            existing = {}
+            for batch in _chunks(list(ids)):
+                marks = ",".join("?" * len(batch))
+                existing.update(self._conn.execute(f"SELECT id, row FROM items WHERE id IN ({marks})", batch))
+            rows = []
+            for id_ in ids:
+                row = existing.get(id_)
+                if row is None:
+                    if self._free:
+                        row = self._free.pop()
+                    else:
+                        row = self._n
+                        self._n += 1
+                rows.append(row)
+            self._ensure_capacity(self._n)
+            rows_arr = np.asarray(rows, dtype=np.int64)
+            # ベクトルを書いてから SQLite に載せる（SQLite にある行は必ずベクトルもある）
+            self._vecs[rows_arr] = vectors
+            if self._codes is not self._vecs:
+                self._quantize(rows_arr, vectors)
+            self._flush_arrays()
+            self._touched()
+            self._written_at[rows_arr] = self._writes
+            docs = documents if documents is not None else [None] * len(ids)
+            metas = metadatas if metadatas is not None else [None] * len(ids)
+            with self._conn:
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO items (id, row, document, metadata) VALUES (?, ?, ?, ?)",
+                    [(id_, row, doc, json.dumps(meta or {}, ensure_ascii=False))
+                     for id_, row, doc, meta in zip(ids, rows, docs, metas)],
+                )
+            self._live[rows_arr] = True
+            self._count += len(ids) - len(existing)
+
+    def update(self, ids, metadatas):
+        with self._lock:
+            current = {}
+            for batch in _chunks(list(ids)):
+                marks = ",".join("?" * len(batch))
+                current.update(self._conn.execute(
+                    f"SELECT id, metadata FROM items WHERE id IN ({marks})", batch))
+            rows = []
+            for id_, meta in zip(ids, metadatas):
+                if id_ not in current:
+                    continue
+                merged = json.loads(current[id_])
+                for key, value in (meta or {}).items():
+                    if value is None:
+                        merged.pop(key, None)
+                    else:
+                        merged[key] = value
+                rows.append((json.dumps(merged, ensure_ascii=False), id_))
+            with self._conn:
+                self._conn.executemany("UPDATE items SET metadata = ? WHERE id = ?", rows)
+            self._touched()
+
+    def delete(self, ids=None, where=None):
+        if ids is None and not where:
+            return
+        with self._lock:
+            rows = self._rows(ids, where)
+            if not rows:
+                return
+            with self._conn:
+                self._conn.executemany("DELETE FROM items WHERE row = ?", [(r,) for r in rows])
+            self._live[rows] = False
+            self._free.extend(rows)
+            self._free.sort(reverse=True)
+            self._count -= len(rows)
+            self._touched()
+
+    # ---- 読み出し ----
+
+    def get(self, ids=None, where=None, limit=None, offset=None, include=("documents", "metadatas")):
+        cond, params = where_to_sql(where) if where else ("1", [])
+        with self._lock:
+            if ids is None:
+                found = self._conn.execute(
+                    f"SELECT id, row, document, metadata FROM items WHERE {cond}"
+                    " ORDER BY row LIMIT ? OFFSET ?",
+                    params + [-1 if limit is None else limit, offset or 0],
+                ).fetchall()
+            else:
+                found = []
+                for batch in _chunks(list(ids)):
+                    marks = ",".join("?" * len(batch))
+                    found.extend(self._conn.execute(
+                        f"SELECT id, row, document, metadata FROM items WHERE id IN ({marks}) AND {cond}",
+                        batch + params))
+                found = found[offset or 0:]
+                if limit is not None:
+                    found = found[:limit]
+            vecs = (np.asarray(self._vecs[[r for _, r, _, _ in found]])
+                    if "embeddings" in include and found else None)
+        return {
+            "ids": [id_ for id_, _, _, _ in found],
+            "documents": [doc for _, _, doc, _ in found] if "documents" in include else None,
+            "metadatas": [json.loads(meta) for _, _, _, meta in found] if "metadatas" in include else None,
+            "embeddings": (vecs if vecs is not None else np.zeros((0, self._dim or 0), np.float32))
+                          if "embeddings" in include else None,
+        }
+
+    @staticmethod
+    def _score(q: np.ndarray, codes, scales, rows: Optional[np.ndarray], n: int) -> np.ndarray:
+        """質問ベクトルと各行の内積（rows=None なら先頭 n 行すべて）。"""
+        # memmap のままだと切り出しのたびに余計な手間がかかるので、ただの ndarray として見る
+        codes = np.asarray(codes)
+        scales = np.asarray(scales) if scales is not None else None
+        total = n if rows is None else len(rows)
+        if rows is None and codes.dtype == np.float32:
+            return q @ codes[:n].T
+        out = np.empty((q.shape[0], total), dtype=np.float32)
+        for s in range(0, total, _SCAN_BLOCK):
+            e = min(total, s + _SCAN_BLOCK)
+            block = codes[s:e] if rows is None else codes[rows[s:e]]
+            if block.dtype != np.float32:
+                block = block.astype(np.float32)
+            out[:, s:e] = q @ block.T
+            if scales is not None:
+                out[:, s:e] *= scales[s:e] if rows is None else scales[rows[s:e]]
+        return out
+
+    def query(self, query_embeddings, n_results=10, where=None, ids=None,
+              include=("documents", "metadatas", "distances")):
+        q = _normalize(np.atleast_2d(np.asarray(query_embeddings, dtype=np.float32)))
+        m = q.shape[0]
+        with self._lock:
+            n = self._n
+            codes, scales = self._codes, self._scales
+            snapshot = self._writes
+            mask = self._mask(where, ids)
+            # 削除で空いた行が無く、絞り込みも無ければ全行が対象
+            allowed = None if mask is None and self._count == n else self._live[:n].copy()
+            n_allowed = self._count
+        if mask is not None:
+            allowed &= mask[:n]
+            n_allowed = int(np.count_nonzero(allowed))
+        k = min(n_results, n_allowed)
+        if k == 0 or codes is None:
+            return {key: [[] for _ in range(m)] for key in ("ids", "documents", "metadatas", "distances")}
+
+        # 対象が全体の半分以上なら全行を計算して落とす、少なければ対象の行だけ集めて計算
+        if n_allowed * 2 >= n:
+            scores = self._score(q, codes, scales, None, n)
+            if allowed is not None:
+                scores[:, ~allowed] = -np.inf
+            cand_rows = None
+        else:
+            cand_rows = np.flatnonzero(allowed)
+            scores = self._score(q, codes, scales, cand_rows, n)
+        quantized = codes.dtype != np.float32
+        c = min(k * self.rescore if quantized else k, scores.shape[1])
+        width = scores.shape[1]
+        top = np.argpartition(scores, width - c, axis=1)[:, width - c:] if c < width \
+            else np.tile(np.arange(width), (m, 1))
+        top_rows = top if cand_rows is None else cand_rows[top]
+        if quantized:
+            # 候補だけ float32 で採点し直す（対象外で候補に入った行は対象外のまま）
+            exact = np.einsum("md,mcd->mc", q, self._read_vectors(top_rows))
+            exact[np.isneginf(np.take_along_axis(scores, top, axis=1))] = -np.inf
+        else:
+            exact = np.take_along_axis(scores, top, axis=1)
+        order = np.argsort(-exact, axis=1)[:, :k]
+        best_rows = np.take_along_axis(top_rows, order, axis=1)
+        best_sims = np.take_along_axis(exact, order, axis=1)
+
+        with self._lock:
+            wanted = sorted({int(r) for r in best_rows.ravel()})
+            items: Dict[int, tuple] = {}
+            for batch in _chunks(wanted):
+                marks = ",".join("?" * len(batch))
+                for row, id_, doc, meta in self._conn.execute(
+                        f"SELECT row, id, document, metadata FROM items WHERE row IN ({marks})", batch):
+                    # 計算を始めた後に書き換えられた行（削除後の使い回し）は出さない
+                    if self._written_at[row] <= snapshot:
+                        items[row] = (id_, doc, meta)
+
+        out = {"ids": [], "documents": [], "metadatas": [], "distances": []}
+        for i in range(m):
+            hits = [(items[int(r)], float(s)) for r, s in zip(best_rows[i], best_sims[i]) if int(r) in items]
+            out["ids"].append([item[0] for item, _ in hits])
+            out["documents"].append([item[1] for item, _ in hits])
+            out["metadatas"].append([json.loads(item[2]) for item, _ in hits])
+            out["distances"].append([1.0 - s for _, s in hits])
+        return out
+
+    def count(self) -> int:
+        return self._count
+
+    def stats(self) -> dict:
+        with self._lock:
+            dim = self._dim or 0
+            scale_bytes = 4 if self.dtype == np.int8 else 0
+            return {
+                "backend": "array",
+                "dtype": self.dtype.name,
+                "rescore": self.rescore,
+                "count": self._count,
+                "rows": self._n,
+                "dim": dim,
+                # 総当たりで毎回読む配列の大きさ（常駐させたいメモリの目安）
+                "scan_bytes": self._n * (dim * self.dtype.itemsize + scale_bytes),
+                "float32_bytes": self._n * dim * 4,
+            }
+
+    def close(self):
+        with self._lock:
+            self._flush_arrays()
+            self._vecs = self._codes = self._scales = None
+            self._conn.close()
+        with self._read_lock:
+            if self._reader is not None:
+                self._reader.close()
+                self._reader = None
+
+class ArrayBackend:
+    """root 直下のフォルダ1つ = インデックス1つ。"""
+
+    kind = "array"
+
+    def __init__(self, root: str, embedding_fn, dtype: str = "float32", rescore: int = 4):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+        self._embed = embedding_fn
+        self.dtype = dtype
+        self.rescore = rescore
+        self._open: Dict[str, ArrayIndex] = {}
+
+    def open(self, name: str) -> ArrayIndex:
+        index = ArrayIndex(os.path.join(self.root, name), name, self._embed, self.dtype, self.rescore)
+        self._open[name] = index
+        return index
+
+    def drop(self, name: str):
+        index = self._open.pop(name, None)
+        if index is not None:
+            index.close()
+        shutil.rmtree(os.path.join(self.root, name), ignore_errors=True)
+
+    def names(self) -> List[str]:
+        return sorted(d for d in os.listdir(self.root) if os.path.isdir(os.path.join(self.root, d)))
@@ -18,13 +18,95 @@ class Settings(BaseSettings):
     max_chars_per_chunk: int = Field(default=1200, alias="MAX_CHARS_PER_CHUNK")
     chunk_overlap_chars: int = Field(default=200, alias="CHUNK_OVERLAP_CHARS")
 
+    # 取り込みパイプライン（0 = CPU コア数）
+    ingest_workers: int = Field(default=0, alias="INGEST_WORKERS")
+    ingest_queue_depth: int = Field(default=64, alias="INGEST_QUEUE_DEPTH")
+    embed_batch_size: int = Field(default=128, alias="EMBED_BATCH_SIZE")
+    # 同時に走らせる取り込みジョブ数（パスが重なるジョブは常に直列）
+    ingest_max_concurrent_jobs: int = Field(default=1, alias="INGEST_MAX_CONCURRENT_JOBS")
+
+    # フォルダ監視（WATCH_ROOTS はカンマ区切り。空なら DATA_ROOT）
+    watch_enabled: bool = Field(default=False, alias="WATCH_ENABLED")
+    watch_roots: str = Field(default="", alias="WATCH_ROOTS")
+    watch_debounce_ms: int = Field(default=1500, alias="WATCH_DEBOUNCE_MS")
+    watch_force_polling: bool = Field(default=False, alias="WATCH_FORCE_POLLING")
+    watch_poll_interval: float = Field(default=2.0, alias="WATCH_POLL_INTERVAL")
+
+    # /recent-files の対象フォルダ（カンマ区切り。空ならカレントディレクトリ）と走査結果の有効期間
+    recent_roots: str = Field(default="", alias="RECENT_ROOTS")
+    recent_scan_ttl: float = Field(default=30.0, alias="RECENT_SCAN_TTL")
+
+    # 抽出テキストのキャッシュ（/preview 用。先頭 TEXT_CACHE_CHARS 文字を保存）
+    text_cache_max_entries: int = Field(default=5000, alias="TEXT_CACHE_MAX_ENTRIES")
+    text_cache_chars: int = Field(default=4000, alias="TEXT_CACHE_CHARS")
+
+    # 検索モード（vector / lexical / hybrid）の既定値。
+    # モードで score の意味が変わる（vector: コサイン距離 / lexical: BM25 / hybrid: RRF）ので、既定は従来どおり vector
+    search_mode: str = Field(default="vector", alias="SEARCH_MODE")
+    # キーワード検索で、チャンクのこの割合より多くに出る語（ありふれた 2-gram など）は採点しない
+    # （BM25 の重みはほぼ 0 なのに、長い出現リストを読むことになるため）
+    lexical_max_df_ratio: float = Field(default=0.25, alias="LEXICAL_MAX_DF_RATIO")
+
+    # ベクトルインデックス（chroma = Chroma の HNSW / array = NumPy の総当たり。切り替えると中身を写す）
+    vector_backend: str = Field(default="chroma", alias="VECTOR_BACKEND")
+    # array のときに総当たりで使う精度（float32 / float16 / int8）と、
+    # 量子化したときに float32 で採点し直す候補の倍率（k × この値）
+    array_index_dtype: str = Field(default="float32", alias="ARRAY_INDEX_DTYPE")
+    array_index_rescore: int = Field(default=4, alias="ARRAY_INDEX_RESCORE")
+
+    # シャード（root = フォルダごと / ext = 拡張子ごとにコレクションを分ける。空なら分けない）
+    shard_by: str = Field(default="", alias="SHARD_BY")
+    # SHARD_BY=root のフォルダ（カンマ区切り。空なら WATCH_ROOTS、それも空なら DATA_ROOT）
+    shard_roots: str = Field(default="", alias="SHARD_ROOTS")
+    # 検索で同時に問い合わせるシャード数（0 = シャード数）
+    shard_query_workers: int = Field(default=0, alias="SHARD_QUERY_WORKERS")
+
+    # ほぼ重複したチャンクを埋め込まずに別名として保存する（dedup.py）。しきい値は推定 Jaccard 類似度
+    dedup_enabled: bool = Field(default=False, alias="DEDUP_ENABLED")
+    dedup_threshold: float = Field(default=0.9, alias="DEDUP_THRESHOLD")
+
     # 埋め込みモデル
     embed_model: str = Field(default="intfloat/multilingual-e5-small", alias="EMBED_MODEL")
 
+    # 埋め込みサーバ（空ならこのプロセスでモデルを読み込む）。http://host:port か unix:///path
+    embed_server_url: str = Field(default="", alias="EMBED_SERVER_URL")
+    embed_server_timeout: float = Field(default=60.0, alias="EMBED_SERVER_TIMEOUT")
+    # 埋め込みサーバ側のマイクロバッチ（この件数か待ち時間に達したらまとめてモデルに通す）
+    embed_server_max_batch: int = Field(default=256, alias="EMBED_SERVER_MAX_BATCH")
+    embed_server_max_wait_ms: float = Field(default=5.0, alias="EMBED_SERVER_MAX_WAIT_MS")
+
+    # 埋め込みキャッシュ（モデル名 + 本文ハッシュ → ベクトル）
+    embed_cache_enabled: bool = Field(default=True, alias="EMBED_CACHE_ENABLED")
+    embed_cache_dir: str = Field(default=".embed_cache", alias="EMBED_CACHE_DIR")
+    embed_cache_max_entries: int = Field(default=200_000, alias="EMBED_CACHE_MAX_ENTRIES")
+    embed_cache_dtype: str = Field(default="float16", alias="EMBED_CACHE_DTYPE")
+
+    # /chat の回答キャッシュ（類似度 0 = 完全一致のみ）。
+    # 類似度 > 0 なら、質問ベクトルが似ていて検索で得たチャンクの重なり（Jaccard）が MIN_OVERLAP 以上でもヒット
+    answer_cache_enabled: bool = Field(default=True, alias="ANSWER_CACHE_ENABLED")
+    answer_cache_max_entries: int = Field(default=1000, alias="ANSWER_CACHE_MAX_ENTRIES")
+    answer_cache_ttl_seconds: float = Field(default=3600.0, alias="ANSWER_CACHE_TTL_SECONDS")
+    answer_cache_similarity: float = Field(default=0.0, alias="ANSWER_CACHE_SIMILARITY")
+    answer_cache_min_overlap: float = Field(default=0.5, alias="ANSWER_CACHE_MIN_OVERLAP")
+
+    # RAG の文脈組み立て（トークン予算・ほぼ重複とみなす類似度）
+    context_token_budget: int = Field(default=3000, alias="CONTEXT_TOKEN_BUDGET")
+    context_dedup_threshold: float = Field(default=0.9, alias="CONTEXT_DEDUP_THRESHOLD")
+
+    # 計測（/metrics と Server-Timing ヘッダ。false なら計測しない）
+    metrics_enabled: bool = Field(default=True, alias="METRICS_ENABLED")
+
     # LLM（OpenAI 互換）
     llm_base_url: str = Field(default="http://localhost:1234/v1", alias="LLM_BASE_URL")
     llm_api_key: str = Field(default="lm-studio", alias="LLM_API_KEY")
     llm_model: str = Field(default="phi3:mini", alias="LLM_MODEL")
+    llm_max_connections: int = Field(default=32, alias="LLM_MAX_CONNECTIONS")
+    llm_timeout: float = Field(default=120.0, alias="LLM_TIMEOUT")
+    # LLM に同時に投げる数・順番待ちの上限・最初のトークンまでの期限（秒。過ぎそうなら抜粋の回答に切り替える。
+    # 生成が始まった後の上限は LLM_TIMEOUT）
+    llm_max_concurrency: int = Field(default=2, alias="LLM_MAX_CONCURRENCY")
+    llm_max_queue: int = Field(default=32, alias="LLM_MAX_QUEUE")
+    llm_deadline_seconds: float = Field(default=30.0, alias="LLM_DEADLINE_SECONDS")
 
     class Config:
         env_file = ".env"
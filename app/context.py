@@ -0,0 +1,171 @@
+# =============================================
+# context.py
+# ---------------------------------------------
+# RAG プロンプトに入れる「参考文脈」を組み立てる。
+# ・同じファイルの隣り合うチャンクはつなげ、重なり（overlap）部分を1回分にする
+# ・ほぼ同じ内容の文脈は落とす
+# ・関連度順にトークン予算へ詰める（はみ出す分は切る）
+# プロンプトが短いほど、ローカル LLM の prefill（最初のトークンまでの時間）が縮みます。
+# LLM が混んでいて期限に間に合わないときの、LLM を使わない抜粋の回答（extractive_answer）もここ。
+# =============================================
+import os
+import re
+from dataclasses import dataclass
+from typing import Dict, List, Set
+
+from .retrieval import Hit
+
+def estimate_tokens(text: str) -> int:
+    """
+    トークン数のざっくり見積もり（トークナイザ非依存）。
+    日本語などの非 ASCII 文字は 1 文字 ≒ 1 トークン、ASCII は 4 文字 ≒ 1 トークン。
+    """
+    non_ascii = sum(1 for ch in text if ord(ch) > 127)
+    return non_ascii + (len(text) - non_ascii + 3) // 4
+
+def _merge_overlap(a: str, b: str, max_overlap: int) -> str:
+    """a の末尾と b の先頭が重なっていれば、重なりを1回分にしてつなぐ。"""
+    limit = min(len(a), len(b), max_overlap)
+    for ov in range(limit, 0, -1):
+        if a.endswith(b[:ov]):
+            return a + b[ov:]
+    return a + "\n" + b
+
+def _shingles(text: str, n: int = 4) -> Set[str]:
+    text = "".join(text.split())
+    if len(text) <= n:
+        return {text}
+    return {text[i:i + n] for i in range(len(text) - n + 1)}
+
+def _jaccard(a: Set[str], b: Set[str]) -> float:
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+@dataclass
+class _Passage:
+    path: str
+    rank: int          # 含まれるチャンクの最上位の順位（小さいほど関連度が高い）
+    last_index: int
+    text: str
+
+@dataclass
+class PackedContext:
+    contexts: List[str]
+    raw_tokens_est: int      # 検索結果をそのまま渡した場合の見積もり
+    packed_tokens_est: int   # 組み立て後の見積もり
+
+    @property
+    def tokens_saved_est(self) -> int:
+        return max(0, self.raw_tokens_est - self.packed_tokens_est)
+
+def pack_contexts(hits: List[Hit], token_budget: int, max_overlap: int,
+                  dedup_threshold: float = 0.9) -> PackedContext:
+    """検索結果（関連度順）から、重複を除いて予算内に収めた文脈リストを作る。"""
+    raw_tokens = sum(estimate_tokens(h.document) for h in hits)
+
+    # 1) ファイルごとにまとめ、チャンク番号順に並べて隣接チャンクをつなぐ
+    by_path: Dict[str, List[tuple]] = {}
+    for rank, hit in enumerate(hits):
+        path = hit.metadata.get("path", "")
+        index = int(hit.metadata.get("chunk_index", -1))
+        by_path.setdefault(path, []).append((index, rank, hit.document))
+
+    passages: List[_Passage] = []
+    for path, items in by_path.items():
+        items.sort()
+        current = None
+        for index, rank, text in items:
+            if current is not None and index >= 0 and index == current.last_index + 1:
+                current.text = _merge_overlap(current.text, text, max_overlap)
+                current.last_index = index
+                current.rank = min(current.rank, rank)
+            elif current is not None and index == current.last_index:
+                continue  # 同じチャンクが重複して来た
+            else:
+                current = _Passage(path=path, rank=rank, last_index=index, text=text)
+                passages.append(current)
+
+    # 2) 関連度順に並べ、ほぼ同じ内容の文脈を落とす
+    passages.sort(key=lambda p: p.rank)
+    kept: List[_Passage] = []
+    kept_shingles: List[Set[str]] = []
+    for p in passages:
+        sh = _shingles(p.text)
+        if any(_jaccard(sh, other) >= dedup_threshold for other in kept_shingles):
+            continue
+        kept.append(p)
+        kept_shingles.append(sh)
+
+    # 3) トークン予算に詰める（最後の1件ははみ出す分だけ切る）
+    contexts: List[str] = []
+    used = 0
+    for p in kept:
+        cost = estimate_tokens(p.text)
+        if used + cost <= token_budget:
+            contexts.append(p.text)
+            used += cost
+            continue
+        remaining = token_budget - used
+        if remaining >= 50:
+            # 予算に収まる長さまで切り詰める（見積もりは文字種で変わるので少しずつ）
+            cut = p.text
+            while cut and estimate_tokens(cut) > remaining:
+                cut = cut[: len(cut) * remaining // estimate_tokens(cut)]
+            if cut:
+                contexts.append(cut)
+                used += estimate_tokens(cut)
+        break
+
+    return PackedContext(contexts=contexts, raw_tokens_est=raw_tokens, packed_tokens_est=used)
+
+# 文の区切り（句点・疑問符・感嘆符・改行）
+_SENTENCE_RE = re.compile(r"[^。．！？!?\n]+[。．！？!?]?")
+
+# 抜粋の回答の前置き（LLM を使えなかった理由ごと。llm_scheduler.LLMUnavailable.reason）
+_EXTRACTIVE_HEADERS = {
+    "queue_full": "LLM への問い合わせが混み合っているため、関連する文書の該当箇所を抜粋してお伝えします。",
+    "deadline": "LLM の回答が期限内に始まらなかったため、関連する文書の該当箇所を抜粋してお伝えします。",
+    "error": "LLM に問い合わせできなかったため、関連する文書の該当箇所を抜粋してお伝えします。",
+}
+
+def extractive_answer(query: str, hits: List[Hit], reason: str = "deadline",
+                      max_sentences: int = 3, max_chars: int = 400) -> str:
+    """
+    LLM を使わない抜粋の回答（LLM の順番待ちが期限に間に合わない・LLM に問い合わせできないとき）。
+    上位チャンクの文から、質問の文字 2-gram を多く含むもの（同点なら上位のチャンク）を選び、
+    チャンクの順位・文の出現順に並べて出典のファイル名を添える。
+    重なったチャンク・重複した文書から来た同じ文（ほぼ同じ文）は1回だけ使う。
+    """
+    q = _shingles(query, 2)
+    candidates = []  # (スコア, 順位, 文の位置, 文, パス)
+    for rank, hit in enumerate(hits):
+        for pos, m in enumerate(_SENTENCE_RE.finditer(hit.document)):
+            sentence = " ".join(m.group().split())
+            if len(sentence) < 8:
+                continue
+            overlap = len(q & _shingles(sentence, 2)) / max(1, len(q))
+            candidates.append((overlap - 0.02 * rank, rank, pos, sentence, hit.metadata.get("path", "")))
+    if not candidates:
+        return "手元の文書からは断定できません。"
+    picked = []
+    picked_shingles: List[Set[str]] = []
+    for c in sorted(candidates, key=lambda c: -c[0]):
+        sh = _shingles(c[3])
+        if any(_jaccard(sh, other) >= 0.9 for other in picked_shingles):
+            continue
+        picked.append(c)
+        picked_shingles.append(sh)
+        if len(picked) >= max_sentences:
+            break
+    picked.sort(key=lambda c: (c[1], c[2]))
+    lines: List[str] = []
+    used = 0
+    for _, _, _, sentence, path in picked:
+        if used + len(sentence) > max_chars:
+            sentence = sentence[:max(0, max_chars - used)] + "…"
+        lines.append(f"・{sentence}（{os.path.basename(path)}）")
+        used += len(sentence)
+        if used >= max_chars:
+            break
+    return _EXTRACTIVE_HEADERS.get(reason, _EXTRACTIVE_HEADERS["deadline"]) + "\n" + "\n".join(lines)
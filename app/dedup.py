@@ -0,0 +1,318 @@
+# =============================================
+# dedup.py
+# ---------------------------------------------
+# ほぼ重複したチャンクの検出（DEDUP_ENABLED）。
+# 共有フォルダには同じ文書のコピーや小さな改訂版（_v2・最終版・最終版(2) …）が多く、
+# そのまま取り込むと同じ内容を何度も埋め込み、検索の上位 k 件も同じ内容で埋まる。
+# ・チャンクの文字 5-gram から MinHash の署名（64 個）を作り、LSH（16 帯 × 4 行）で候補を引く。
+#   推定 Jaccard 類似度が DEDUP_THRESHOLD 以上の既存チャンク（同じシャード・別ファイル）があれば、
+#   新しいチャンクは埋め込まずに「別名」としてここに保存する（ベクトルインデックスには入れない）
+# ・代表（ベクトルインデックスにあるチャンク）を消すときは、残っている別名の1つを代表に昇格させる。
+#   昇格したチャンクは元の代表のベクトルを使い回す（埋め込み直さない。ingest.py）
+# ・検索結果は重複のまとまり（クラスタ）ごとに1件にまとめ、ほかのコピーのパスを添える（retrieval.py）
+# ※ 同じファイルの中のチャンク同士は別名にしない（更新で旧版を消したときに昇格が連鎖しないように）。
+# =============================================
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import unicodedata
+from typing import Dict, Iterable, List, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+
+from .config import settings
+
+_NUM_PERM = 64          # 署名の長さ
+_BANDS = 16             # LSH の帯の数（1帯 = 4 行。類似度 0.5 で約 6 割、0.8 以上ならほぼ確実に候補になる）
+_SHINGLE = 5            # 文字 n-gram の長さ
+_MIN_CHARS = 64         # これより短いチャンクは比べない（見出しだけのチャンクなどが別名になりやすい）
+_PRIME = (1 << 31) - 1
+_SQL_BATCH = 500
+
+_SPACE_RE = re.compile(r"\s+")
+
+class Promotion(NamedTuple):
+    """代表を消したときに、代わりに代表になった別名。"""
+    old: str            # 消した代表の ID（このベクトルを使い回す）
+    new: str            # 昇格した別名の ID
+    document: str
+    metadata: dict
+
+def _normalize(text: str) -> str:
+    return _SPACE_RE.sub(" ", unicodedata.normalize("NFKC", text).lower()).strip()
+
+def _chunks(items: list) -> Iterable[list]:
+    for s in range(0, len(items), _SQL_BATCH):
+        yield items[s:s + _SQL_BATCH]
+
+class DuplicateIndex:
+    """MinHash + LSH によるほぼ重複チャンクの索引と、別名（埋め込まずに保存したチャンク）。スレッドセーフ。"""
+
+    def __init__(self, db_path: str, threshold: float):
+        parent = os.path.dirname(db_path)
+        if parent:
+            os.makedirs(parent, exist_ok=True)
+        self.threshold = threshold
+        rng = np.random.RandomState(20240601)   # 署名の計算方法は保存した署名と揃っている必要がある
+        self._a = rng.randint(1, _PRIME, size=_NUM_PERM).astype(np.uint64)
+        self._b = rng.randint(0, _PRIME, size=_NUM_PERM).astype(np.uint64)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        with self._conn:
+            # canonical: 代表の ID（代表自身は自分の ID）。document / metadata は別名のときだけ持つ
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS chunks ("
+                " id TEXT PRIMARY KEY,"
+                " shard TEXT NOT NULL,"
+                " canonical TEXT NOT NULL,"
+                " alias INTEGER NOT NULL,"
+                " path TEXT NOT NULL,"
+                " sig BLOB NOT NULL,"
+                " document TEXT,"
+                " metadata TEXT)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS chunks_canonical ON chunks(canonical)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS chunks_path ON chunks(path)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS chunks_alias ON chunks(alias, shard)")
+            # LSH の帯（代表だけを登録する）
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS bands (shard TEXT NOT NULL, band INTEGER NOT NULL,"
+                " hash INTEGER NOT NULL, id TEXT NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS bands_key ON bands(shard, band, hash)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS bands_id ON bands(id)")
+        self._n_aliases = self._count_aliases()
+
+    # ---- 署名 ----
+
+    def signature(self, text: str) -> Optional[np.ndarray]:
+        """MinHash 署名（uint32 × 64）。短すぎるチャンクは None。"""
+        norm = _normalize(text)
+        if len(norm) < _MIN_CHARS:
+            return None
+        cps = np.frombuffer(norm.encode("utf-32-le"), dtype=np.uint32).astype(np.uint64)
+        n = len(cps) - _SHINGLE + 1
+        # 文字 n-gram の多項式ハッシュ（uint64 で桁あふれさせたまま）
+        h = np.zeros(n, dtype=np.uint64)
+        for j in range(_SHINGLE):
+            h = h * np.uint64(1000003) + cps[j:j + n]
+        h = np.unique(h % np.uint64(_PRIME))
+        return ((self._a[:, None] * h[None, :] + self._b[:, None]) % np.uint64(_PRIME)).min(axis=1).astype(np.uint32)
+
+    @staticmethod
+    def _band_hashes(sig: np.ndarray) -> List[int]:
+        rows = sig.reshape(_BANDS, -1)
+        return [int.from_bytes(hashlib.blake2b(r.tobytes(), digest_size=8).digest(), "little", signed=True)
+                for r in rows]
+
+    @staticmethod
+    def similarity(a: np.ndarray, b: np.ndarray) -> float:
+        """署名から推定した Jaccard 類似度。"""
+        return float(np.count_nonzero(a == b)) / len(a)
+
+    # ---- 取り込み ----
+
+    def plan(self, ids: List[str], documents: List[str], paths: List[str],
+             shards: List[str]) -> Tuple[List[Optional[str]], List[Optional[np.ndarray]]]:
+        """
+        チャンクごとに「別名にする代表の ID（None なら自分が代表）」と署名を返す（まだ登録はしない）。
+        同じバッチの中で先に出てきたチャンクも代表の候補にする。
+        すでに代表として登録されているチャンク（同じ ID の書き直し）は代表のまま。
+        """
+        sigs = [self.signature(doc or "") for doc in documents]
+        canon: List[Optional[str]] = [None] * len(ids)
+        with self._lock:
+            current = self._rows(ids, "id, alias")
+            # このバッチで代表になったもの: (shard, band, hash) → [index]
+            local: Dict[tuple, List[int]] = {}
+            for i, sig in enumerate(sigs):
+                if sig is None:
+                    continue
+                bands = self._band_hashes(sig)
+                if current.get(ids[i], (None, 1))[1] == 0:
+                    pass  # 代表のまま
+                else:
+                    best, best_sim = None, self.threshold
+                    for cid, (cpath, csig) in self._candidates(shards[i], bands).items():
+                        if cpath == paths[i] or cid == ids[i]:
+                            continue
+                        sim = self.similarity(sig, csig)
+                        if sim >= best_sim:
+                            best, best_sim = cid, sim
+                    for b, h in enumerate(bands):
+                        for j in local.get((shards[i], b, h), ()):
+                            if paths[j] == paths[i]:
+                                continue
+                            sim = self.similarity(sig, sigs[j])
+                            if sim >= best_sim:
+                                best, best_sim = ids[j], sim
+                    canon[i] = best
+                if canon[i] is None:
+                    for b, h in enumerate(bands):
+                        local.setdefault((shards[i], b, h), []).append(i)
+        return canon, sigs
+
+    def _rows(self, ids: List[str], columns: str) -> Dict[str, tuple]:
+        # ロック内で呼ぶ
+        out: Dict[str, tuple] = {}
+        for batch in _chunks(list(ids)):
+            marks = ",".join("?" * len(batch))
+            for row in self._conn.execute(f"SELECT {columns} FROM chunks WHERE id IN ({marks})", batch):
+                out[row[0]] = row
+        return out
+
+    def _candidates(self, shard: str, bands: List[int]) -> Dict[str, Tuple[str, np.ndarray]]:
+        # ロック内で呼ぶ。帯が1つでも一致した代表 → (パス, 署名)
+        found = set()
+        for b, h in enumerate(bands):
+            found.update(r[0] for r in self._conn.execute(
+                "SELECT id FROM bands WHERE shard = ? AND band = ? AND hash = ?", (shard, b, h)))
+        if not found:
+            return {}
+        return {id_: (path, np.frombuffer(sig, dtype=np.uint32))
+                for id_, path, sig in self._rows(list(found), "id, path, sig").values()}
+
+    def commit(self, ids: List[str], documents: List[str], metadatas: List[dict], shards: List[str],
+               canon: List[Optional[str]], sigs: List[Optional[np.ndarray]]):
+        """plan() の結果を登録する（代表はベクトルインデックスへの書き込みが済んでから）。"""
+        rows, bands, stale = [], [], []
+        for i, id_ in enumerate(ids):
+            sig = sigs[i]
+            if sig is None:
+                stale.append(id_)
+                continue
+            path = metadatas[i].get("path", "")
+            if canon[i] is None:
+                rows.append((id_, shards[i], id_, 0, path, sig.tobytes(), None, None))
+                bands.extend((shards[i], b, h, id_) for b, h in enumerate(self._band_hashes(sig)))
+            else:
+                rows.append((id_, shards[i], canon[i], 1, path, sig.tobytes(), documents[i],
+                             json.dumps(metadatas[i], ensure_ascii=False)))
+        with self._lock, self._conn:
+            # 書き直すチャンクの古い帯・短くなって比べなくなったチャンクは消す
+            for batch in _chunks(ids):
+                marks = ",".join("?" * len(batch))
+                self._conn.execute(f"DELETE FROM bands WHERE id IN ({marks})", batch)
+            for batch in _chunks(stale):
+                marks = ",".join("?" * len(batch))
+                self._conn.execute(f"DELETE FROM chunks WHERE id IN ({marks})", batch)
+            self._conn.executemany("INSERT OR REPLACE INTO chunks VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+            self._conn.executemany("INSERT INTO bands VALUES (?, ?, ?, ?)", bands)
+            self._n_aliases = self._count_aliases()
+
+    def unalias(self, ids: List[str]):
+        """別名だったチャンクがベクトルインデックスに書かれた（重複検出を切って取り込み直した）ので別名から外す。"""
+        if not self._n_aliases:
+            return
+        with self._lock, self._conn:
+            for batch in _chunks(list(ids)):
+                marks = ",".join("?" * len(batch))
+                self._conn.execute(f"DELETE FROM chunks WHERE alias = 1 AND id IN ({marks})", batch)
+            self._n_aliases = self._count_aliases()
+
+    # ---- 削除 ----
+
+    def remove(self, ids: Sequence[str]) -> List[Promotion]:
+        """
+        チャンクを索引から消す。消す代表に（消さない）別名が残っていれば、1つを代表に昇格させて返す
+        （呼び出し側が、元の代表のベクトルで昇格したチャンクをベクトルインデックスに書く）。
+        """
+        doomed = set(ids)
+        if not doomed:
+            return []
+        promotions: List[Promotion] = []
+        with self._lock, self._conn:
+            rows = self._rows(list(doomed), "id, alias")
+            for id_, alias in rows.values():
+                if alias:
+                    continue
+                survivors = [r for r in self._conn.execute(
+                    "SELECT id, sig, document, metadata, shard FROM chunks"
+                    " WHERE canonical = ? AND alias = 1 ORDER BY rowid", (id_,)) if r[0] not in doomed]
+                if not survivors:
+                    continue
+                new, sig, doc, meta, shard = survivors[0]
+                self._conn.execute("UPDATE chunks SET canonical = ? WHERE canonical = ?", (new, id_))
+                self._conn.execute(
+                    "UPDATE chunks SET alias = 0, document = NULL, metadata = NULL WHERE id = ?", (new,))
+                self._conn.executemany(
+                    "INSERT INTO bands VALUES (?, ?, ?, ?)",
+                    [(shard, b, h, new) for b, h in enumerate(self._band_hashes(np.frombuffer(sig, np.uint32)))])
+                promotions.append(Promotion(id_, new, doc or "", json.loads(meta or "{}")))
+            for batch in _chunks(list(doomed)):
+                marks = ",".join("?" * len(batch))
+                self._conn.execute(f"DELETE FROM bands WHERE id IN ({marks})", batch)
+                self._conn.execute(f"DELETE FROM chunks WHERE id IN ({marks})", batch)
+            self._n_aliases = self._count_aliases()
+        return promotions
+
+    def ids_for_path(self, path: str) -> List[str]:
+        with self._lock:
+            return [r[0] for r in self._conn.execute("SELECT id FROM chunks WHERE path = ?", (path,))]
+
+    def rename(self, old: str, new: str, meta: dict):
+        """パスの付け替え。別名のメタデータにも meta（path / mtime / 祖先フォルダ）を反映する。"""
+        with self._lock, self._conn:
+            rows = self._conn.execute(
+                "SELECT id, metadata FROM chunks WHERE path = ? AND alias = 1", (old,)).fetchall()
+            self._conn.executemany(
+                "UPDATE chunks SET metadata = ? WHERE id = ?",
+                [(json.dumps({k: v for k, v in dict(json.loads(m or "{}"), **meta).items() if v is not None},
+                             ensure_ascii=False), id_) for id_, m in rows])
+            self._conn.execute("UPDATE chunks SET path = ? WHERE path = ?", (new, old))
+
+    def clear_shard(self, shard: str):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM bands WHERE shard = ?", (shard,))
+            self._conn.execute("DELETE FROM chunks WHERE shard = ?", (shard,))
+            self._n_aliases = self._count_aliases()
+
+    def clear(self):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM bands")
+            self._conn.execute("DELETE FROM chunks")
+            self._n_aliases = 0
+
+    # ---- 検索 ----
+
+    def active(self) -> bool:
+        """別名が1つでもあるか（無ければ検索側は何もしなくてよい）。"""
+        return self._n_aliases > 0
+
+    def resolve(self, ids: Sequence[str]) -> Dict[str, Tuple[str, str, dict]]:
+        """別名の ID → (代表の ID, 本文, メタデータ)。代表・未登録の ID は含まない。"""
+        if not self._n_aliases or not ids:
+            return {}
+        with self._lock:
+            rows = self._rows(list(ids), "id, canonical, alias, document, metadata")
+        return {id_: (c, doc or "", json.loads(meta or "{}"))
+                for id_, c, alias, doc, meta in rows.values() if alias}
+
+    def cluster_paths(self, canonicals: Sequence[str]) -> Dict[str, List[str]]:
+        """代表の ID → そのクラスタのパス（代表・別名すべて）。"""
+        if not self._n_aliases or not canonicals:
+            return {}
+        out: Dict[str, List[str]] = {}
+        with self._lock:
+            for batch in _chunks(list(set(canonicals))):
+                marks = ",".join("?" * len(batch))
+                for c, path in self._conn.execute(
+                        f"SELECT canonical, path FROM chunks WHERE canonical IN ({marks}) ORDER BY rowid", batch):
+                    out.setdefault(c, []).append(path)
+        return out
+
+    def _count_aliases(self) -> int:
+        return self._conn.execute("SELECT COUNT(*) FROM chunks WHERE alias = 1").fetchone()[0]
+
+    def stats(self) -> dict:
+        with self._lock:
+            canonicals = self._conn.execute("SELECT COUNT(*) FROM chunks WHERE alias = 0").fetchone()[0]
+            return {"enabled": settings.dedup_enabled, "threshold": self.threshold,
+                    "canonical_chunks": canonicals, "alias_chunks": self._n_aliases}
+
+# アプリ全体で共有する重複索引（Chroma の保存先に並べて置く）
+duplicate_index = DuplicateIndex(os.path.join(settings.chroma_dir, "k9_dedup.sqlite3"), settings.dedup_threshold)
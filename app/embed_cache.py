@@ -0,0 +1,237 @@
+# =============================================
+# embed_cache.py
+# ---------------------------------------------
+# 埋め込みベクトルのディスクキャッシュ（内容アドレス方式）。
+# ・キー: (埋め込みモデル名, チャンク本文の SHA-256)
+# ・ベクトル: メモリマップした float16/float32 の2次元配列（1行 = 1件）
+# ・索引: SQLite（キー → 行番号, 最終利用時刻）
+# ・件数上限を超えたら LRU（最も長く使われていないもの）から追い出す
+# ・参照のたびには SQLite に書かない。最終利用時刻はメモリに貯め、_TOUCH_FLUSH_EVERY 件ごと・
+#   登録（追い出し）時・close() 時にまとめて書く（落ちたときに失うのは並び順の一部だけ）
+# ・1つのキャッシュディレクトリを書き込めるのは1プロセスだけ。開くときにロックファイルを取り、
+#   取れなければ CacheInUse を送出する（uvicorn --workers N では最初の1つだけがキャッシュを使う）
+# ・追い出した行を使い回すときは、先に索引から外してコミットしてから上書きする
+#   （途中で落ちても、索引が別の本文のベクトルを指したままにならない。外れた行は次の起動で空き扱い）
+# =============================================
+import hashlib
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+# 最終利用時刻をまとめて書き込む件数
+_TOUCH_FLUSH_EVERY = 1024
+
+class CacheInUse(RuntimeError):
+    """ほかのプロセスが同じキャッシュディレクトリを開いている。"""
+
+def _lock_exclusive(path: str):
+    """ロックファイルを排他で取る（取れなければ CacheInUse）。閉じるまで持ち続けるファイルを返す。"""
+    f = open(path, "a+b")
+    try:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        else:
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+    except OSError:
+        f.close()
+        raise CacheInUse(f"embedding cache is in use by another process: {os.path.dirname(path)}")
+    return f
+
+class EmbeddingCache:
+    """テキストのハッシュ → 埋め込みベクトル の永続 LRU キャッシュ。"""
+
+    def __init__(self, root_dir: str, model_name: str, max_entries: int, dtype: str = "float16"):
+        # モデルごとにディレクトリを分ける（次元もベクトル空間も違うため）
+        model_key = hashlib.sha256(model_name.encode("utf-8")).hexdigest()[:16]
+        self.dir = os.path.join(root_dir, model_key)
+        os.makedirs(self.dir, exist_ok=True)
+        self.max_entries = max(1, max_entries)
+        self._dtype = np.dtype(dtype)
+        self._vec_path = os.path.join(self.dir, f"vectors.{self._dtype.name}")
+        self._lock = threading.Lock()
+        self._lock_file = _lock_exclusive(os.path.join(self.dir, "writer.lock"))
+
+        self._conn = sqlite3.connect(os.path.join(self.dir, "index.sqlite3"), check_same_thread=False)
+        with self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                " key BLOB PRIMARY KEY, slot INTEGER NOT NULL, last_used INTEGER NOT NULL)"
+            )
+            self._conn.execute("CREATE TABLE IF NOT EXISTS meta (k TEXT PRIMARY KEY, v TEXT)")
+            self._conn.execute(
+                "INSERT OR IGNORE INTO meta (k, v) VALUES ('model', ?)", (model_name,)
+            )
+
+        row = self._conn.execute("SELECT v FROM meta WHERE k = 'dim'").fetchone()
+        self._dim: Optional[int] = int(row[0]) if row else None
+        self._capacity = 0
+        self._vecs: Optional[np.memmap] = None
+        if self._dim and os.path.exists(self._vec_path):
+            self._open_vectors(os.path.getsize(self._vec_path) // (self._dim * self._dtype.itemsize))
+
+        # 先頭 = 最も古い。末尾 = 最近使った
+        self._lru: "OrderedDict[bytes, int]" = OrderedDict()
+        for key, slot in self._conn.execute("SELECT key, slot FROM entries ORDER BY last_used"):
+            if slot < self._capacity:
+                self._lru[key] = slot
+        # 使っていない行（追い出して外したまま登録されなかった行）と、次に伸ばす行
+        used = set(self._lru.values())
+        self._next_slot = max(used) + 1 if used else 0
+        self._free: List[int] = sorted(set(range(self._next_slot)) - used, reverse=True)
+        row = self._conn.execute("SELECT MAX(last_used) FROM entries").fetchone()
+        self._clock = (row[0] or 0) + 1
+        # まだ書き込んでいない最終利用時刻（キー → 時刻）
+        self._touched: Dict[bytes, int] = {}
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def key_for(text: str) -> bytes:
+        return hashlib.sha256(text.encode("utf-8")).digest()
+
+    # ---- ベクトル配列（メモリマップ） ----
+
+    def _open_vectors(self, capacity: int):
+        if self._vecs is not None:
+            self._vecs.flush()
+            del self._vecs
+        self._vecs = None
+        self._capacity = capacity
+        if capacity > 0:
+            self._vecs = np.memmap(self._vec_path, dtype=self._dtype, mode="r+",
+                                   shape=(capacity, self._dim))
+
+    def _ensure_capacity(self, n_slots: int):
+        if n_slots <= self._capacity:
+            return
+        # 倍々で伸ばす（上限は max_entries）
+        new_cap = min(self.max_entries, max(n_slots, self._capacity * 2, 1024))
+        with open(self._vec_path, "ab") as f:
+            f.truncate(new_cap * self._dim * self._dtype.itemsize)
+        self._open_vectors(new_cap)
+
+    # ---- 参照・登録 ----
+
+    def get_many(self, keys: List[bytes]) -> List[Optional[np.ndarray]]:
+        """キー列に対応するベクトル（なければ None）を返す。"""
+        out: List[Optional[np.ndarray]] = []
+        with self._lock:
+            for key in keys:
+                slot = self._lru.get(key)
+                if slot is None:
+                    out.append(None)
+                    self.misses += 1
+                    continue
+                self._lru.move_to_end(key)
+                out.append(np.array(self._vecs[slot], dtype=np.float32))
+                self._touched[key] = self._clock
+                self._clock += 1
+                self.hits += 1
+            if len(self._touched) >= _TOUCH_FLUSH_EVERY:
+                with self._conn:
+                    self._write_touched()
+        return out
+
+    def put_many(self, keys: List[bytes], vectors: np.ndarray):
+        """ベクトルを登録。満杯なら LRU の行を再利用する。"""
+        if len(keys) == 0:
+            return
+        vectors = np.asarray(vectors)
+        with self._lock:
+            if self._dim is None:
+                self._dim = int(vectors.shape[1])
+                with self._conn:
+                    self._conn.execute("INSERT OR REPLACE INTO meta (k, v) VALUES ('dim', ?)", (str(self._dim),))
+            if vectors.shape[1] != self._dim:
+                raise ValueError(f"embedding dim mismatch: {vectors.shape[1]} != {self._dim}")
+
+            # 1) 行を割り当てる（空き行 → 末尾に伸ばす → LRU を追い出す）
+            rows = []
+            placed = []
+            evicted = []
+            for key, vec in zip(keys, vectors):
+                if key in self._lru:
+                    continue
+                if self._free:
+                    slot = self._free.pop()
+                elif len(self._lru) < self.max_entries:
+                    slot = self._next_slot
+                    self._next_slot += 1
+                    self._ensure_capacity(slot + 1)
+                else:
+                    old_key, slot = self._lru.popitem(last=False)
+                    self._touched.pop(old_key, None)
+                    evicted.append((old_key,))
+                    self.evictions += 1
+                self._lru[key] = slot
+                placed.append((slot, vec))
+                rows.append((key, slot, self._clock))
+                self._clock += 1
+            if not rows:
+                return
+            # 2) 追い出したキーを索引から外してコミット（この後で落ちても古いキーは残らない）
+            with self._conn:
+                self._write_touched()
+                self._conn.executemany("DELETE FROM entries WHERE key = ?", evicted)
+            # 3) ベクトルを書いてディスクに反映してから、4) 新しいキーを登録する
+            for slot, vec in placed:
+                self._vecs[slot] = vec
+            self._vecs.flush()
+            with self._conn:
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO entries (key, slot, last_used) VALUES (?, ?, ?)", rows
+                )
+
+    def _write_touched(self):
+        # ロックとトランザクションの中で呼ぶ
+        if self._touched:
+            self._conn.executemany(
+                "UPDATE entries SET last_used = ? WHERE key = ?",
+                [(clock, key) for key, clock in self._touched.items()],
+            )
+            self._touched.clear()
+
+    def flush(self):
+        """貯めている最終利用時刻を書き込む。"""
+        with self._lock, self._conn:
+            self._write_touched()
+
+    def close(self):
+        """書き残しを書き込んで閉じる（シャットダウン時）。"""
+        with self._lock:
+            with self._conn:
+                self._write_touched()
+            if self._vecs is not None:
+                self._vecs.flush()
+            self._conn.close()
+            self._lock_file.close()  # ロックも外れる
+
+    def round_trip(self, vectors: np.ndarray) -> np.ndarray:
+        """保存精度に丸めたベクトル（キャッシュの有無で結果が変わらないように）。"""
+        return np.asarray(vectors).astype(self._dtype).astype(np.float32)
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._lru),
+                "max_entries": self.max_entries,
+                "dtype": self._dtype.name,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": (self.hits / total) if total else 0.0,
+            }
@@ -0,0 +1,225 @@
+# =============================================
+# embed_server.py
+# ---------------------------------------------
+# 埋め込みサーバ。モデルを1プロセスだけに読み込み、API サーバの各ワーカーから共有する。
+# ・POST /embed {"texts": [...]} → float32（リトルエンディアン）の生バイト列
+#   次元は X-Embedding-Dim ヘッダ。JSON の数値配列より小さく、変換も速い
+# ・マイクロバッチ：数ミリ秒（EMBED_SERVER_MAX_WAIT_MS）のうちに届いた要求を
+#   まとめて1回のモデル呼び出しにする（最大 EMBED_SERVER_MAX_BATCH 件）。
+#   モデルの計算中に届いた要求は、次の1回にまとめて流れる
+# ・1回分の処理で想定外の例外が出ても、その回の要求にエラーを返してバッチ処理は続ける。
+#   それでもバッチ処理が止まっていたら /health は 503 を返す
+# ・埋め込みキャッシュ（embed_cache.py）はこのプロセスが持つ
+#
+#   python -m app.embed_server --port 8100
+#   python -m app.embed_server --uds /tmp/k9-embed.sock
+#   （API 側は EMBED_SERVER_URL=http://127.0.0.1:8100 / unix:///tmp/k9-embed.sock）
+# =============================================
+import argparse
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Tuple
+
+import numpy as np
+from fastapi import FastAPI, HTTPException
+from fastapi.responses import JSONResponse, PlainTextResponse, Response
+from pydantic import BaseModel
+
+from .config import settings
+from .embed_cache import EmbeddingCache
+from .embeddings import CachedEmbeddingFunction, Embedder
+from . import metrics
+from .metrics import EMBED_REQUESTS_PER_BATCH
+
+class EmbedRequest(BaseModel):
+    texts: List[str]
+
+class MicroBatcher:
+    """
+    同時に届いた埋め込み要求を1回の計算にまとめる。
+    計算は専用スレッド1本で順に行う（モデルを同時に呼ばない）。
+    """
+
+    def __init__(self, embed, max_batch: int, max_wait_ms: float):
+        self._embed = embed
+        self.max_batch = max(1, max_batch)
+        self.max_wait = max(0.0, max_wait_ms) / 1000
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="embed-model")
+        self.requests = 0
+        self.batches = 0
+        self.texts = 0
+        self.failures = 0
+        self.last_error: Optional[str] = None
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self):
+        self._queue = asyncio.Queue()
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+        self._executor.shutdown(wait=False)
+
+    async def embed(self, texts: List[str]) -> np.ndarray:
+        if not self.running:
+            # 止まったバッチ処理に積むと、誰も結果を返さないので永久に待つ
+            raise RuntimeError("embedding batcher is not running")
+        future = asyncio.get_running_loop().create_future()
+        self.requests += 1
+        await self._queue.put((texts, future))
+        return await future
+
+    async def _collect(self) -> List[Tuple[List[str], asyncio.Future]]:
+        """最初の1件を待ち、その後 max_wait の間（か max_batch 件まで）に届いた分を集める。"""
+        batch = [await self._queue.get()]
+        n = len(batch[0][0])
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.max_wait
+        while n < self.max_batch:
+            try:
+                item = self._queue.get_nowait()
+            except asyncio.QueueEmpty:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), remaining)
+                except asyncio.TimeoutError:
+                    break
+            batch.append(item)
+            n += len(item[0])
+        return batch
+
+    async def _run(self):
+        while True:
+            batch = await self._collect()
+            try:
+                await self._process(batch)
+            except asyncio.CancelledError:
+                self._fail(batch, RuntimeError("embedding server is shutting down"))
+                raise
+            except Exception as e:
+                # 1回分の失敗（モデルの例外・戻り値の形の違いなど）はその回の要求に返し、次の回へ進む
+                self.failures += 1
+                self.last_error = repr(e)
+                self._fail(batch, e)
+
+    async def _process(self, batch: List[Tuple[List[str], asyncio.Future]]):
+        # 待っている間に切断された要求は計算しない
+        batch = [(texts, f) for texts, f in batch if not f.done()]
+        if not batch:
+            return
+        texts = [t for part, _ in batch for t in part]
+        self.batches += 1
+        self.texts += len(texts)
+        EMBED_REQUESTS_PER_BATCH.observe(len(batch))
+        vectors = await asyncio.get_running_loop().run_in_executor(self._executor, self._embed, texts)
+        vectors = np.asarray(vectors)
+        if vectors.ndim != 2 or len(vectors) != len(texts):
+            raise ValueError(f"embedder returned shape {vectors.shape} for {len(texts)} texts")
+        offset = 0
+        for part, f in batch:
+            if not f.done():
+                f.set_result(vectors[offset:offset + len(part)])
+            offset += len(part)
+
+    @staticmethod
+    def _fail(batch: List[Tuple[List[str], asyncio.Future]], error: BaseException):
+        for _, f in batch:
+            if not f.done():
+                f.set_exception(error)
+
+    def stats(self) -> dict:
+        return {
+            "requests": self.requests,
+            "batches": self.batches,
+            "texts": self.texts,
+            "mean_requests_per_batch": (self.requests / self.batches) if self.batches else 0.0,
+            "mean_texts_per_batch": (self.texts / self.batches) if self.batches else 0.0,
+            "max_batch": self.max_batch,
+            "max_wait_ms": self.max_wait * 1000,
+            "running": self.running,
+            "failures": self.failures,
+            "last_error": self.last_error,
+        }
+
+def create_app() -> FastAPI:
+    embedder = Embedder(settings.embed_model)
+    cache = (
+        EmbeddingCache(settings.embed_cache_dir, settings.embed_model,
+                       settings.embed_cache_max_entries, settings.embed_cache_dtype)
+        if settings.embed_cache_enabled else None
+    )
+    embed_fn = CachedEmbeddingFunction(embedder, cache)
+    batcher = MicroBatcher(embed_fn.embed_array, settings.embed_server_max_batch,
+                           settings.embed_server_max_wait_ms)
+    app = FastAPI(title="K-nine Embedding Server")
+
+    @app.on_event("startup")
+    async def _startup():
+        # モデルは起動時に読み込んで温めておく（専用サーバなので待ってよい）
+        await asyncio.get_running_loop().run_in_executor(None, embedder.load)
+        batcher.start()
+
+    @app.on_event("shutdown")
+    async def _shutdown():
+        await batcher.stop()
+        if cache is not None:
+            cache.close()
+
+    @app.get("/health")
+    def health():
+        if not batcher.running:
+            # バッチ処理が止まっている（/embed は受け付けられない）
+            return JSONResponse(status_code=503, content={
+                "status": "error", "model": settings.embed_model, "state": embedder.state,
+                "detail": "embedding batcher is not running", "last_error": batcher.last_error,
+            })
+        return {"status": "ok", "model": settings.embed_model, "state": embedder.state}
+
+    @app.post("/embed")
+    async def embed(req: EmbedRequest):
+        if not req.texts:
+            raise HTTPException(status_code=400, detail="texts is empty")
+        try:
+            vectors = await batcher.embed(req.texts)
+        except RuntimeError as e:
+            if batcher.running:
+                raise
+            raise HTTPException(status_code=503, detail=str(e))
+        vectors = np.ascontiguousarray(vectors, dtype="<f4")
+        return Response(content=vectors.tobytes(), media_type="application/octet-stream",
+                        headers={"X-Embedding-Dim": str(vectors.shape[1])})
+
+    @app.get("/stats")
+    def stats():
+        return {
+            "model": settings.embed_model,
+            "embedder": embedder.status(),
+            "batching": batcher.stats(),
+            "embed_cache": cache.stats() if cache is not None else None,
+        }
+
+    @app.get("/metrics", response_class=PlainTextResponse)
+    def metrics_endpoint():
+        return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+    return app
+
+def main():
+    import uvicorn
+    p = argparse.ArgumentParser(description="K-nine 埋め込みサーバ（マイクロバッチ）")
+    p.add_argument("--host", default="127.0.0.1")
+    p.add_argument("--port", type=int, default=8100)
+    p.add_argument("--uds", help="TCP の代わりに UNIX ドメインソケットで待ち受ける")
+    a = p.parse_args()
+    uvicorn.run(create_app(), host=a.host, port=a.port, uds=a.uds, log_level="warning")
+
+if __name__ == "__main__":
+    main()
@@ -3,21 +3,171 @@
 # ---------------------------------------------
 # Sentence-Transformers を使ってテキストをベクトル化するラッパ。
 # Chroma に差し込める「embedding_function」も用意します。
+# ・埋め込みキャッシュ（embed_cache.py）があれば、モデルより先に参照します。
+# ・モデル（と sentence-transformers / torch の import）は初回の利用か load() まで遅らせる
+#   （サーバの起動を待たせない。読み込みは main.py の startup から裏で始める）
+# ・EMBED_SERVER_URL があれば、モデルは読み込まずに埋め込みサーバ（embed_server.py）へ送る
+#   （RemoteEmbedder。uvicorn --workers N でもモデルは1つで済む）
 # =============================================
-from sentence_transformers import SentenceTransformer
-from chromadb.utils.embedding_functions import EmbeddingFunction
+import threading
+import time
+from typing import Optional
+
+import numpy as np
+
+from .embed_cache import EmbeddingCache
+from .metrics import CACHE_LOOKUPS, EMBED_BATCH_SIZE, TEXTS_EMBEDDED, record_stage, stage
 
 class Embedder:
+    """Sentence-Transformers のモデル。初回の encode（または load()）で読み込む。スレッドセーフ。"""
+
     def __init__(self, model_name: str):
-        self.model = SentenceTransformer(model_name)
+        self.model_name = model_name
+        self._model = None
+        self._lock = threading.Lock()
+        self.state = "pending"   # pending / loading / ready / failed
+        self.load_seconds: Optional[float] = None
+        self.error: Optional[str] = None
+
+    def load(self):
+        """モデルを読み込み、1回推論して温めておく（済んでいれば何もしない）。"""
+        if self._model is not None:
+            return self._model
+        with self._lock:
+            if self._model is None:
+                self.state = "loading"
+                started = time.perf_counter()
+                try:
+                    from sentence_transformers import SentenceTransformer
+                    model = SentenceTransformer(self.model_name)
+                    model.encode(["warmup"], convert_to_numpy=True)
+                except Exception as e:
+                    # 次の利用で読み込み直す
+                    self.state, self.error = "failed", str(e)
+                    raise
+                self.load_seconds = time.perf_counter() - started
+                record_stage("load_embedder", self.load_seconds)
+                self._model, self.state, self.error = model, "ready", None
+        return self._model
+
+    def status(self) -> dict:
+        return {"state": self.state, "model": self.model_name,
+                "load_seconds": self.load_seconds, "error": self.error}
+
+    def encode_array(self, texts: list[str]) -> np.ndarray:
+        model = self.load()
+        EMBED_BATCH_SIZE.observe(len(texts))
+        TEXTS_EMBEDDED.inc(len(texts))
+        with stage("embed"):
+            return np.asarray(model.encode(texts, convert_to_numpy=True), dtype=np.float32)
 
     def encode(self, texts: list[str]):
-        return self.model.encode(texts, convert_to_numpy=True).tolist()
+        return self.encode_array(texts).tolist()
+
+class RemoteEmbedder(Embedder):
+    """
+    埋め込みサーバ（embed_server.py）に計算を任せる Embedder。
+    url は http://host:port か unix:///path/to.sock（同じマシン内ならソケットが速い）。
+    """
+
+    def __init__(self, model_name: str, url: str, timeout: float = 60.0):
+        super().__init__(model_name)
+        self.url = url
+        self.timeout = timeout
+        self._client = None
+
+    def _get_client(self):
+        import httpx
+        if self._client is None:
+            if self.url.startswith("unix://"):
+                transport = httpx.HTTPTransport(uds=self.url[len("unix://"):])
+                self._client = httpx.Client(transport=transport, base_url="http://embed-server",
+                                            timeout=self.timeout)
+            else:
+                self._client = httpx.Client(base_url=self.url.rstrip("/"), timeout=self.timeout)
+        return self._client
+
+    def load(self):
+        """サーバに接続でき、同じモデルを使っているかを確かめる（モデルはこのプロセスに読み込まない）。"""
+        if self.state == "ready":
+            return None
+        with self._lock:
+            if self.state != "ready":
+                self.state = "loading"
+                started = time.perf_counter()
+                try:
+                    info = self._get_client().get("/health").raise_for_status().json()
+                    if info.get("model") != self.model_name:
+                        raise RuntimeError(
+                            f"Embedding server uses {info.get('model')!r}, expected {self.model_name!r}")
+                except Exception as e:
+                    self.state, self.error = "failed", str(e)
+                    raise
+                self.load_seconds = time.perf_counter() - started
+                self.state, self.error = "ready", None
+        return None
 
-class ChromaEmbeddingFunction(EmbeddingFunction):
-    def __init__(self, embedder: Embedder):
+    def status(self) -> dict:
+        return dict(super().status(), server=self.url)
+
+    def encode_array(self, texts: list[str]) -> np.ndarray:
+        self.load()
+        if not texts:
+            return np.zeros((0, 0), dtype=np.float32)
+        with stage("embed_remote"):
+            resp = self._get_client().post("/embed", json={"texts": texts})
+        resp.raise_for_status()
+        dim = int(resp.headers["x-embedding-dim"])
+        return np.frombuffer(resp.content, dtype="<f4").reshape(len(texts), dim)
+
+class CachedEmbeddingFunction:
+    """埋め込みキャッシュ → モデルの順に引く埋め込み関数（検索側からも直接使う）。"""
+
+    def __init__(self, embedder: Embedder, cache: Optional[EmbeddingCache] = None):
         self._embedder = embedder
+        self._cache = cache
 
     def __call__(self, input: list[str]):
-        # ChromaDB が要求する形式 (input 引数) に対応
-        return self._embedder.encode(input)
+        return self.embed_array(input).tolist()
+
+    def embed_array(self, input: list[str]) -> np.ndarray:
+        """(件数, 次元) の float32 配列で返す。"""
+        if not input:
+            return np.zeros((0, 0), dtype=np.float32)
+        if self._cache is None:
+            return self._embedder.encode_array(input)
+
+        keys = [EmbeddingCache.key_for(t) for t in input]
+        vectors = self._cache.get_many(keys)
+
+        # キャッシュにない本文だけ（同一本文は1回だけ）モデルに通す
+        missing: dict = {}
+        for i, (key, vec) in enumerate(zip(keys, vectors)):
+            if vec is None and key not in missing:
+                missing[key] = input[i]
+        hits = len(keys) - sum(1 for v in vectors if v is None)
+        CACHE_LOOKUPS.inc(hits, "embed", "hit")
+        CACHE_LOOKUPS.inc(len(keys) - hits, "embed", "miss")
+        if missing:
+            fresh = self._cache.round_trip(self._embedder.encode_array(list(missing.values())))
+            self._cache.put_many(list(missing.keys()), fresh)
+            by_key = dict(zip(missing.keys(), fresh))
+            vectors = [by_key[k] if v is None else v for k, v in zip(keys, vectors)]
+        return np.stack(vectors).astype(np.float32, copy=False)
+
+def chroma_embedding_function(fn: CachedEmbeddingFunction):
+    """
+    Chroma に渡す embedding_function（EmbeddingFunction の派生）に包む。
+    chromadb の import は重いので、コレクションを開くときまで遅らせる。
+    """
+    from chromadb.utils.embedding_functions import EmbeddingFunction
+
+    class ChromaEmbeddingFunction(EmbeddingFunction):
+        def __init__(self):
+            pass
+
+        def __call__(self, input: list[str]):
+            # ChromaDB が要求する形式 (input 引数) に対応
+            return fn(input)
+
+    return ChromaEmbeddingFunction()
@@ -3,174 +3,639 @@
 # ---------------------------------------------
 # 文書の「取り込み」を担当。
 # 1) テキスト抽出 → 2) チャンク化 → 3) ベクトル化 → 4) Chroma へ追加
-# ※ デモ簡略化のため、変更検知は「毎回差し替え」にしています。
+# ・マニフェスト（manifest.py）で変更検知し、変化のないファイルはスキップ
+# ・1) 2) はワーカープロセスで並列化（pipeline.py）、3) 4) はここでバッチ処理
+# ・走査は os.scandir。サイズ・mtime はディレクトリの読み出し結果から取る（ファイルごとに
+#   stat しに行かない。Windows・ネットワークドライブで効く）。ファイルの中身は前処理で1回だけ読む
+# ・台帳は Chroma への書き込み・削除が成功した後に更新する（台帳にあるものは Chroma にもある）
+# ・削除・リネームは書き込みロック、書き込みは読み取りロックの中で行う（vectorstore.index_lock）
+# ・チャンクは path でシャードに振り分けられる（shards.py）。path の分かる削除はそのシャードだけで行う
+# ・DEDUP_ENABLED なら、ほぼ重複したチャンクは埋め込まずに別名として保存する（dedup.py）。
+#   チャンクの削除は _delete_chunks を通す（代表を消すときに別名を昇格させる）
 # =============================================
-import os, time, hashlib
-from typing import List, Tuple
+import os, time, hashlib, threading
+from dataclasses import dataclass, field
+from typing import Dict, Iterator, List, Optional, Tuple
 
 from .config import settings
-from .parsers import load_text_from_file, SUPPORTED_EXTS
-from .vectorstore import get_collection
-
-def chunk_text(text: str, max_chars: int, overlap: int) -> List[str]:
-    """
-    文字数ベースの安全なチャンク分割。
-    - 短文（n <= max_chars）は一発で返す
-    - ステップ = max_chars - overlap（ただし最低1）
-    - 末尾に到達したら必ず終了（無限ループ防止）
-    """
-    n = len(text)
-    if n == 0:
-        return []
-    if max_chars <= 0:
-        raise ValueError("max_chars must be > 0")
-
-    # 短文ならそのまま返す
-    if n <= max_chars:
-        return [text]
-
-    # overlap は 0〜max_chars-1 にクランプ
-    overlap = max(0, min(overlap, max_chars - 1))
-    step = max(1, max_chars - overlap)
-
-    chunks: List[str] = []
-    start = 0
-    while start < n:
-        end = min(start + max_chars, n)
-        chunk = text[start:end]
-        if chunk:  # 念のため空文字は除外
-            chunks.append(chunk)
-        if end >= n:
-            break  # 末尾に到達したので終了
-        start += step  # 次の開始位置（必ず前進する）
-    return chunks
+from .parsers import SUPPORTED_EXTS
+from .pipeline import FileTask, iter_prepared
+from .vectorstore import get_collection, get_generations, index_lock, swap_collection
+from .manifest import dir_prefix, manifest, normalize_path, FileRecord
+from .answer_cache import answer_cache
+from .lexical import lexical_index
+from .dedup import duplicate_index
+from .text_cache import text_cache
+from .scope import scope_metadata, stale_scope_keys
+from .metrics import CHUNKS_DEDUPLICATED, CHUNKS_WRITTEN, FILES_INGESTED, WRITE_BATCH_SIZE, record_stage, stage
+
+# チャンクのメタデータ形式のバージョン。上げると既存ファイルも作り直す。
+# 2: 語彙インデックス（lexical.py）を追加
+# 3: PDF のページ番号（page / page_end）を追加
+# 4: スコープ検索用の祖先フォルダ（dir0, dir1, ...）と拡張子（ext）を追加
+INDEX_VERSION = 4
+
+def _id_prefix(path: str, digest: str) -> str:
+    # パスも含めてハッシュ化しないと、別ファイルで同内容の場合にIDが重複する
+    path_digest = hashlib.sha256(path.encode()).hexdigest()[:16]
+    return f"{digest}_{path_digest}"
+
+def _delete_chunks(index, ids: List[str]):
+    """
+    チャンクを ID 指定で消す（index はそのシャードのインデックス）。
+    重複の代表を消すときは、残っている別名を元の代表のベクトルのまま代表に昇格させる。
+    """
+    promotions = duplicate_index.remove(ids)
+    if promotions:
+        data = index.get(ids=[p.old for p in promotions], include=["embeddings"])
+        found = data.get("ids") or []
+        vectors = dict(zip(found, data["embeddings"])) if found else {}
+        reuse = [p for p in promotions if p.old in vectors]
+        if reuse:
+            index.upsert(ids=[p.new for p in reuse], documents=[p.document for p in reuse],
+                         metadatas=[p.metadata for p in reuse], embeddings=[vectors[p.old] for p in reuse])
+        # 代表のベクトルが見つからなければ埋め込み直す
+        embed = [p for p in promotions if p.old not in vectors]
+        if embed:
+            index.upsert(ids=[p.new for p in embed], documents=[p.document for p in embed],
+                         metadatas=[p.metadata for p in embed])
+    index.delete(ids=ids)
 
 def _delete_by_path(path: str):
     """同じパスの既存レコードを削除（差し替えのため）。"""
-    col = get_collection()
     try:
-        col.delete(where={"path": path})
+        index = get_collection().shard_for(path)
+        ids = set(index.get(where={"path": path}, include=[]).get("ids") or [])
+        ids.update(duplicate_index.ids_for_path(path))
+        if ids:
+            _delete_chunks(index, sorted(ids))
     except Exception:
         pass
+    lexical_index.delete_path(path)
 
-def file_hash(path: str) -> str:
-    """変更検知・重複回避用に SHA-256 ハッシュを作る。"""
-    h = hashlib.sha256()
-    with open(path, "rb") as f:
-        for chunk in iter(lambda: f.read(8192), b""):
-            h.update(chunk)
-    return h.hexdigest()
-
-def _ingest_file(col, path: str) -> Tuple[int, int]:
-    """単一ファイルの取り込み。成功なら (1, チャンク数) を返す。"""
+def _delete_stale_chunks(col, record: FileRecord, prev: Optional[FileRecord]):
+    """新しい版を書き込んだ後に、旧版のチャンクだけを削除する。"""
+    col = col.shard_for(record.path)
+    if prev is not None and prev.id_prefix:
+        # 台帳に旧版の ID があれば、ID 指定で消す（メタデータの検索が要らない）
+        stale = sorted(set(prev.chunk_ids()) - set(record.chunk_ids()))
+        if stale:
+            _delete_chunks(col, stale)
+            lexical_index.delete_ids(stale)
+        return
+    path, digest, n_chunks = record.path, record.digest, record.chunk_count
     try:
-        text = load_text_from_file(path)
+        stale = col.get(where={"$and": [
+            {"path": path},
+            {"$or": [{"digest": {"$ne": digest}}, {"chunk_index": {"$gte": n_chunks}}]},
+        ]}, include=[]).get("ids") or []
+        if stale:
+            _delete_chunks(col, stale)
     except Exception:
+        pass
+    lexical_index.delete_stale(path, digest, n_chunks)
+
+def scan_files(root: str, cancel=None, failed: Optional[List[str]] = None) -> Iterator[Tuple[str, os.stat_result]]:
+    """
+    フォルダ配下の対象ファイルを (パス, stat) で返す（パスは os.walk と同じ形）。
+    stat は DirEntry のもの（Windows ではディレクトリの読み出しに含まれている）。
+    フォルダへのシンボリックリンクはたどらない。cancel はフォルダごとに呼ぶ。
+    読めなかったフォルダ・エントリ（権限・共有フォルダの一時的なエラーなど）のパスは failed に入れる。
+    """
+    stack = [root]
+    while stack:
+        if cancel is not None:
+            cancel()
+        current = stack.pop()
+        subdirs = []
+        try:
+            with os.scandir(current) as it:
+                for entry in it:
+                    try:
+                        if entry.is_dir():
+                            if not entry.is_symlink():
+                                subdirs.append(entry.path)
+                            continue
+                        if os.path.splitext(entry.name)[1].lower() not in SUPPORTED_EXTS:
+                            continue
+                        st = entry.stat()
+                    except OSError:
+                        if failed is not None:
+                            failed.append(entry.path)
+                        continue
+                    yield entry.path, st
+        except OSError:
+            # 途中まで読めていても、このフォルダ配下は読めなかった扱い
+            if failed is not None:
+                failed.append(current)
+            continue
+        # os.walk と同じく、見つけた順に下りる
+        stack.extend(reversed(subdirs))
+
+@dataclass
+class IngestStats:
+    """取り込み結果の集計。"""
+    processed_files: int = 0   # 新規 + 更新で実際に埋め込んだファイル数
+    processed_chunks: int = 0
+    skipped_files: int = 0
+    new_files: int = 0
+    updated_files: int = 0
+    unchanged_files: int = 0
+    removed_files: int = 0
+    duplicate_chunks: int = 0  # ほぼ重複として埋め込まなかったチャンク数（DEDUP_ENABLED）
+    errors: List[dict] = field(default_factory=list)  # [{"path": ..., "error": ...}]
+
+class IngestCancelled(Exception):
+    """取り込みがキャンセルされた（途中でインデックスがリセットされた場合も）。"""
+
+@dataclass
+class IngestProgress:
+    """
+    取り込みの進捗。ジョブ（jobs.py）から別スレッドで読まれる。
+    cancel_event をセットすると、次の区切りで IngestCancelled を送出して止まる。
+    """
+    files_discovered: int = 0   # 走査で見つかった対象ファイル（変更なしも含む）
+    files_to_process: int = 0   # stat が変わっていて前処理に回したファイル
+    files_parsed: int = 0       # 前処理（ハッシュ・抽出・チャンク化）が終わったファイル
+    files_embedded: int = 0     # 書き込みまで終わった（または不要と分かった）ファイル
+    chunks_embedded: int = 0
+    chunks_deduplicated: int = 0  # 埋め込まずに別名として保存したチャンク
+    errors: List[dict] = field(default_factory=list)
+    started_at: float = field(default_factory=time.time)
+    cancel_event: threading.Event = field(default_factory=threading.Event)
+
+    def check_cancelled(self):
+        if self.cancel_event.is_set():
+            raise IngestCancelled()
+
+def remove_file(path: str):
+    """ファイルのチャンク・語彙インデックス・台帳エントリを削除（消えたファイル / 手動削除）。"""
+    if manifest.get(path) is None:
+        # 旧版は指定どおりのパス（相対パスなど）で登録していたので、その形で無ければ絶対パスで引く
+        path = normalize_path(path)
+    with index_lock.writing():
+        record = manifest.get(path)
+        if record is not None and record.id_prefix:
+            ids = record.chunk_ids()
+            _delete_chunks(get_collection().shard_for(path), ids)
+            lexical_index.delete_ids(ids)
+        else:
+            _delete_by_path(path)
+        manifest.remove(path)
+    answer_cache.invalidate_paths([path])
+
+def remove_directory(path: str, batch_size: int = 5000) -> Tuple[int, int]:
+    """
+    フォルダ配下のファイルをまとめて削除する。(ファイル数, チャンク数) を返す。
+    台帳からチャンク ID を引いて ID 指定で消すので、Chroma の全件走査は不要。
+    """
+    prefix = dir_prefix(normalize_path(path))
+    records = list(manifest.under(prefix))
+    if not records:
         return 0, 0
+    col = get_collection()
+    n_chunks = 0
+    with index_lock.writing():
+        # シャード → 削除待ちの ID
+        ids: Dict[str, List[str]] = {}
+        for rec in records:
+            if rec.id_prefix:
+                shard_id = col.route(rec.path)
+                batch = ids.setdefault(shard_id, [])
+                batch.extend(rec.chunk_ids())
+                n_chunks += rec.chunk_count
+                if len(batch) >= batch_size:
+                    _delete_chunks(col.shard_index(shard_id), batch)
+                    lexical_index.delete_ids(batch)
+                    ids[shard_id] = []
+            else:
+                _delete_by_path(rec.path)
+        for shard_id, batch in ids.items():
+            if batch:
+                _delete_chunks(col.shard_index(shard_id), batch)
+                lexical_index.delete_ids(batch)
+        manifest.remove_under(prefix)
+    answer_cache.invalidate_paths([rec.path for rec in records])
+    return len(records), n_chunks
 
-    # 今回は単純に差し替え（より高度にはハッシュ比較など）
-    _delete_by_path(path)
+def shard_records(shard_id: str) -> List[FileRecord]:
+    """シャードに入っているファイルの台帳。"""
+    col = get_collection()
+    col.shard(shard_id)  # 無いシャードなら KeyError
+    return [rec for rec in manifest.under("") if col.route(rec.path) == shard_id]
 
-    chunks = chunk_text(text, settings.max_chars_per_chunk, settings.chunk_overlap_chars)
-    mtime = os.path.getmtime(path)
-    digest = file_hash(path)
+def shard_sources(shard_id: str) -> List[str]:
+    """シャードを作り直すときに取り込み直すパス（フォルダのシャードならそのフォルダ）。"""
+    spec = get_collection().shard(shard_id).spec
+    if spec.root is not None:
+        return [spec.root]
+    return [rec.path for rec in shard_records(shard_id)]
 
-    ids = [f"{digest}:{i}" for i in range(len(chunks))]
-    metadatas = [{
-        "path": path,
-        "mtime": mtime,
-        "chunk_index": i,
-        "digest": digest,
-    } for i in range(len(chunks))]
+def reset_index(shard: Optional[str] = None) -> int:
+    """
+    インデックス（shard を渡すとそのシャードだけ）を空にする。削除したチャンク数を返す。
+    コレクションは新しい世代に差し替えて旧世代ごと捨てる（全件読み出しはしない）。
+    """
+    if shard is None:
+        def clear_side_stores():
+            lexical_index.clear()
+            duplicate_index.clear()
+            manifest.clear()
+            answer_cache.clear()
+        return swap_collection(clear_side_stores)
 
-    col.add(ids=ids, documents=chunks, metadatas=metadatas)
-    return 1, len(chunks)
+    records = shard_records(shard)
 
-def ingest_paths(paths: List[str]) -> Tuple[int, int, int]:
-    """複数パス（ファイル/ディレクトリ）を取り込み。統計を返す。"""
-    processed_files = 0
-    processed_chunks = 0
-    skipped = 0
+    def clear_shard_side_stores():
+        # 差し替えと同じ書き込みロックの中で（途中の状態を検索に見せない）
+        for rec in records:
+            if rec.id_prefix:
+                lexical_index.delete_ids(rec.chunk_ids())
+            else:
+                lexical_index.delete_path(rec.path)
+        duplicate_index.clear_shard(shard)
+        manifest.remove_many([rec.path for rec in records])
+        answer_cache.invalidate_paths([rec.path for rec in records])
+    return swap_collection(clear_shard_side_stores, [shard])
 
+def rename_path(old: str, new: str) -> bool:
+    """
+    ファイルの移動・リネームを反映する。
+    埋め込みは作り直さず、チャンクの path / mtime メタデータと台帳だけ書き換える。
+    """
+    old, new = normalize_path(old), normalize_path(new)
+    prev = manifest.get(old)
+    if prev is None:
+        return False
+    try:
+        st = os.stat(new)
+    except OSError:
+        return False
     col = get_collection()
-    
-    # バッチ処理用のリスト
-    batch_ids = []
-    batch_docs = []
-    batch_metas = []
-    
-    # 削除対象のパス（まとめて削除はできないが、ループ内で処理）
-    
-    def process_single_file(path):
-        nonlocal processed_files, processed_chunks, skipped
-        try:
+    with index_lock.writing():
+        # 移動先が別のシャードなら、update の中で埋め込みごと移し替える
+        src = col.shard_for(old)
+        if prev.id_prefix:
+            data = src.get(ids=prev.chunk_ids(), include=["metadatas"])
+        else:
+            data = src.get(where={"path": old}, include=["metadatas"])
+        ids = data.get("ids") or []
+        dup_ids = duplicate_index.ids_for_path(old)
+        if not ids and not dup_ids:
+            return False
+        if dup_ids and col.route(new) != col.route(old):
+            # 重複の索引はシャードごと。移動先のシャードの中で比べ直すため、取り込み直してもらう
+            return False
+        # 祖先フォルダも付け替える（浅くなった分の古いキーは None で消す）
+        scope_meta = dict(stale_scope_keys(old, new), **scope_metadata(new))
+        if ids:
+            metas = [dict(m, path=new, mtime=st.st_mtime, **scope_meta) for m in data["metadatas"]]
+            col.update(ids=ids, metadatas=metas)
+        if dup_ids:
+            duplicate_index.rename(old, new, dict(scope_meta, path=new, mtime=st.st_mtime))
+        lexical_index.rename(old, new, st.st_mtime)
+        manifest.rename(old, new, st.st_size, st.st_mtime)
+    answer_cache.invalidate_paths([old])
+    return True
+
+def backfill_manifest(page_size: int = 5000) -> int:
+    """
+    台帳にチャンク数・ID が無いファイル（旧版で取り込んだもの）を Chroma から一度だけ補う。
+    台帳に無いパスは version 0 で登録するので、次回の取り込みで作り直される。
+    補ったファイル数を返す。
+    """
+    col = get_collection()
+    missing = {rec.path: rec for rec in manifest.without_chunk_ids()}
+    if not missing and manifest.totals()[0] > 0:
+        return 0
+    if col.count() == 0:
+        return 0
+    # path → [チャンク数, ID 接頭辞, mtime, digest]
+    found: Dict[str, list] = {}
+    offset = 0
+    while True:
+        data = col.get(include=["metadatas"], limit=page_size, offset=offset)
+        ids = data.get("ids") or []
+        if not ids:
+            break
+        for id_, meta in zip(ids, data["metadatas"]):
+            path = (meta or {}).get("path")
+            if not path:
+                continue
+            entry = found.setdefault(path, [0, id_.rsplit(":", 1)[0], meta.get("mtime", 0.0), meta.get("digest", "")])
+            entry[0] += 1
+        offset += len(ids)
+
+    now = time.time()
+    records = []
+    for path, (count, prefix, mtime, digest) in found.items():
+        rec = missing.pop(path, None) or manifest.get(path)
+        if rec is not None and rec.id_prefix:
+            continue
+        if rec is None:
             try:
-                text = load_text_from_file(path)
-            except Exception:
-                skipped += 1
-                return
+                size = os.path.getsize(path)
+            except OSError:
+                size = -1
+            rec = FileRecord(path, size, float(mtime), digest, 0)
+        records.append(rec._replace(chunk_count=count, id_prefix=prefix, ingested_at=rec.ingested_at or now))
+    # Chroma にチャンクが無かった登録は、次回の取り込みで作り直す
+    for rec in missing.values():
+        records.append(rec._replace(version=0, id_prefix=_id_prefix(rec.path, rec.digest)))
+    manifest.upsert_many(records)
+    return len(records)
 
-            # 既存削除
-            _delete_by_path(path)
+class _ChunkWriter:
+    """
+    埋め込み + upsert ステージ。
+    チャンクを batch_size 件ずつまとめて Chroma に書き込み、
+    書き込みが済んだファイルから旧チャンク削除・台帳更新を行う。
+    """
+
+    def __init__(self, col, batch_size: int, progress: IngestProgress):
+        self.col = col
+        # 取り込み中に書き込み先のシャードがリセット（世代の差し替え）されたら、書き込まずに中断する
+        self.generations = get_generations()
+        self.batch_size = max(1, batch_size)
+        self.progress = progress
+        self.ids: List[str] = []
+        self.docs: List[str] = []
+        self.metas: List[dict] = []
+        # 全チャンクがバッファに入り、書き込み待ちのファイル
+        self.pending: List[FileRecord] = []
+        # チャンクを受け取り中のファイル（path → (digest, 受け取ったチャンク数)）
+        self.in_progress: Dict[str, Tuple[str, int]] = {}
+        # 先頭チャンク（/preview 用のテキストキャッシュに入れる）
+        self.first_chunk: Dict[str, str] = {}
+
+    def add(self, path: str, digest: str, mtime: float, chunks: List[str], start: int,
+            pages: Optional[List[Optional[Tuple[int, int]]]] = None):
+        prefix = _id_prefix(path, digest)
+        self.in_progress[path] = (digest, start + len(chunks))
+        if start == 0 and chunks:
+            self.first_chunk[path] = chunks[0]
+        scope_meta = scope_metadata(path)
+        for i, chunk in enumerate(chunks, start):
+            # ID = コンテンツハッシュ_パスハッシュ:チャンク番号
+            self.ids.append(f"{prefix}:{i}")
+            self.docs.append(chunk)
+            meta = {
+                "path": path,
+                "mtime": mtime,
+                "chunk_index": i,
+                "digest": digest,
+                **scope_meta,
+            }
+            page_range = pages[i - start] if pages else None
+            if page_range is not None:
+                meta["page"], meta["page_end"] = page_range
+            self.metas.append(meta)
+            if len(self.ids) >= self.batch_size:
+                self.flush()
+
+    def finish_file(self, record: FileRecord):
+        self.in_progress.pop(record.path, None)
+        first = self.first_chunk.pop(record.path, None)
+        if first is not None:
+            text_cache.put(record.path, record.mtime, record.size, first, record.chunk_count == 1)
+        self.pending.append(record)
+        if not self.ids:
+            self.flush()
+
+    def _check_generation(self, paths):
+        # 読み取りロック内で呼ぶ
+        current = get_generations()
+        for shard_id in {self.col.route(path) for path in paths}:
+            if current.get(shard_id) != self.generations.get(shard_id):
+                raise IngestCancelled()
+
+    def abort_file(self, path: str):
+        """抽出が途中で失敗したファイルの、送られてきた分のチャンクを捨てる。"""
+        digest, n = self.in_progress.pop(path, ("", 0))
+        self.first_chunk.pop(path, None)
+        if not n:
+            return
+        keep = [i for i, meta in enumerate(self.metas) if meta["path"] != path]
+        self.ids = [self.ids[i] for i in keep]
+        self.docs = [self.docs[i] for i in keep]
+        self.metas = [self.metas[i] for i in keep]
+        prefix = _id_prefix(path, digest)
+        ids = [f"{prefix}:{i}" for i in range(n)]
+        with index_lock.reading():
+            self._check_generation([path])
+            prev = manifest.get(path)
+            if prev is not None and prev.id_prefix == prefix:
+                # 同じ ID の旧版は上書きされただけなので、旧版に無い分だけ消す
+                ids = ids[prev.chunk_count:]
+            if ids:
+                _delete_chunks(self.col.shard_for(path), ids)
+                lexical_index.delete_ids(ids)
+
+    def update_manifest(self, records: List[FileRecord]):
+        """埋め込み不要だったファイルの台帳だけを更新する。"""
+        with index_lock.reading():
+            self._check_generation([record.path for record in records])
+            manifest.upsert_many(records)
+
+    def flush(self):
+        with index_lock.reading():
+            self._check_generation({meta["path"] for meta in self.metas} | {r.path for r in self.pending})
+            self._flush()
 
-            chunks = chunk_text(text, settings.max_chars_per_chunk, settings.chunk_overlap_chars)
-            if not chunks:
-                skipped += 1
+    def _flush(self):
+        if self.ids:
+            ids, docs, metas = self.ids, self.docs, self.metas
+            canon = None
+            if settings.dedup_enabled:
+                # ほぼ重複したチャンクは別名にして、代表だけを埋め込む
+                with stage("dedup"):
+                    shards = [self.col.route(meta["path"]) for meta in metas]
+                    canon, sigs = duplicate_index.plan(ids, docs, [meta["path"] for meta in metas], shards)
+                keep = [i for i, c in enumerate(canon) if c is None]
+            else:
+                keep = list(range(len(ids)))
+            if keep:
+                # upsert の中で埋め込みも計算される（その分は stage="embed" として別にも記録）
+                with stage("vector_upsert"):
+                    self.col.upsert(ids=[ids[i] for i in keep], documents=[docs[i] for i in keep],
+                                    metadatas=[metas[i] for i in keep])
+            # 語彙インデックスには別名も入れる（本文が少し違えば語の一致も違う）
+            with stage("lexical_add"):
+                lexical_index.add(ids, docs, metas)
+            if canon is not None:
+                aliases: Dict[str, List[str]] = {}
+                for i, c in enumerate(canon):
+                    if c is not None:
+                        aliases.setdefault(shards[i], []).append(ids[i])
+                # 重複検出を入れる前に書いた同じ ID があれば、ベクトルインデックスからは外す
+                for shard_id, alias_ids in aliases.items():
+                    self.col.shard_index(shard_id).delete(ids=alias_ids)
+                duplicate_index.commit(ids, docs, metas, shards, canon, sigs)
+                n_aliases = len(ids) - len(keep)
+                CHUNKS_DEDUPLICATED.inc(n_aliases)
+                self.progress.chunks_deduplicated += n_aliases
+            else:
+                duplicate_index.unalias(ids)
+            WRITE_BATCH_SIZE.observe(len(keep))
+            CHUNKS_WRITTEN.inc(len(keep))
+            self.progress.chunks_embedded += len(keep)
+            self.ids, self.docs, self.metas = [], [], []
+        # ここまでに done になったファイルは全チャンク書き込み済み
+        now = time.time()
+        records = [record._replace(ingested_at=now) for record in self.pending]
+        with stage("delete_stale"):
+            for record in records:
+                _delete_stale_chunks(self.col, record, manifest.get(record.path))
+        manifest.upsert_many(records)
+        answer_cache.invalidate_paths([record.path for record in records])
+        self.progress.files_embedded += len(self.pending)
+        self.pending = []
+
+def _record_timings(timings: Dict[str, float]):
+    """ワーカーで測った段階ごとの所要時間（ハッシュ・抽出）を記録する。"""
+    for name, seconds in timings.items():
+        record_stage(name, seconds)
+
+def ingest_paths(paths: List[str], progress: Optional[IngestProgress] = None) -> IngestStats:
+    """
+    複数パス（ファイル/ディレクトリ）を取り込み。統計を返す。
+    progress を渡すと進捗を書き込み、キャンセル要求にも応じる。
+    """
+    if progress is None:
+        progress = IngestProgress()
+    # 台帳・メタデータの path は絶対パスにそろえる（配下のパスも scan_files がこの形で返す）
+    paths = [normalize_path(p) for p in paths]
+    # エラー一覧は進捗と共有（キャンセル・途中経過でも見えるように）
+    stats = IngestStats(errors=progress.errors)
+
+    def record_error(path: str, message: str):
+        stats.errors.append({"path": path, "error": message})
+
+    col = get_collection()
+
+    # 1) 走査：stat だけで判定し、変化のありそうなファイルを仕事リストにする
+    tasks: List[FileTask] = []
+    is_new: Dict[str, bool] = {}
+    # 今回の走査で実在を確認したパス（消えたファイルの検出用）
+    seen = set()
+
+    def consider(path, st: Optional[os.stat_result] = None):
+        if path in seen:
+            return
+        seen.add(path)
+        progress.files_discovered += 1
+        if st is None:
+            try:
+                st = os.stat(path)
+            except OSError as e:
+                record_error(path, str(e))
+                stats.skipped_files += 1
                 return
 
-            mtime = os.path.getmtime(path)
-            digest = file_hash(path)
-            # パスも含めてハッシュ化しないと、別ファイルで同内容の場合にIDが重複する
-            path_digest = hashlib.sha256(path.encode()).hexdigest()[:16]
-
-            for i, chunk in enumerate(chunks):
-                # ID = コンテンツハッシュ_パスハッシュ:チャンク番号
-                batch_ids.append(f"{digest}_{path_digest}:{i}")
-                batch_docs.append(chunk)
-                batch_metas.append({
-                    "path": path,
-                    "mtime": mtime,
-                    "chunk_index": i,
-                    "digest": digest,
-                })
-            
-            processed_files += 1
-            processed_chunks += len(chunks)
-        except Exception as e:
-            print(f"Error processing file {path}: {e}")
-            skipped += 1
+        # stat が前回と同じなら、ファイルを開かずにスキップ
+        recorded = manifest.get(path)
+        prev = recorded
+        if prev is not None and prev.version != INDEX_VERSION:
+            prev = None  # メタデータ形式が古いので作り直す
+        if prev is not None and prev.size == st.st_size and prev.mtime == st.st_mtime:
+            stats.unchanged_files += 1
+            FILES_INGESTED.inc(1, "unchanged")
+            return
+        if not col.writable(path):
+            # 書き込み先のシャードを開けていない（ほかのシャードの取り込みは続ける）
+            record_error(path, f"Shard {col.route(path)} is unavailable")
+            stats.skipped_files += 1
+            return
+        is_new[path] = recorded is None
+        tasks.append(FileTask(path, st.st_size, st.st_mtime, prev.digest if prev else None))
 
+    scan_started = time.perf_counter()
     for p in paths:
         if os.path.isdir(p):
-            for root, _, files in os.walk(p):
-                for name in files:
-                    full = os.path.join(root, name)
-                    ext = os.path.splitext(full)[1].lower()
-                    if ext not in SUPPORTED_EXTS:
-                        continue
-                    process_single_file(full)
+            failed: List[str] = []
+            for full, st in scan_files(p, progress.check_cancelled, failed):
+                consider(full, st)
+            for bad in failed:
+                record_error(bad, "Could not be read during the scan; kept as is")
+            # 前回はあったのに今回見つからなかったファイルを削除
+            # （読めなかったフォルダ・ファイルの配下は、消えたのか読めなかっただけか分からないので残す）
+            unreadable = set(failed)
+            unreadable_dirs = tuple(dir_prefix(bad) for bad in failed)
+            for old in manifest.paths_under(p):
+                if old in seen or old in unreadable or (unreadable_dirs and old.startswith(unreadable_dirs)):
+                    continue
+                remove_file(old)
+                stats.removed_files += 1
         elif os.path.isfile(p):
             ext = os.path.splitext(p)[1].lower()
             if ext in SUPPORTED_EXTS:
-                process_single_file(p)
+                consider(p)
             else:
-                skipped += 1
+                record_error(p, f"Unsupported file type: {ext}")
+                stats.skipped_files += 1
+        elif manifest.get(p) is not None:
+            # 単体指定されたファイルが消えていた
+            remove_file(p)
+            stats.removed_files += 1
         else:
-            skipped += 1
-
-    # まとめてDBに追加（埋め込み計算のオーバーヘッドを減らす）
-    if batch_ids:
-        # Chromaの制限（一度に多すぎるとエラーになる場合がある）を考慮して
-        # 必要ならさらに分割するが、まずは一括で試す
-        # (数千件程度なら問題ないはず)
-        BATCH_SIZE = 100 # 念のため小分けにする
-        total = len(batch_ids)
-        for i in range(0, total, BATCH_SIZE):
-            end = min(i + BATCH_SIZE, total)
-            col.add(
-                ids=batch_ids[i:end],
-                documents=batch_docs[i:end],
-                metadatas=batch_metas[i:end]
-            )
-
-    return processed_files, processed_chunks, skipped
+            record_error(p, "Path not found")
+            stats.skipped_files += 1
+    record_stage("scan", time.perf_counter() - scan_started)
+
+    # 2) 前処理（並列）→ 3) 埋め込み + 書き込み（このスレッドでバッチ処理）
+    task_by_path = {t.path: t for t in tasks}
+    progress.files_to_process = len(tasks)
+    writer = _ChunkWriter(col, settings.embed_batch_size, progress)
+    workers = settings.ingest_workers or (os.cpu_count() or 1)
+    for msg in iter_prepared(tasks, settings.max_chars_per_chunk, settings.chunk_overlap_chars,
+                             workers, settings.ingest_queue_depth, progress.cancel_event):
+        # ここで抜けるとワーカーも止まる（書き込み済みのファイルは整合したまま）
+        progress.check_cancelled()
+        kind, path = msg[0], msg[1]
+        task = task_by_path[path]
+        if kind != "chunks":
+            progress.files_parsed += 1
+        if kind == "chunks":
+            _, _, digest, chunks, start, pages = msg
+            writer.add(path, digest, task.mtime, chunks, start, pages)
+        elif kind == "done":
+            _, _, digest, n_chunks, timings = msg
+            _record_timings(timings)
+            record = FileRecord(path, task.size, task.mtime, digest, INDEX_VERSION,
+                                n_chunks, _id_prefix(path, digest))
+            if n_chunks == 0:
+                # テキストが空になった：既存チャンクも不要
+                remove_file(path)
+                progress.files_embedded += 1
+                stats.skipped_files += 1
+                FILES_INGESTED.inc(1, "empty")
+                continue
+            writer.finish_file(record)
+            if is_new[path]:
+                stats.new_files += 1
+            else:
+                stats.updated_files += 1
+            FILES_INGESTED.inc(1, "new" if is_new[path] else "updated")
+            stats.processed_files += 1
+            stats.processed_chunks += n_chunks
+        elif kind == "unchanged":
+            # 中身（ハッシュ）が同じなら、埋め込みをスキップして台帳だけ更新
+            _record_timings(msg[3])
+            prev = manifest.get(path)
+            if prev is not None:
+                writer.update_manifest([prev._replace(size=task.size, mtime=task.mtime)])
+            progress.files_embedded += 1
+            stats.unchanged_files += 1
+            FILES_INGESTED.inc(1, "touched")  # mtime だけ変わった
+        else:
+            # skipped（抽出失敗）/ error（想定外の例外）
+            writer.abort_file(path)
+            record_error(path, msg[2])
+            progress.files_embedded += 1
+            stats.skipped_files += 1
+            FILES_INGESTED.inc(1, kind)
+
+    progress.check_cancelled()
+    writer.flush()
+    stats.duplicate_chunks = progress.chunks_deduplicated
+    return stats
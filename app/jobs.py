@@ -0,0 +1,194 @@
+# =============================================
+# jobs.py
+# ---------------------------------------------
+# 取り込みをバックグラウンドジョブとして実行する。
+# ・投入するとすぐにジョブ ID を返し、別スレッドで ingest_paths を実行
+# ・進捗（発見/前処理/書き込み済みファイル数, chunks/sec, 残り時間）とエラーを参照できる
+# ・キャンセル可能
+# ・同じパス集合のジョブが動いていればそれを返す（重複排除）
+# ・パスが重なるジョブは直列化（同じコレクションを取り合わない）
+#   重なりの判定は「ルート集合」と「祖先集合」の set 引きで行う（パス同士の総当たりはしない）
+# =============================================
+import os
+import threading
+import time
+import uuid
+from dataclasses import asdict, dataclass, field
+from typing import Dict, FrozenSet, List, Optional, Tuple
+
+from .config import settings
+from .ingest import IngestCancelled, IngestProgress, IngestStats, ingest_paths
+
+ACTIVE_STATES = ("queued", "running")
+
+def _norm(path: str) -> str:
+    return os.path.normcase(os.path.abspath(path))
+
+def _lineage(path: str) -> List[str]:
+    """path 自身と、その祖先ディレクトリ（ファイルシステムのルートまで）。"""
+    out = [path]
+    parent = os.path.dirname(path)
+    while parent != path:
+        out.append(parent)
+        path, parent = parent, os.path.dirname(parent)
+    return out
+
+def _roots(norm_paths: Tuple[str, ...]) -> FrozenSet[str]:
+    """他のパスの配下にあるものを除いた、最上位のパスだけの集合。"""
+    paths = set(norm_paths)
+    return frozenset(p for p in paths if not any(a in paths for a in _lineage(p)[1:]))
+
+@dataclass
+class IngestJob:
+    id: str
+    paths: List[str]
+    norm_paths: Tuple[str, ...]
+    status: str = "queued"   # queued / running / completed / failed / cancelled
+    created_at: float = field(default_factory=time.time)
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    progress: IngestProgress = field(default_factory=IngestProgress)
+    stats: Optional[IngestStats] = None
+    error: Optional[str] = None
+    done_event: threading.Event = field(default_factory=threading.Event)
+    # 重なり判定用: 最上位のパスと、それらの祖先（自身を含む）
+    roots: FrozenSet[str] = field(init=False, repr=False)
+    ancestors: FrozenSet[str] = field(init=False, repr=False)
+
+    def __post_init__(self):
+        self.roots = _roots(self.norm_paths)
+        self.ancestors = frozenset(a for r in self.roots for a in _lineage(r))
+
+    def overlaps(self, other: "IngestJob") -> bool:
+        """どちらかのパスがもう一方の配下（または同一）なら True。"""
+        for root in self.roots:
+            # root が other のどれかの祖先（または同一）か、root の祖先に other のルートがあるか
+            if root in other.ancestors or any(a in other.roots for a in _lineage(root)):
+                return True
+        return False
+
+    def snapshot(self) -> dict:
+        """状態を dict で返す（IngestJobStatus 互換）。"""
+        p = self.progress
+        chunks_per_sec = 0.0
+        eta_seconds = None
+        if self.started_at is not None:
+            elapsed = (self.finished_at or time.time()) - self.started_at
+            if elapsed > 0:
+                chunks_per_sec = p.chunks_embedded / elapsed
+                if self.status == "running" and p.files_embedded > 0:
+                    remaining = max(0, p.files_to_process - p.files_embedded)
+                    eta_seconds = remaining * elapsed / p.files_embedded
+        return {
+            "job_id": self.id,
+            "paths": self.paths,
+            "status": self.status,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "files_discovered": p.files_discovered,
+            "files_to_process": p.files_to_process,
+            "files_parsed": p.files_parsed,
+            "files_embedded": p.files_embedded,
+            "chunks_embedded": p.chunks_embedded,
+            "chunks_deduplicated": p.chunks_deduplicated,
+            "chunks_per_sec": chunks_per_sec,
+            "eta_seconds": eta_seconds,
+            "errors": list(p.errors),
+            "result": asdict(self.stats) if self.stats is not None else None,
+            "error": self.error,
+        }
+
+class JobManager:
+    """取り込みジョブの投入・実行・参照・キャンセルを管理する。"""
+
+    def __init__(self, max_concurrent: int = 1, max_history: int = 100):
+        self.max_concurrent = max(1, max_concurrent)
+        self.max_history = max_history
+        self._cond = threading.Condition()
+        self._jobs: Dict[str, IngestJob] = {}
+
+    def submit(self, paths: List[str]) -> Tuple[IngestJob, bool]:
+        """ジョブを投入。(ジョブ, 新規作成したか) を返す。"""
+        norm_paths = tuple(sorted({_norm(p) for p in paths}))
+        with self._cond:
+            for job in self._jobs.values():
+                if (job.status in ACTIVE_STATES and job.norm_paths == norm_paths
+                        and not job.progress.cancel_event.is_set()):
+                    return job, False
+            job = IngestJob(id=uuid.uuid4().hex, paths=list(paths), norm_paths=norm_paths)
+            self._jobs[job.id] = job
+            self._trim_history()
+        threading.Thread(target=self._run, args=(job,), name=f"ingest-{job.id[:8]}", daemon=True).start()
+        return job, True
+
+    def get(self, job_id: str) -> Optional[IngestJob]:
+        with self._cond:
+            return self._jobs.get(job_id)
+
+    def list(self) -> List[IngestJob]:
+        with self._cond:
+            return sorted(self._jobs.values(), key=lambda j: j.created_at, reverse=True)
+
+    def cancel(self, job_id: str) -> Optional[IngestJob]:
+        with self._cond:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            if job.status in ACTIVE_STATES:
+                job.progress.cancel_event.set()
+                self._cond.notify_all()  # 待機中のジョブを起こす
+            return job
+
+    def _can_start(self, job: IngestJob) -> bool:
+        active = [j for j in self._jobs.values() if j.status in ACTIVE_STATES]
+        running = [j for j in active if j.status == "running"]
+        if len(running) >= self.max_concurrent:
+            return False
+        if any(job.overlaps(r) for r in running):
+            return False
+        # 先に投入された待機中ジョブとパスが重なるなら、順番を守る
+        for other in active:
+            if other is job:
+                break
+            if other.status == "queued" and job.overlaps(other):
+                return False
+        return True
+
+    def _run(self, job: IngestJob):
+        with self._cond:
+            while not job.progress.cancel_event.is_set() and not self._can_start(job):
+                self._cond.wait()
+            if job.progress.cancel_event.is_set():
+                self._finish(job, "cancelled")
+                return
+            job.status = "running"
+            job.started_at = time.time()
+            job.progress.started_at = job.started_at
+
+        status, error = "completed", None
+        try:
+            job.stats = ingest_paths(job.paths, job.progress)
+        except IngestCancelled:
+            status = "cancelled"
+        except Exception as e:
+            status, error = "failed", str(e)
+        with self._cond:
+            job.error = error
+            self._finish(job, status)
+
+    def _finish(self, job: IngestJob, status: str):
+        # self._cond を保持した状態で呼ぶ
+        job.status = status
+        job.finished_at = time.time()
+        job.done_event.set()
+        self._cond.notify_all()
+
+    def _trim_history(self):
+        finished = [j for j in self._jobs.values() if j.status not in ACTIVE_STATES]
+        finished.sort(key=lambda j: j.created_at)
+        for job in finished[:max(0, len(self._jobs) - self.max_history)]:
+            del self._jobs[job.id]
+
+# アプリ全体で共有するジョブ管理
+job_manager = JobManager(settings.ingest_max_concurrent_jobs)
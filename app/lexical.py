@@ -0,0 +1,263 @@
+# =============================================
+# lexical.py
+# ---------------------------------------------
+# 語彙（キーワード）検索用の転置インデックス。BM25 でスコアリングします。
+# ・日本語は辞書なしで扱えるよう「文字 2-gram」に分割
+# ・英数字（型番・製品コードなど）はひと続きの語として扱う
+# ・SQLite に永続化し、チャンク単位で追加・削除できる（差分取り込みに追従）
+# ・ベクトル検索と並べて使い、retrieval.py で順位を融合（RRF）します
+# ・フォルダ・拡張子・更新日時のスコープ（scope.py）は、スコアを付ける前に絞り込む
+# ・採点は SQL 1 本（出現リストの結合と集計）で行い、ありふれた語（LEXICAL_MAX_DF_RATIO 超）は読まない
+# =============================================
+import math
+import os
+import re
+import sqlite3
+import threading
+import unicodedata
+from collections import Counter
+from typing import Iterable, List, Optional, Tuple
+
+from .config import settings
+from .scope import Scope, file_dir
+
+# BM25 のパラメータ（一般的な値）
+_K1 = 1.2
+_B = 0.75
+
+# 英数字の語（AB-1234, v2.0, foo_bar などを1語に）と、それ以外の文字（かな・漢字など）の並び
+_ASCII_WORD = re.compile(r"[a-z0-9]+(?:[-_.][a-z0-9]+)*")
+_CJK_RUN = re.compile(r"[^\W\d_a-z]+")
+
+def tokenize(text: str) -> List[str]:
+    """NFKC 正規化 + 小文字化したうえで、英数字は語、それ以外は文字 2-gram に分ける。"""
+    text = unicodedata.normalize("NFKC", text).lower()
+    tokens: List[str] = []
+    for m in _ASCII_WORD.finditer(text):
+        word = m.group()
+        tokens.append(word)
+        # 区切り入りの語は部分でも引けるように（"ab-1234" → "ab", "1234"）
+        if len(word) > 1 and re.search(r"[-_.]", word):
+            tokens.extend(p for p in re.split(r"[-_.]", word) if p)
+    for m in _CJK_RUN.finditer(text):
+        run = m.group()
+        if len(run) == 1:
+            tokens.append(run)
+        else:
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return tokens
+
+class LexicalIndex:
+    """チャンク ID 単位の BM25 転置インデックス（SQLite 永続）。スレッドセーフ。"""
+
+    def __init__(self, db_path: str):
+        parent = os.path.dirname(db_path)
+        if parent:
+            os.makedirs(parent, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        with self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS docs ("
+                " doc INTEGER PRIMARY KEY,"
+                " id TEXT UNIQUE NOT NULL,"
+                " path TEXT NOT NULL,"
+                " digest TEXT NOT NULL,"
+                " chunk_index INTEGER NOT NULL,"
+                " length INTEGER NOT NULL)"
+            )
+            # スコープ用の列（旧形式の表には足す）
+            cols = {r[1] for r in self._conn.execute("PRAGMA table_info(docs)")}
+            for name, decl in (("dir", "TEXT NOT NULL DEFAULT ''"),
+                               ("ext", "TEXT NOT NULL DEFAULT ''"),
+                               ("mtime", "REAL NOT NULL DEFAULT 0")):
+                if name not in cols:
+                    self._conn.execute(f"ALTER TABLE docs ADD COLUMN {name} {decl}")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS docs_path ON docs(path)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS docs_dir ON docs(dir)")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS postings ("
+                " term TEXT NOT NULL, doc INTEGER NOT NULL, tf INTEGER NOT NULL,"
+                " PRIMARY KEY (term, doc)) WITHOUT ROWID"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS postings_doc ON postings(doc)")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS terms (term TEXT PRIMARY KEY, df INTEGER NOT NULL) WITHOUT ROWID"
+            )
+        # 文書数と平均長はよく使うのでメモリに持つ
+        n, total = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(length), 0) FROM docs").fetchone()
+        self._n_docs = n
+        self._total_len = total
+
+    # ---- 更新 ----
+
+    def _delete_docs(self, doc_rows: List[Tuple[int, int]]):
+        """(doc, length) のリストを削除。ロックとトランザクション内で呼ぶ。"""
+        if not doc_rows:
+            return
+        for doc, length in doc_rows:
+            terms = [r[0] for r in self._conn.execute("SELECT term FROM postings WHERE doc = ?", (doc,))]
+            self._conn.executemany("UPDATE terms SET df = df - 1 WHERE term = ?", [(t,) for t in terms])
+            self._conn.execute("DELETE FROM postings WHERE doc = ?", (doc,))
+            self._conn.execute("DELETE FROM docs WHERE doc = ?", (doc,))
+            self._n_docs -= 1
+            self._total_len -= length
+        self._conn.execute("DELETE FROM terms WHERE df <= 0")
+
+    def add(self, ids: List[str], texts: List[str], metadatas: List[dict]):
+        """チャンクを登録（同じ ID があれば置き換え）。"""
+        with self._lock, self._conn:
+            existing = []
+            for id_ in ids:
+                row = self._conn.execute("SELECT doc, length FROM docs WHERE id = ?", (id_,)).fetchone()
+                if row:
+                    existing.append(row)
+            self._delete_docs(existing)
+            for id_, text, meta in zip(ids, texts, metadatas):
+                counts = Counter(tokenize(text))
+                length = sum(counts.values())
+                path = meta.get("path", "")
+                cur = self._conn.execute(
+                    "INSERT INTO docs (id, path, digest, chunk_index, length, dir, ext, mtime)"
+                    " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (id_, path, meta.get("digest", ""), int(meta.get("chunk_index", 0)), length,
+                     file_dir(path), os.path.splitext(path)[1].lower(), float(meta.get("mtime", 0.0))),
+                )
+                doc = cur.lastrowid
+                self._conn.executemany(
+                    "INSERT INTO postings (term, doc, tf) VALUES (?, ?, ?)",
+                    [(t, doc, tf) for t, tf in counts.items()],
+                )
+                self._conn.executemany(
+                    "INSERT INTO terms (term, df) VALUES (?, 1) ON CONFLICT(term) DO UPDATE SET df = df + 1",
+                    [(t,) for t in counts],
+                )
+                self._n_docs += 1
+                self._total_len += length
+
+    def delete_ids(self, ids: Iterable[str]):
+        with self._lock, self._conn:
+            rows = []
+            for id_ in ids:
+                row = self._conn.execute("SELECT doc, length FROM docs WHERE id = ?", (id_,)).fetchone()
+                if row:
+                    rows.append(row)
+            self._delete_docs(rows)
+
+    def delete_path(self, path: str):
+        with self._lock, self._conn:
+            rows = self._conn.execute("SELECT doc, length FROM docs WHERE path = ?", (path,)).fetchall()
+            self._delete_docs(rows)
+
+    def delete_stale(self, path: str, digest: str, n_chunks: int):
+        """新しい版（digest, 0..n_chunks-1）以外のチャンクを削除。"""
+        with self._lock, self._conn:
+            rows = self._conn.execute(
+                "SELECT doc, length FROM docs WHERE path = ? AND (digest != ? OR chunk_index >= ?)",
+                (path, digest, n_chunks),
+            ).fetchall()
+            self._delete_docs(rows)
+
+    def rename(self, old: str, new: str, mtime: Optional[float] = None):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE docs SET path = ?, dir = ?, ext = ?, mtime = COALESCE(?, mtime) WHERE path = ?",
+                (new, file_dir(new), os.path.splitext(new)[1].lower(), mtime, old),
+            )
+
+    def clear(self):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM postings")
+            self._conn.execute("DELETE FROM terms")
+            self._conn.execute("DELETE FROM docs")
+            self._n_docs = 0
+            self._total_len = 0
+
+    # ---- 検索 ----
+
+    @staticmethod
+    def _scope_sql(scope: Scope) -> Tuple[str, list]:
+        conds, params = [], []
+        if scope.dir is not None:
+            sub = scope.dir if scope.dir.endswith(os.sep) else scope.dir + os.sep
+            conds.append("(dir = ? OR (dir >= ? AND dir < ?))")
+            params += [scope.dir, sub, sub + "\U0010ffff"]
+        if scope.exts:
+            conds.append(f"ext IN ({', '.join('?' * len(scope.exts))})")
+            params += list(scope.exts)
+        if scope.mtime_from is not None:
+            conds.append("mtime >= ?")
+            params.append(scope.mtime_from)
+        if scope.mtime_to is not None:
+            conds.append("mtime <= ?")
+            params.append(scope.mtime_to)
+        return " AND ".join(conds), params
+
+    def scoped_ids(self, scope: Scope, limit: int) -> Optional[List[str]]:
+        """スコープに入るチャンク ID（フォルダ列の索引で引く）。limit 件を超えるなら None。"""
+        cond, params = self._scope_sql(scope)
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT id FROM docs WHERE {cond} LIMIT ?", params + [limit + 1]
+            ).fetchall()
+        if len(rows) > limit:
+            return None
+        return [r[0] for r in rows]
+
+    def search(self, query: str, k: int, scope: Optional[Scope] = None) -> List[Tuple[str, float]]:
+        """BM25 上位 k 件の (チャンク ID, スコア) を返す。scope があればその範囲だけを採点する。"""
+        terms = set(tokenize(query))
+        if not terms or k <= 0:
+            return []
+        with self._lock:
+            n = self._n_docs
+            if n == 0:
+                return []
+            avg_len = self._total_len / n
+            dfs = self._conn.execute(
+                f"SELECT term, df FROM terms WHERE term IN ({', '.join('?' * len(terms))})", list(terms)
+            ).fetchall()
+            if not dfs:
+                return []
+            # ありふれた語は読まない（全部ありふれた語なら、いちばん珍しい1語だけで採点）
+            max_df = max(1, int(n * settings.lexical_max_df_ratio))
+            kept = [(t, df) for t, df in dfs if df <= max_df] or [min(dfs, key=lambda x: x[1])]
+            postings_total = sum(df for _, df in kept)
+
+            cond, cond_params = "", []
+            join = "q CROSS JOIN postings p CROSS JOIN docs d"
+            if scope is not None and not scope.is_empty():
+                cond, cond_params = self._scope_sql(scope)
+                scoped = self._conn.execute(
+                    f"SELECT COUNT(*) FROM (SELECT 1 FROM docs WHERE {cond} LIMIT ?)",
+                    cond_params + [postings_total],
+                ).fetchone()[0]
+                if scoped == 0:
+                    return []
+                if scoped < postings_total:
+                    # 範囲が狭いときは、範囲内の文書から (語, 文書) の主キーで出現を引く
+                    join = "docs d CROSS JOIN q CROSS JOIN postings p"
+                cond = " AND " + cond
+
+            values = ", ".join("(?, ?)" for _ in kept)
+            params: list = [v for t, df in kept for v in (t, math.log(1 + (n - df + 0.5) / (df + 0.5)))]
+            params += [_K1 + 1, _K1, _B, _B, avg_len]
+            params += cond_params + [k]
+            rows = self._conn.execute(
+                f"WITH q(term, idf) AS (VALUES {values})"
+                " SELECT d.id, SUM(q.idf * p.tf * ? / (p.tf + ? * (1 - ? + ? * d.length / ?))) AS score"
+                f" FROM {join}"
+                f" WHERE p.term = q.term AND d.doc = p.doc{cond}"
+                " GROUP BY d.doc ORDER BY score DESC, d.doc LIMIT ?",
+                params,
+            ).fetchall()
+            return [(id_, score) for id_, score in rows]
+
+    def count(self) -> int:
+        with self._lock:
+            return self._n_docs
+
+# アプリ全体で共有する語彙インデックス（Chroma の保存先に並べて置く）
+lexical_index = LexicalIndex(os.path.join(settings.chroma_dir, "k9_lexical.sqlite3"))
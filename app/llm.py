@@ -3,35 +3,119 @@
 # ---------------------------------------------
 # LM Studio の OpenAI 互換 API を使って Phi-3-mini を呼び出す。
 # RAG 用に、検索で得たチャンクを「参考文脈」として渡します。
+# クライアント（と openai パッケージの import）は初回の呼び出しまで作らない。
 # =============================================
-from typing import List
-from openai import OpenAI
+import asyncio
+import time
+from typing import TYPE_CHECKING, AsyncIterator, List
+import httpx
 from .config import settings
+from .context import estimate_tokens
+from . import metrics
+from .metrics import LLM_REQUESTS, LLM_TOKENS, record_stage
+
+if TYPE_CHECKING:
+    from openai import AsyncOpenAI
 
 # RAG の基本姿勢をガイドするシステムプロンプト
 _SYSTEM_PROMPT = (
     "あなたはRAGアシスタントです。与えられた文脈だけを根拠に、簡潔で正確に答えてください。"    "わからない場合は推測せず『手元の文書からは断定できません』と答えてください。"
 )
 
-# OpenAI 互換クライアント（base_url を LM Studio に向ける）
-_client = OpenAI(base_url=settings.llm_base_url, api_key=settings.llm_api_key)
+# OpenAI 互換の非同期クライアント（base_url を LM Studio に向け、HTTP コネクションプールをアプリ全体で共有）
+# 同時チャットが増えてもワーカースレッドを占有しない。
+# httpx の接続はイベントループに紐づくため、ループごとに1つだけ作る。
+_async_client = None
+_async_loop = None
+
+def _get_async_client() -> "AsyncOpenAI":
+    global _async_client, _async_loop
+    loop = asyncio.get_running_loop()
+    if _async_client is None or _async_loop is not loop:
+        from openai import AsyncOpenAI
+        _async_client = AsyncOpenAI(
+            base_url=settings.llm_base_url,
+            api_key=settings.llm_api_key,
+            timeout=settings.llm_timeout,
+            http_client=httpx.AsyncClient(
+                limits=httpx.Limits(
+                    max_connections=settings.llm_max_connections,
+                    max_keepalive_connections=settings.llm_max_connections,
+                ),
+                timeout=settings.llm_timeout,
+            ),
+        )
+        _async_loop = loop
+    return _async_client
+
+def warmup_client():
+    """openai パッケージを先に import しておく（起動後に裏で呼ぶ。クライアントはループごとに作る）。"""
+    from openai import AsyncOpenAI  # noqa: F401
+
+async def close_async_client():
+    """シャットダウン時にコネクションプールを閉じる。"""
+    global _async_client, _async_loop
+    if _async_client is not None:
+        await _async_client.close()
+    _async_client = None
+    _async_loop = None
 
-def rag_answer(query: str, contexts: List[str]) -> str:
-    """検索で得た上位チャンクを文脈として渡し、Phi-3-mini で回答を生成。"""
+def _build_messages(query: str, contexts: List[str]) -> List[dict]:
+    """検索で得た上位チャンクを文脈として埋め込んだメッセージを作る。"""
     context_block = "\n\n".join([f"[CONTEXT {i+1}]\n" + c for i, c in enumerate(contexts)])
     user_prompt = (
         f"質問:\n{query}\n\n"
         f"参考文脈:\n{context_block}\n\n"
         "日本語で、要点を簡潔にまとめて回答してください。根拠の箇所があれば短く触れてください。"
     )
+    return [
+        {"role": "system", "content": _SYSTEM_PROMPT},
+        {"role": "user", "content": user_prompt},
+    ]
 
-    resp = _client.chat.completions.create(
-        model=settings.llm_model,
-        messages=[
-            {"role": "system", "content": _SYSTEM_PROMPT},
-            {"role": "user", "content": user_prompt},
-        ],
-        temperature=0.2,
-        max_tokens=512,
-    )
-    return resp.choices[0].message.content.strip()
+def prompt_text(query: str, contexts: List[str]) -> str:
+    """LLM に送るプロンプト全体（サイズ計測用）。"""
+    return "\n".join(m["content"] for m in _build_messages(query, contexts))
+
+def _record_usage(kind: str, started: float, messages: List[dict], tokens_out: int = 0, status: str = "ok"):
+    """LLM 呼び出しの所要時間・トークン数を記録（入力は見積もり）。"""
+    if not metrics.ENABLED:
+        return
+    record_stage("llm", time.perf_counter() - started)
+    LLM_REQUESTS.inc(1, kind, status)
+    if status != "ok":
+        return
+    tokens_in = estimate_tokens("\n".join(m["content"] for m in messages))
+    LLM_TOKENS.inc(tokens_in, "in")
+    LLM_TOKENS.inc(tokens_out, "out")
+
+async def rag_answer_stream(query: str, contexts: List[str]) -> AsyncIterator[str]:
+    """
+    検索で得た上位チャンクを文脈として渡し、Phi-3-mini の回答をトークン（差分）単位で逐次返す。
+    /chat も /chat/stream もこれを使う（/chat はつなげて返す）。
+    """
+    messages = _build_messages(query, contexts)
+    started = time.perf_counter()
+    n_deltas = 0
+    try:
+        stream = await _get_async_client().chat.completions.create(
+            model=settings.llm_model,
+            messages=messages,
+            temperature=0.2,
+            max_tokens=512,
+            stream=True,
+        )
+        async for event in stream:
+            if not event.choices:
+                continue
+            delta = event.choices[0].delta.content
+            if delta:
+                if n_deltas == 0:
+                    record_stage("llm_ttft", time.perf_counter() - started)
+                n_deltas += 1
+                yield delta
+    except Exception:
+        _record_usage("stream", started, messages, status="error")
+        raise
+    # 差分1つ ≒ 1トークン
+    _record_usage("stream", started, messages, tokens_out=n_deltas)
@@ -0,0 +1,157 @@
+# =============================================
+# llm_scheduler.py
+# ---------------------------------------------
+# LLM への問い合わせの順番待ち（/chat・/chat/stream）。
+# ローカル LLM（GPU 1枚）に同時に何十件も投げると、全員の応答が遅くなり、結局タイムアウトする。
+# ・同時に LLM へ投げるのは LLM_MAX_CONCURRENCY 件まで。残りは到着順に待つ（待ち行列は LLM_MAX_QUEUE 件まで）
+# ・リクエストごとに期限（LLM_DEADLINE_SECONDS / ChatRequest.deadline_seconds）を持つ。
+#   待ち行列があふれている・期限までに順番が来ない（来そうにない）ときは LLMUnavailable を送出し、
+#   呼び出し側（main.py）は LLM を使わない抜粋の回答に切り替える（context.extractive_answer）
+# ・待っている間の順番（1 = 次）は /chat/stream で {"type": "queue", "position": n} として返す
+# イベントループの中だけで使う（ロック不要）。uvicorn のワーカーごとに1つ。
+# =============================================
+import asyncio
+import time
+from collections import deque
+from typing import AsyncIterator, Deque, Optional
+
+from .config import settings
+
+# 順番待ちの間、順番の変化と期限を確かめる間隔（秒）
+_POLL_SECONDS = 0.5
+# 1件あたりの占有時間の移動平均の重み（新しい値）
+_EWMA_ALPHA = 0.2
+
+class LLMUnavailable(Exception):
+    """期限までに LLM の回答を得られない。reason: queue_full / deadline / error"""
+
+    def __init__(self, reason: str):
+        super().__init__(reason)
+        self.reason = reason
+
+class Ticket:
+    """順番待ちの札。submit() で受け取り、終わったら必ず release() する。"""
+
+    def __init__(self, deadline: float):
+        self.deadline = deadline          # time.monotonic() の値
+        self.enqueued_at = time.monotonic()
+        self.granted_at: Optional[float] = None
+        self.released = False
+        self._granted = asyncio.get_running_loop().create_future()
+
+    @property
+    def granted(self) -> bool:
+        return self.granted_at is not None
+
+    def remaining(self) -> float:
+        return max(0.0, self.deadline - time.monotonic())
+
+    def waited(self) -> float:
+        """順番が来るまでに待った秒数（まだなら今までの分）。"""
+        return (self.granted_at or time.monotonic()) - self.enqueued_at
+
+class LLMScheduler:
+    """同時実行数の上限つきの到着順の待ち行列。"""
+
+    def __init__(self, limit: int, max_queue: int):
+        self.limit = max(1, limit)
+        self.max_queue = max(0, max_queue)
+        self._active = 0
+        self._queue: Deque[Ticket] = deque()
+        # 1件が枠を占有する時間（秒）の移動平均。待ち時間の見込みに使う
+        self._service_seconds: Optional[float] = None
+        self.rejected = 0
+        self.expired = 0
+        self.completed = 0
+
+    def submit(self, deadline: float) -> Ticket:
+        """札を取る。空きがあればすぐ順番が来る。待ち行列がいっぱいなら LLMUnavailable("queue_full")。"""
+        ticket = Ticket(deadline)
+        if self._active < self.limit and not self._queue:
+            self._grant(ticket)
+        elif len(self._queue) >= self.max_queue:
+            self.rejected += 1
+            raise LLMUnavailable("queue_full")
+        else:
+            self._queue.append(ticket)
+        return ticket
+
+    def position(self, ticket: Ticket) -> int:
+        """待ち行列での順番（1 = 次）。順番が来ていれば 0。"""
+        if ticket.granted:
+            return 0
+        try:
+            return self._queue.index(ticket) + 1
+        except ValueError:
+            return 0
+
+    def expected_wait(self, ticket: Ticket) -> float:
+        """順番が来るまでの見込みの秒数（占有時間の実績がまだ無ければ 0）。"""
+        pos = self.position(ticket)
+        if not pos or self._service_seconds is None:
+            return 0.0
+        return pos / self.limit * self._service_seconds
+
+    async def wait_turn(self, ticket: Ticket) -> AsyncIterator[int]:
+        """
+        順番が来るまで待ち、待っている間の順番を変わるたびに返す（順番が来たら終わる）。
+        期限を過ぎた・見込みの待ち時間が期限を超えるときは LLMUnavailable("deadline")。
+        """
+        last = None
+        while not ticket.granted:
+            pos = self.position(ticket)
+            if pos != last:
+                last = pos
+                yield pos
+            remaining = ticket.remaining()
+            if remaining <= 0 or self.expected_wait(ticket) > remaining:
+                # 待っても間に合わないので、札を返して抜粋の回答に切り替えてもらう
+                self.expired += 1
+                self.release(ticket)
+                raise LLMUnavailable("deadline")
+            try:
+                await asyncio.wait_for(asyncio.shield(ticket._granted), min(_POLL_SECONDS, remaining))
+            except asyncio.TimeoutError:
+                pass
+
+    def release(self, ticket: Ticket):
+        """札を返す（LLM の呼び出しが終わった / 待つのをやめた）。2回目以降は何もしない。"""
+        if ticket.released:
+            return
+        ticket.released = True
+        if ticket.granted:
+            self._active -= 1
+            seconds = time.monotonic() - ticket.granted_at
+            self.completed += 1
+            if self._service_seconds is None:
+                self._service_seconds = seconds
+            else:
+                self._service_seconds += _EWMA_ALPHA * (seconds - self._service_seconds)
+        else:
+            try:
+                self._queue.remove(ticket)
+            except ValueError:
+                pass
+        while self._active < self.limit and self._queue:
+            self._grant(self._queue.popleft())
+
+    def _grant(self, ticket: Ticket):
+        self._active += 1
+        ticket.granted_at = time.monotonic()
+        if not ticket._granted.done():
+            ticket._granted.set_result(True)
+
+    def stats(self) -> dict:
+        return {
+            "limit": self.limit,
+            "max_queue": self.max_queue,
+            "active": self._active,
+            "queued": len(self._queue),
+            "service_seconds_avg": round(self._service_seconds, 3) if self._service_seconds is not None else None,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "expired": self.expired,
+        }
+
+# アプリ全体で共有する順番待ち
+llm_scheduler = LLMScheduler(settings.llm_max_concurrency, settings.llm_max_queue)
@@ -2,28 +2,58 @@
 # main.py
 # ---------------------------------------------
 # FastAPI のエントリーポイント。ルーターを定義します。
-# ・/health   : 動作確認
+# ・/health   : 動作確認（プロセスが生きているか。すぐ返る）
+# ・/ready    : 準備完了の確認（埋め込みモデル・Chroma の読み込み状態）
 # ・/ingest   : ドキュメント取り込み
+# ・/ingest/jobs : バックグラウンド取り込み（進捗参照・キャンセル）
+# ・/watcher  : フォルダ監視の状態
 # ・/search   : 文章検索（意味検索）
 # ・/chat     : RAG チャット（Phi-3-mini 使用）
+# ・/chat/stream : RAG チャット（トークンを逐次返すストリーミング版）
+#   どちらも LLM の順番待ち（llm_scheduler.py）を通し、期限に間に合わなければ抜粋の回答を返す
 # ・/preview  : 指定ファイルの先頭抜粋を返す
 # ・/stats    : インデックス統計
+# ・/shards   : シャードの一覧・リセット・作り直し・オフライン（SHARD_BY）
+# ・/metrics  : 処理段階ごとの所要時間・件数（Prometheus 形式）
 # =============================================
-from fastapi import FastAPI, HTTPException
+import asyncio
+import itertools
+import json
+import logging
+import threading
+import time
+from dataclasses import asdict
+from fastapi import FastAPI, HTTPException, Query
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
-from typing import List
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from typing import List, Optional
 
 from .config import settings
 from .schemas import (
-    IngestRequest, IngestResponse,
-    SearchResponse, SearchResult,
+    IngestRequest, IngestResponse, IngestJobStatus,
+    SearchResponse, SearchResult, SearchScope, BatchSearchRequest, BatchSearchResponse,
     ChatRequest, ChatResponse,
     StatsResponse,
 )
-from .vectorstore import get_collection
-from .ingest import ingest_paths
-from .parsers import load_text_from_file
-from .llm import rag_answer
+from .vectorstore import embed_cache_error, get_collection, get_embed_cache, readiness, set_shard_offline, warmup
+from .ingest import backfill_manifest, remove_directory, remove_file, reset_index, shard_sources
+from .manifest import SORT_KEYS, manifest, normalize_path
+from .jobs import job_manager
+from .pipeline import shutdown_workers
+from .watcher import watcher
+from .parsers import read_text_prefix
+from .text_cache import text_cache
+from .recent import recent_index
+from .llm import rag_answer_stream, close_async_client, prompt_text, warmup_client
+from .llm_scheduler import LLMUnavailable, llm_scheduler
+from .context import estimate_tokens, extractive_answer, pack_contexts
+from .retrieval import SEARCH_MODES, Hit, embed_query, retrieve, retrieve_batch
+from .scope import Scope
+from .answer_cache import answer_cache
+from .dedup import duplicate_index
+from . import metrics
+from .metrics import CACHE_LOOKUPS, LLM_DEGRADED, ServerTimingMiddleware, record_stage, stage
 
 app = FastAPI(title="K-nine Demo Backend", version="0.2.0")
 
@@ -34,86 +64,436 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # ブラウザ（開発者ツール）から Server-Timing を読めるように
+    expose_headers=["Server-Timing"],
 )
+if metrics.ENABLED:
+    # 処理段階ごとの所要時間を Server-Timing ヘッダで返す
+    app.add_middleware(ServerTimingMiddleware)
+
+def _background_startup():
+    """
+    起動後の重い初期化を裏で順に行う（その間も /health や /preview などは応答できる）。
+    Chroma を開く → 台帳の補完 → フォルダ監視の開始 → 埋め込みモデルの読み込み。
+    モデルが要る検索・取り込みは、読み込みが終わるまで待ってから処理される。
+    """
+    try:
+        # 旧版で取り込んだインデックスなら、台帳のチャンク数・ID を一度だけ補う
+        backfill_manifest()
+    except Exception:
+        pass  # Chroma を開けなかった（状態は /ready で見える）
+    if settings.watch_enabled:
+        watcher.start()
+    warmup()
+    warmup_client()
+
+@app.on_event("startup")
+def _startup():
+    threading.Thread(target=_background_startup, name="startup-warmup", daemon=True).start()
+    # 最近のファイル索引は裏で作っておく（初回の /recent-files を待たせない）
+    recent_index.refresh()
+
+@app.on_event("shutdown")
+async def _shutdown():
+    watcher.stop()
+    await close_async_client()
+    cache = get_embed_cache()
+    if cache is not None:
+        cache.close()
+    text_cache.close()
+    shutdown_workers()
 
 @app.get("/health")
 def health():
     """起動確認（/docs でAPI一覧も見られます）"""
     return {"status": "ok", "collection": settings.collection_name}
 
+@app.get("/ready")
+def ready():
+    """
+    準備完了の確認。埋め込みモデルと Chroma の読み込み状態を返す。
+    両方 ready なら 200、読み込み中・失敗なら 503（ロードバランサ等の readiness probe 用）。
+    """
+    status = readiness()
+    return JSONResponse(status, status_code=200 if status["ready"] else 503)
+
 @app.post("/ingest", response_model=IngestResponse)
 def ingest(req: IngestRequest):
-    """指定パス群からドキュメントを取り込み、ベクトルDBに追加。"""
-    processed_files, processed_chunks, skipped = ingest_paths(req.paths)
-    return IngestResponse(processed_files=processed_files, processed_chunks=processed_chunks, skipped_files=skipped)
+    """指定パス群からドキュメントを取り込み、ベクトルDBに追加（完了まで待つ）。"""
+    # ジョブとして投入し、他の取り込みと直列化した上で完了を待つ
+    job, _ = job_manager.submit(req.paths)
+    job.done_event.wait()
+    if job.status == "failed":
+        raise HTTPException(status_code=500, detail=job.error)
+    if job.stats is None:
+        raise HTTPException(status_code=409, detail=f"ingest job {job.status}")
+    return IngestResponse(**asdict(job.stats))
+
+@app.get("/watcher")
+def watcher_status():
+    """フォルダ監視の状態（監視方式・反映したバッチ数など）。"""
+    return watcher.status()
+
+@app.post("/ingest/jobs", response_model=IngestJobStatus, status_code=202)
+def submit_ingest_job(req: IngestRequest):
+    """取り込みをバックグラウンドジョブとして投入し、すぐにジョブ ID を返す。"""
+    job, created = job_manager.submit(req.paths)
+    return IngestJobStatus(**job.snapshot(), deduplicated=not created)
+
+@app.get("/ingest/jobs", response_model=List[IngestJobStatus])
+def list_ingest_jobs():
+    """ジョブ一覧（新しい順）。"""
+    return [IngestJobStatus(**job.snapshot()) for job in job_manager.list()]
+
+@app.get("/ingest/jobs/{job_id}", response_model=IngestJobStatus)
+def get_ingest_job(job_id: str):
+    """ジョブの進捗・エラー・結果を返す。"""
+    job = job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return IngestJobStatus(**job.snapshot())
+
+@app.post("/ingest/jobs/{job_id}/cancel", response_model=IngestJobStatus)
+def cancel_ingest_job(job_id: str):
+    """ジョブをキャンセル（書き込み済みのファイルはそのまま残る）。"""
+    job = job_manager.cancel(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return IngestJobStatus(**job.snapshot())
+
+def _to_result(hit: Hit) -> SearchResult:
+    return SearchResult(
+        path=hit.metadata.get("path", ""),
+        score=hit.score,
+        snippet=hit.document[:200].replace("\n", " "),
+        mtime=float(hit.metadata.get("mtime", 0.0)),
+        page=hit.metadata.get("page"),
+        duplicates=hit.duplicates,
+    )
+
+def _search_mode(mode: Optional[str]) -> str:
+    mode = mode or settings.search_mode
+    if mode not in SEARCH_MODES:
+        raise HTTPException(status_code=400, detail=f"mode must be one of {', '.join(SEARCH_MODES)}")
+    return mode
+
+def _scope(scope: Optional[SearchScope]) -> Optional[Scope]:
+    if scope is None:
+        return None
+    s = Scope.create(scope.dir, scope.exts, scope.mtime_from, scope.mtime_to)
+    return None if s.is_empty() else s
 
 @app.get("/search", response_model=SearchResponse)
-def search(q: str, k: int = 5):
-    """意味検索。上位 k 件のチャンクとメタデータを返す。"""
-    col = get_collection()
-    res = col.query(query_texts=[q], n_results=k)
+def search(q: str, k: int = 5, mode: Optional[str] = None, dir: Optional[str] = None,
+           ext: str = "", mtime_from: Optional[float] = None, mtime_to: Optional[float] = None):
+    """
+    検索。上位 k 件のチャンクとメタデータを返す（mode: vector / lexical / hybrid）。
+    dir（フォルダ配下）/ ext（拡張子、カンマ区切り）/ mtime_from, mtime_to で範囲を絞れる。
+    """
+    exts = [e.strip() for e in ext.split(",") if e.strip()]
+    scope = _scope(SearchScope(dir=dir, exts=exts, mtime_from=mtime_from, mtime_to=mtime_to))
+    hits = retrieve(q, k, mode=_search_mode(mode), scope=scope)
+    return SearchResponse(query=q, results=[_to_result(h) for h in hits])
+
+# /search/batch で1回にまとめて処理する質問数（ストリーミング時はこの単位で返す）
+_SEARCH_BATCH_SIZE = 64
+
+@app.post("/search/batch")
+def search_batch(req: BatchSearchRequest):
+    """
+    まとめて検索。埋め込みは一括計算、ベクトル検索は1回の multi-query で行う。
+    結果は queries と同じ順。stream=true なら {"index": i, "query": ..., "results": [...]} を1行ずつ返す。
+    stream=true でも最初のまとまりは返し始める前に検索するので、条件の誤りはそこで 400 になる。
+    返し始めた後に失敗したときは {"type": "error", "detail": ...} の行で終わる（/chat/stream と同じ）。
+    """
+    mode = _search_mode(req.mode)
+    queries = [(q.query, q.k, q.filter, _scope(q.scope)) for q in req.queries]
+
+    def batches():
+        for start in range(0, len(queries), _SEARCH_BATCH_SIZE):
+            part = queries[start:start + _SEARCH_BATCH_SIZE]
+            for offset, hits in enumerate(retrieve_batch(part, mode)):
+                i = start + offset
+                yield i, SearchResponse(query=queries[i][0], results=[_to_result(h) for h in hits])
 
-    docs = res.get("documents", [[]])[0]
-    metas = res.get("metadatas", [[]])[0]
-    dists = res.get("distances", [[]])[0]
+    if req.stream:
+        results = batches()
+        try:
+            first = next(results, None)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+        def lines():
+            try:
+                for i, res in itertools.chain([first] if first is not None else [], results):
+                    yield json.dumps({"index": i, **res.model_dump()}, ensure_ascii=False) + "\n"
+            except Exception as e:
+                yield json.dumps({"type": "error", "detail": str(e)}, ensure_ascii=False) + "\n"
+        return StreamingResponse(lines(), media_type="application/x-ndjson")
+    try:
+        return BatchSearchResponse(results=[res for _, res in batches()])
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
-    results: List[SearchResult] = []
-    for doc, meta, score in zip(docs, metas, dists):
-        snippet = doc[:200].replace("\n", " ")
-        results.append(SearchResult(
-            path=meta.get("path", ""),
-            score=float(score) if isinstance(score, (int, float)) else 0.0,
-            snippet=snippet,
-            mtime=float(meta.get("mtime", 0.0)),
-        ))
+def _retrieve_for_chat(query: str, k: int, mode: str, scope: Optional[Scope] = None):
+    """チャット用の検索。回答キャッシュの類似判定用に質問ベクトルも返す。"""
+    qvec = embed_query(query) if mode != "lexical" else None
+    return qvec, retrieve(query, k, qvec, mode=mode, scope=scope)
 
-    return SearchResponse(query=q, results=results)
+def _cached_answer(query: str, hits: List[Hit], qvec) -> Optional[str]:
+    if not settings.answer_cache_enabled:
+        return None
+    entry = answer_cache.get(query, [h.id for h in hits], qvec)
+    CACHE_LOOKUPS.inc(1, "answer", "miss" if entry is None else "hit")
+    return entry.answer if entry is not None else None
+
+def _store_answer(query: str, hits: List[Hit], qvec, answer: str):
+    if settings.answer_cache_enabled and answer:
+        paths = [h.metadata.get("path", "") for h in hits]
+        answer_cache.put(query, [h.id for h in hits], answer, paths, qvec)
+
+def _pack(query: str, hits: List[Hit]):
+    """文脈を組み立て、(文脈リスト, プロンプト統計) を返す。"""
+    with stage("context_pack"):
+        packed = pack_contexts(hits, settings.context_token_budget, settings.chunk_overlap_chars,
+                               settings.context_dedup_threshold)
+        prompt = prompt_text(query, packed.contexts)
+    prompt_stats = {
+        "prompt_chars": len(prompt),
+        "prompt_tokens_est": estimate_tokens(prompt),
+        "tokens_saved_est": packed.tokens_saved_est,
+    }
+    return packed.contexts, prompt_stats
+
+logger = logging.getLogger(__name__)
+
+def _deadline(req: ChatRequest) -> float:
+    """回答の期限（time.monotonic() の値。リクエストの受け付けから数える）。"""
+    seconds = req.deadline_seconds if req.deadline_seconds is not None else settings.llm_deadline_seconds
+    return time.monotonic() + max(0.0, seconds)
+
+def _degraded_answer(query: str, hits: List[Hit], reason: str) -> str:
+    """LLM の回答が得られないときの、検索上位チャンクからの抜粋の回答（前置きは理由ごと）。"""
+    LLM_DEGRADED.inc(1, reason)
+    with stage("extractive"):
+        return extractive_answer(query, hits, reason)
+
+async def _first_token(tokens, ticket) -> Optional[str]:
+    """
+    LLM の最初のトークンを待つ。ここまでは期限で打ち切る（LLMUnavailable）。
+    流れ始めたら期限は見ない（生成全体の上限は LLM_TIMEOUT）。空の回答なら None。
+    """
+    try:
+        return await asyncio.wait_for(tokens.__anext__(), ticket.remaining())
+    except StopAsyncIteration:
+        return None
+    except asyncio.TimeoutError:
+        raise LLMUnavailable("deadline")
+    except Exception:
+        # 設定の誤り・接続できない等。原因は残してから抜粋の回答に切り替える
+        logger.exception("LLM request failed; falling back to an extractive answer")
+        raise LLMUnavailable("error")
 
 @app.post("/chat", response_model=ChatResponse)
-def chat(req: ChatRequest):
-    """RAG チャット。検索上位チャンクを文脈に回答を生成。"""
-    col = get_collection()
-    res = col.query(query_texts=[req.query], n_results=req.top_k)
-    docs = res.get("documents", [[]])[0]
-    metas = res.get("metadatas", [[]])[0]
+async def chat(req: ChatRequest):
+    """
+    RAG チャット。検索上位チャンクを文脈に回答を生成。
+    LLM が混んでいて期限までに回答が始まらなければ、抜粋の回答を degraded=true で返す。
+    """
+    deadline = _deadline(req)
+    # 検索（埋め込み計算）は CPU 処理なのでスレッドプールへ
+    qvec, hits = await run_in_threadpool(_retrieve_for_chat, req.query, req.top_k, _search_mode(req.mode),
+                                         _scope(req.scope))
+    citations = [_to_result(h) for h in hits]
+
+    cached = _cached_answer(req.query, hits, qvec)
+    if cached is not None:
+        return ChatResponse(answer=cached, citations=citations, cached=True)
+
+    contexts, prompt_stats = _pack(req.query, hits)
+    ticket = None
+    try:
+        ticket = llm_scheduler.submit(deadline)
+        async for _ in llm_scheduler.wait_turn(ticket):
+            pass
+        record_stage("llm_queue", ticket.waited())
+        # 期限は最初のトークンまで（/chat/stream と同じ）。長い回答も途中で捨てない
+        tokens = rag_answer_stream(req.query, contexts).__aiter__()
+        first = await _first_token(tokens, ticket)
+        parts = [first] if first is not None else []
+        async for token in tokens:
+            parts.append(token)
+        answer = "".join(parts).strip()
+    except LLMUnavailable as e:
+        return ChatResponse(answer=_degraded_answer(req.query, hits, e.reason), citations=citations,
+                            degraded=True, degraded_reason=e.reason,
+                            queue_ms=ticket.waited() * 1000 if ticket is not None else None, **prompt_stats)
+    finally:
+        if ticket is not None:
+            llm_scheduler.release(ticket)
+    _store_answer(req.query, hits, qvec, answer)
+    return ChatResponse(answer=answer, citations=citations, queue_ms=ticket.waited() * 1000, **prompt_stats)
 
-    answer = rag_answer(req.query, docs)
+@app.post("/chat/stream")
+async def chat_stream(req: ChatRequest):
+    """
+    RAG チャット（ストリーミング版）。NDJSON で1行ずつ返す。
+    1) {"type": "citations", ...}  … 先に根拠を返す
+    1') {"type": "queue", "position": n}  … LLM の順番待ちの間、順番（1 = 次）が変わるたびに
+    2) {"type": "token", "content": ...}  … 生成されたそばから
+    3) {"type": "done", "ttft_ms": ..., "total_ms": ..., "cached": ..., "degraded": ...}
+    最初のトークンまでに期限を過ぎそうなら、抜粋の回答を1トークンとして返す（degraded=true）。
+    """
+    started = time.perf_counter()
+    deadline = _deadline(req)
+    qvec, hits = await run_in_threadpool(_retrieve_for_chat, req.query, req.top_k, _search_mode(req.mode),
+                                         _scope(req.scope))
+    cached = _cached_answer(req.query, hits, qvec)
 
-    citations: List[SearchResult] = []
-    for doc, meta in zip(docs, metas):
-        citations.append(SearchResult(
-            path=meta.get("path", ""),
-            score=0.0,  # デモではスコア省略
-            snippet=doc[:200].replace("\n", " "),
-            mtime=float(meta.get("mtime", 0.0)),
-        ))
+    async def events():
+        citations = [_to_result(h).model_dump() for h in hits]
+        yield json.dumps({"type": "citations", "citations": citations}, ensure_ascii=False) + "\n"
+        ttft_ms = None
+        prompt_stats = {}
+        degraded_reason = None
+        queue_ms = None
+        if cached is not None:
+            # キャッシュヒット：回答全体を1トークンとして返す
+            ttft_ms = (time.perf_counter() - started) * 1000
+            yield json.dumps({"type": "token", "content": cached}, ensure_ascii=False) + "\n"
+        else:
+            parts: List[str] = []
+            contexts, prompt_stats = _pack(req.query, hits)
+            ticket = None
+            try:
+                ticket = llm_scheduler.submit(deadline)
+                async for position in llm_scheduler.wait_turn(ticket):
+                    yield json.dumps({"type": "queue", "position": position}) + "\n"
+                queue_ms = ticket.waited() * 1000
+                record_stage("llm_queue", ticket.waited())
+                tokens = rag_answer_stream(req.query, contexts).__aiter__()
+                # 最初のトークンまでは期限で打ち切る（流れ始めたら最後まで返す）
+                token = await _first_token(tokens, ticket)
+                if token is not None:
+                    ttft_ms = (time.perf_counter() - started) * 1000
+                    parts.append(token)
+                    yield json.dumps({"type": "token", "content": token}, ensure_ascii=False) + "\n"
+                    async for token in tokens:
+                        parts.append(token)
+                        yield json.dumps({"type": "token", "content": token}, ensure_ascii=False) + "\n"
+                _store_answer(req.query, hits, qvec, "".join(parts).strip())
+            except LLMUnavailable as e:
+                degraded_reason = e.reason
+                answer = _degraded_answer(req.query, hits, e.reason)
+                ttft_ms = (time.perf_counter() - started) * 1000
+                yield json.dumps({"type": "token", "content": answer}, ensure_ascii=False) + "\n"
+            except Exception as e:
+                yield json.dumps({"type": "error", "detail": str(e)}, ensure_ascii=False) + "\n"
+            finally:
+                if ticket is not None:
+                    if queue_ms is None:
+                        queue_ms = ticket.waited() * 1000
+                    llm_scheduler.release(ticket)
+        total_ms = (time.perf_counter() - started) * 1000
+        yield json.dumps({"type": "done", "ttft_ms": ttft_ms, "total_ms": total_ms,
+                          "cached": cached is not None, "degraded": degraded_reason is not None,
+                          "degraded_reason": degraded_reason, "queue_ms": queue_ms, **prompt_stats}) + "\n"
 
-    return ChatResponse(answer=answer, citations=citations)
+    return StreamingResponse(events(), media_type="application/x-ndjson")
 
 @app.get("/preview")
 def preview(path: str, nchars: int = 800):
     """指定されたファイルの先頭を返す（プレーンテキスト）。"""
     try:
-        text = load_text_from_file(path)
+        st = os.stat(path)
+        cached = text_cache.get(path, st.st_mtime, st.st_size)
+        if cached is not None and (cached.complete or len(cached.text) >= nchars):
+            return {"path": path, "preview": cached.text[:nchars]}
+        # 先頭だけ抽出（キャッシュに入れる分は少し多めに読む）
+        text, complete = read_text_prefix(path, max(nchars, text_cache.max_chars))
+        text_cache.put(path, st.st_mtime, st.st_size, text, complete)
         return {"path": path, "preview": text[:nchars]}
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics_endpoint():
+    """処理段階ごとの所要時間・バッチサイズ・キャッシュヒット・LLM トークン数（Prometheus 形式）。"""
+    if not metrics.ENABLED:
+        raise HTTPException(status_code=404, detail="Metrics are disabled (METRICS_ENABLED=false)")
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
 @app.get("/stats", response_model=StatsResponse)
 def stats():
     """インデックスの基本統計を返す。"""
     col = get_collection()
     try:
-        n = col.count()
+        index_stats = col.stats()
+        n = index_stats["count"]
     except Exception:
-        n = 0
+        index_stats, n = None, 0
+    cache = get_embed_cache()
     return StatsResponse(
         collection=settings.collection_name,
         num_embeddings=n,
+        num_files=manifest.totals()[0],
         embed_model=settings.embed_model,
         llm_model=settings.llm_model,
+        embed_cache=cache.stats() if cache is not None else (
+            {"error": embed_cache_error()} if embed_cache_error() else None),
+        answer_cache=answer_cache.stats() if settings.answer_cache_enabled else None,
+        text_cache=text_cache.stats(),
+        vector_index=index_stats,
+        dedup=duplicate_index.stats(),
+        llm_scheduler=llm_scheduler.stats(),
     )
 
+@app.get("/shards")
+def list_shards():
+    """シャードごとの状態（online / offline / failed）・世代・件数。"""
+    col = get_collection()
+    return {"shard_by": col.router.by, "shards": [s.status() for s in col.shards.values()]}
+
+def _shard_or_404(shard_id: str):
+    try:
+        return get_collection().shard(shard_id)
+    except KeyError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+
+@app.post("/shards/{shard_id}/reset")
+def reset_shard(shard_id: str):
+    """シャード1つだけを空にする（ほかのシャードの検索・取り込みはそのまま）。"""
+    _shard_or_404(shard_id)
+    count = reset_index(shard_id)
+    return {"status": "ok", "shard": shard_id, "deleted_count": count}
+
+@app.post("/shards/{shard_id}/rebuild", response_model=IngestJobStatus, status_code=202)
+def rebuild_shard(shard_id: str):
+    """
+    シャードを空にして、入っていたフォルダ（ファイル）を取り込み直すジョブを投入する。
+    作り直しの途中を検索に見せたくなければ、先に offline にしておき、ジョブが終わったら online に戻す。
+    """
+    _shard_or_404(shard_id)
+    paths = shard_sources(shard_id)
+    # 取り込み直すものが無いなら、空にする前に断る（中身を消したまま 409 を返さない）
+    if not paths:
+        raise HTTPException(status_code=409, detail=f"Shard {shard_id} has no files to re-ingest")
+    reset_index(shard_id)
+    job, created = job_manager.submit(paths)
+    return IngestJobStatus(**job.snapshot(), deduplicated=not created)
+
+@app.post("/shards/{shard_id}/offline")
+def shard_offline(shard_id: str):
+    """シャードを検索の対象から外す（取り込み・リセットはできる）。"""
+    _shard_or_404(shard_id)
+    return set_shard_offline(shard_id, True)
+
+@app.post("/shards/{shard_id}/online")
+def shard_online(shard_id: str):
+    """シャードを検索の対象に戻す。"""
+    _shard_or_404(shard_id)
+    return set_shard_offline(shard_id, False)
+
 from pydantic import BaseModel
 import subprocess
 import sys
@@ -174,32 +554,35 @@ def create_file(req: FolderRequest):
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+def _ingested_among(paths: List[str]) -> set:
+    """paths のうち取り込み済みのもの（台帳はまとめて1回で引く）。"""
+    # 台帳と同じ形（絶対パス）にそろえて引く
+    normalized = {p: normalize_path(p) for p in paths}
+    found = manifest.existing(normalized.values())
+    return {p for p in paths if normalized[p] in found}
+
 @app.get("/recent-files")
-def recent_files(limit: int = 5):
-    """最近変更されたファイルを返す"""
+def recent_files(limit: int = 5, ext: str = "", ingested: Optional[bool] = None):
+    """
+    最近変更されたファイルを返す（recent.py の索引から。ツリー全体は歩かない）
+    ext: 拡張子で絞り込み（カンマ区切り。例: pdf,docx）
+    ingested: true なら取り込み済みのみ、false なら未取り込みのみ
+    """
     try:
+        exts = [e.strip() for e in ext.split(",") if e.strip()]
+        keep = None
+        if ingested is not None:
+            keep = lambda paths: (_ingested_among(paths) if ingested
+                                  else set(paths) - _ingested_among(paths))
         files = []
-        # カレントディレクトリ以下のファイルを走査（隠しファイル除外）
-        for root, dirs, filenames in os.walk("."):
-            dirs[:] = [d for d in dirs if not d.startswith(".")]
-            for filename in filenames:
-                if filename.startswith("."):
-                    continue
-                filepath = os.path.join(root, filename)
-                try:
-                    mtime = os.path.getmtime(filepath)
-                    files.append({
-                        "name": filename,
-                        "path": filepath,
-                        "mtime": mtime,
-                        "mtime_str": str(mtime) # 簡易的な文字列表現
-                    })
-                except OSError:
-                    continue
-        
-        # 更新日時で降順ソート
-        files.sort(key=lambda x: x["mtime"], reverse=True)
-        return {"files": files[:limit]}
+        for mtime, filepath in recent_index.top(limit, exts, keep):
+            files.append({
+                "name": os.path.basename(filepath),
+                "path": filepath,
+                "mtime": mtime,
+                "mtime_str": str(mtime) # 簡易的な文字列表現
+            })
+        return {"files": files}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -248,44 +631,48 @@ finally:
 def reset_database():
     """データベース（記憶）をリセットする"""
     try:
-        col = get_collection()
-        count = col.count()
-        if count > 0:
-            all_data = col.get()
-            if all_data['ids']:
-                col.delete(ids=all_data['ids'])
+        count = reset_index()
         return {"status": "ok", "deleted_count": count}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/ingested-files")
-def list_ingested_files():
-    """取り込み済みファイルの一覧を返す"""
+def list_ingested_files(
+    offset: int = Query(0, ge=0),
+    limit: int = Query(1000, ge=1, le=10000),
+    sort: str = "path",
+    order: str = "asc",
+    prefix: str = "",
+):
+    """
+    取り込み済みファイルの一覧を返す（台帳から。Chroma の全件読み出しはしない）
+    sort: path / mtime / size / chunk_count / ingested_at、order: asc / desc、prefix: パスの前方一致
+    1回で返すのは limit 件まで。続きがあれば next_offset（次に渡す offset）を返す（無ければ null）
+    """
+    if sort not in SORT_KEYS:
+        raise HTTPException(status_code=400, detail=f"sort must be one of {', '.join(SORT_KEYS)}")
+    if order not in ("asc", "desc"):
+        raise HTTPException(status_code=400, detail="order must be asc or desc")
     try:
-        col = get_collection()
-        # 全データのメタデータを取得
-        # データ量が多い場合はページネーションが必要だが、デモ用なので全件取得
-        data = col.get(include=["metadatas"])
-        metadatas = data.get("metadatas", [])
-        
-        # パスごとにユニークにする
-        unique_files = {}
-        for meta in metadatas:
-            path = meta.get("path")
-            if path:
-                if path not in unique_files:
-                    unique_files[path] = {
-                        "path": path,
-                        "mtime": meta.get("mtime", 0),
-                        "chunk_count": 0
-                    }
-                unique_files[path]["chunk_count"] += 1
-        
-        # リスト化してソート
-        file_list = list(unique_files.values())
-        file_list.sort(key=lambda x: x["path"])
-        
-        return {"files": file_list}
+        total, records = manifest.list_files(offset, limit, sort, order == "desc", prefix)
+        file_list = [
+            {
+                "path": r.path,
+                "mtime": r.mtime,
+                "size": r.size,
+                "chunk_count": r.chunk_count,
+                "ingested_at": r.ingested_at,
+            }
+            for r in records
+        ]
+        next_offset = offset + len(file_list)
+        return {
+            "files": file_list,
+            "total": total,
+            "offset": offset,
+            "limit": limit,
+            "next_offset": next_offset if next_offset < total else None,
+        }
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -296,12 +683,23 @@ class DeleteFileRequest(BaseModel):
 def delete_file(req: DeleteFileRequest):
     """指定されたパスのドキュメントを削除する"""
     try:
-        col = get_collection()
-        col.delete(where={"path": req.path})
+        remove_file(req.path)
         return {"status": "ok", "path": req.path}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+class DeleteDirectoryRequest(BaseModel):
+    path: str
+
+@app.post("/delete-directory")
+def delete_directory(req: DeleteDirectoryRequest):
+    """指定フォルダ配下のドキュメントをまとめて削除する"""
+    try:
+        files, chunks = remove_directory(req.path)
+        return {"status": "ok", "path": req.path, "deleted_files": files, "deleted_chunks": chunks}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
 @app.post("/list-directory")
 def list_directory(req: FolderRequest):
     """指定パスのディレクトリ内容を返す"""
@@ -0,0 +1,200 @@
+# =============================================
+# manifest.py
+# ---------------------------------------------
+# 取り込み済みファイルの「台帳（マニフェスト）」。
+# ・パスごとに (サイズ, mtime, SHA-256) を SQLite に永続化
+# ・再取り込み時、stat が同じファイルは開かずにスキップ
+# ・ハッシュが同じファイルは埋め込みをスキップ
+# ・チャンク数とチャンク ID の接頭辞も持つので、ファイル単位の一覧・削除に
+#   Chroma の全件読み出しが要らない（/ingested-files, /stats, /delete-file）
+# ・パスは normalize_path()（絶対パス）にそろえて登録し、引くときも同じ形で引く
+#   （"./docs/a.txt" と "docs/a.txt" と "/srv/docs/a.txt" を同じファイルとして扱う）
+# =============================================
+import os
+import sqlite3
+import threading
+from typing import Iterable, Iterator, List, NamedTuple, Optional, Set, Tuple
+
+from .config import settings
+
+class FileRecord(NamedTuple):
+    path: str
+    size: int
+    mtime: float
+    digest: str
+    version: int
+    chunk_count: int = 0
+    id_prefix: str = ""       # チャンク ID は "{id_prefix}:{0..chunk_count-1}"
+    ingested_at: float = 0.0
+
+    def chunk_ids(self) -> List[str]:
+        return [f"{self.id_prefix}:{i}" for i in range(self.chunk_count)] if self.id_prefix else []
+
+_COLUMNS = "path, size, mtime, digest, version, chunk_count, id_prefix, ingested_at"
+
+# /ingested-files で並べ替えに使える列
+SORT_KEYS = ("path", "mtime", "size", "chunk_count", "ingested_at")
+
+def _prefix_range(prefix: str) -> Tuple[str, str]:
+    """前方一致を主キー索引の範囲検索で行うための (下限, 上限)。"""
+    return prefix, prefix + "\U0010ffff"
+
+def normalize_path(path: str) -> str:
+    """台帳（とチャンクの path メタデータ）に使う形。起動時の作業フォルダからの絶対パス。"""
+    return os.path.abspath(path)
+
+def dir_prefix(root: str) -> str:
+    """フォルダ配下を引くときの接頭辞（末尾に区切りを1つ付ける。"a/b" で "a/bc/..." を拾わない）。"""
+    return root.rstrip("/\\") + os.sep
+
+class FileManifest:
+    """パス → (size, mtime, digest, チャンク数, ID 接頭辞) の永続台帳。スレッドセーフ。"""
+
+    def __init__(self, db_path: str):
+        parent = os.path.dirname(db_path)
+        if parent:
+            os.makedirs(parent, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        with self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS files ("
+                " path TEXT PRIMARY KEY,"
+                " size INTEGER NOT NULL,"
+                " mtime REAL NOT NULL,"
+                " digest TEXT NOT NULL,"
+                " version INTEGER NOT NULL DEFAULT 0)"
+            )
+            # 旧形式の台帳に列を足す
+            cols = {r[1] for r in self._conn.execute("PRAGMA table_info(files)")}
+            for name, decl in (("chunk_count", "INTEGER NOT NULL DEFAULT 0"),
+                               ("id_prefix", "TEXT NOT NULL DEFAULT ''"),
+                               ("ingested_at", "REAL NOT NULL DEFAULT 0")):
+                if name not in cols:
+                    self._conn.execute(f"ALTER TABLE files ADD COLUMN {name} {decl}")
+            for key in SORT_KEYS[1:]:
+                self._conn.execute(f"CREATE INDEX IF NOT EXISTS files_{key} ON files({key})")
+
+    def get(self, path: str) -> Optional[FileRecord]:
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT {_COLUMNS} FROM files WHERE path = ?", (path,)
+            ).fetchone()
+        return FileRecord(*row) if row else None
+
+    def existing(self, paths: Iterable[str]) -> Set[str]:
+        """paths のうち台帳にあるものを返す（1件ずつ引かず、まとめて問い合わせる）。"""
+        paths = list(dict.fromkeys(paths))
+        found: Set[str] = set()
+        with self._lock:
+            # SQLite の変数の数の上限（既定 999）に収まるように分ける
+            for start in range(0, len(paths), 500):
+                part = paths[start:start + 500]
+                rows = self._conn.execute(
+                    f"SELECT path FROM files WHERE path IN ({','.join('?' * len(part))})", part
+                ).fetchall()
+                found.update(r[0] for r in rows)
+        return found
+
+    def upsert_many(self, records: List[FileRecord]):
+        """まとめて登録（Chroma への書き込み成功後に呼ぶ）。"""
+        if not records:
+            return
+        with self._lock, self._conn:
+            self._conn.executemany(
+                f"INSERT OR REPLACE INTO files ({_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                records,
+            )
+
+    def remove(self, path: str):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM files WHERE path = ?", (path,))
+
+    def remove_many(self, paths: List[str]):
+        with self._lock, self._conn:
+            self._conn.executemany("DELETE FROM files WHERE path = ?", [(p,) for p in paths])
+
+    def remove_under(self, prefix: str) -> int:
+        """prefix で始まるパスの登録をまとめて削除。削除件数を返す。"""
+        lo, hi = _prefix_range(prefix)
+        with self._lock, self._conn:
+            cur = self._conn.execute("DELETE FROM files WHERE path >= ? AND path < ?", (lo, hi))
+        return cur.rowcount
+
+    def rename(self, old: str, new: str, size: int, mtime: float) -> bool:
+        """path を付け替える（チャンク ID・チャンク数はそのまま）。"""
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM files WHERE path = ?", (new,))
+            cur = self._conn.execute(
+                "UPDATE files SET path = ?, size = ?, mtime = ? WHERE path = ?", (new, size, mtime, old)
+            )
+        return cur.rowcount > 0
+
+    def paths_under(self, root: str) -> List[str]:
+        """root 配下として登録されているパス一覧（消えたファイルの検出用。under() と同じ範囲）。"""
+        lo, hi = _prefix_range(dir_prefix(root))
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT path FROM files WHERE path >= ? AND path < ?", (lo, hi)
+            ).fetchall()
+        return [r[0] for r in rows]
+
+    def under(self, prefix: str) -> Iterator[FileRecord]:
+        """prefix で始まるパスの登録を順に返す（大きなフォルダでも少しずつ読む）。"""
+        lo, hi = _prefix_range(prefix)
+        last = None
+        while True:
+            with self._lock:
+                if last is None:
+                    rows = self._conn.execute(
+                        f"SELECT {_COLUMNS} FROM files WHERE path >= ? AND path < ? ORDER BY path LIMIT 500",
+                        (lo, hi),
+                    ).fetchall()
+                else:
+                    rows = self._conn.execute(
+                        f"SELECT {_COLUMNS} FROM files WHERE path > ? AND path < ? ORDER BY path LIMIT 500",
+                        (last, hi),
+                    ).fetchall()
+            if not rows:
+                return
+            for row in rows:
+                yield FileRecord(*row)
+            last = rows[-1][0]
+
+    def list_files(self, offset: int = 0, limit: int = 100, sort: str = "path",
+                   descending: bool = False, prefix: str = "") -> Tuple[int, List[FileRecord]]:
+        """ページ単位の一覧。(条件に合う総数, このページの登録) を返す。"""
+        if sort not in SORT_KEYS:
+            raise ValueError(f"sort must be one of {SORT_KEYS}")
+        where, params = "", ()
+        if prefix:
+            where, params = " WHERE path >= ? AND path < ?", _prefix_range(prefix)
+        order = "DESC" if descending else "ASC"
+        with self._lock:
+            total = self._conn.execute(f"SELECT COUNT(*) FROM files{where}", params).fetchone()[0]
+            rows = self._conn.execute(
+                f"SELECT {_COLUMNS} FROM files{where} ORDER BY {sort} {order}, path {order} LIMIT ? OFFSET ?",
+                params + (limit, offset),
+            ).fetchall()
+        return total, [FileRecord(*r) for r in rows]
+
+    def without_chunk_ids(self) -> List[FileRecord]:
+        """チャンク ID が未記録の登録（旧形式の台帳の名残）。"""
+        with self._lock:
+            rows = self._conn.execute(f"SELECT {_COLUMNS} FROM files WHERE id_prefix = ''").fetchall()
+        return [FileRecord(*r) for r in rows]
+
+    def totals(self) -> Tuple[int, int]:
+        """(ファイル数, チャンク数)"""
+        with self._lock:
+            files, chunks = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(chunk_count), 0) FROM files"
+            ).fetchone()
+        return files, chunks
+
+    def clear(self):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM files")
+
+# アプリ全体で共有する台帳（Chroma の保存先に並べて置く）
+manifest = FileManifest(os.path.join(settings.chroma_dir, "k9_manifest.sqlite3"))
@@ -0,0 +1,208 @@
+# =============================================
+# metrics.py
+# ---------------------------------------------
+# 処理段階ごとの所要時間・件数の計測（/metrics と Server-Timing ヘッダ）。
+# ・ヒストグラムとカウンタを Prometheus のテキスト形式で /metrics に出す
+# ・stage("embed") で囲んだ区間は、k9_stage_seconds{stage="embed"} に記録し、
+#   リクエスト中なら Server-Timing ヘッダにも載せる（同じ段階は合算）
+# ・METRICS_ENABLED=false なら、stage() は何もしない共有オブジェクトを返し、
+#   カウンタ類も即 return（ホットパスに残るのは関数呼び出し1回だけ）
+# ・取り込みの読み込み・ハッシュ・抽出はワーカープロセスで測り、結果メッセージに載せて
+#   親プロセスで record_stage() する（pipeline.py）
+# =============================================
+import bisect
+import threading
+import time
+from contextvars import ContextVar
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from .config import settings
+
+ENABLED = settings.metrics_enabled
+
+# 所要時間（秒）とバッチサイズ（件）のバケット
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024, 4096)
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _label_text(names: Sequence[str], values: Tuple[str, ...], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+class Counter:
+    """単調増加のカウンタ（ラベルの値ごと）。"""
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        self.name, self.help, self.labels = name, help, tuple(labels)
+        self._lock = threading.Lock()
+        self._values: Dict[Tuple[str, ...], float] = {}
+        _REGISTRY.append(self)
+
+    def inc(self, value: float = 1.0, *labels: str):
+        if not ENABLED:
+            return
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for labels, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_label_text(self.labels, labels)} {value:g}")
+        return lines
+
+class Histogram:
+    """バケット付きヒストグラム（ラベルの値ごとに件数・合計）。"""
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.name, self.help, self.labels = name, help, tuple(labels)
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        # ラベル → [バケットごとの件数（累積ではない。最後は +Inf）, 合計, 件数]
+        self._series: Dict[Tuple[str, ...], list] = {}
+        _REGISTRY.append(self)
+
+    def observe(self, value: float, *labels: str):
+        if not ENABLED:
+            return
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][i] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for labels, (counts, total, n) in sorted(self._series.items()):
+                cumulative = 0
+                for bound, c in zip(self.buckets + (float("inf"),), counts):
+                    cumulative += c
+                    le = "+Inf" if bound == float("inf") else f"{bound:g}"
+                    le_label = 'le="%s"' % le
+                    lines.append(f"{self.name}_bucket{_label_text(self.labels, labels, le_label)} {cumulative}")
+                lines.append(f"{self.name}_sum{_label_text(self.labels, labels)} {total:g}")
+                lines.append(f"{self.name}_count{_label_text(self.labels, labels)} {n}")
+        return lines
+
+_REGISTRY: List[object] = []
+
+# ---- 計測項目 ----
+
+STAGE_SECONDS = Histogram("k9_stage_seconds", "Duration of each processing stage in seconds.", ("stage",))
+HTTP_SECONDS = Histogram("k9_http_request_seconds", "HTTP request duration until the response starts.",
+                         ("method", "route", "status"))
+EMBED_BATCH_SIZE = Histogram("k9_embed_batch_size", "Texts per embedding model call.", (), SIZE_BUCKETS)
+EMBED_REQUESTS_PER_BATCH = Histogram("k9_embed_server_requests_per_batch",
+                                     "Requests merged into one model call by the embedding server.", (),
+                                     SIZE_BUCKETS)
+WRITE_BATCH_SIZE = Histogram("k9_ingest_write_batch_size", "Chunks per vector index upsert during ingest.", (),
+                             SIZE_BUCKETS)
+TEXTS_EMBEDDED = Counter("k9_texts_embedded_total", "Texts passed through the embedding model.")
+CHUNKS_WRITTEN = Counter("k9_chunks_written_total", "Chunks written to the index by ingest.")
+CHUNKS_DEDUPLICATED = Counter("k9_chunks_deduplicated_total",
+                              "Near-duplicate chunks stored as aliases instead of being embedded.")
+FILES_INGESTED = Counter("k9_ingest_files_total", "Files seen by ingest, by result.", ("result",))
+CACHE_LOOKUPS = Counter("k9_cache_lookups_total", "Cache lookups, by cache and result.", ("cache", "result"))
+LLM_REQUESTS = Counter("k9_llm_requests_total", "LLM completion requests, by kind and status.", ("kind", "status"))
+LLM_TOKENS = Counter("k9_llm_tokens_total", "LLM tokens in (prompt) and out (completion).", ("direction",))
+LLM_DEGRADED = Counter("k9_llm_degraded_total", "Chat answers replaced by an extractive answer, by reason.",
+                       ("reason",))
+
+# ---- 段階の計測と Server-Timing ----
+
+# リクエストごとの [(段階, 秒)]。リクエスト外（取り込みジョブなど）では None
+_request_timings: ContextVar[Optional[list]] = ContextVar("k9_request_timings", default=None)
+
+def record_stage(name: str, seconds: float):
+    """別の場所で測った所要時間を記録する。"""
+    if not ENABLED:
+        return
+    STAGE_SECONDS.observe(seconds, name)
+    timings = _request_timings.get()
+    if timings is not None:
+        timings.append((name, seconds))
+
+class _Stage:
+    __slots__ = ("name", "started")
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        record_stage(self.name, time.perf_counter() - self.started)
+        return False
+
+class _NoopStage:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+_NOOP_STAGE = _NoopStage()
+
+def stage(name: str):
+    """with stage("embed"): ... で区間の所要時間を記録する。"""
+    return _Stage(name) if ENABLED else _NOOP_STAGE
+
+def server_timing(timings: List[Tuple[str, float]], total: float) -> str:
+    """Server-Timing ヘッダの値（同じ段階は合算。dur はミリ秒）。"""
+    merged: Dict[str, float] = {}
+    for name, seconds in timings:
+        merged[name] = merged.get(name, 0.0) + seconds
+    merged["total"] = total
+    return ", ".join(f"{name};dur={seconds * 1000:.2f}" for name, seconds in merged.items())
+
+class ServerTimingMiddleware:
+    """
+    リクエストごとに段階の記録先を用意し、応答ヘッダに Server-Timing を付ける ASGI ミドルウェア。
+    ストリーミング応答ではヘッダを送った時点（最初の行の前）までの段階が載る。
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        timings: list = []
+        token = _request_timings.set(timings)
+        started = time.perf_counter()
+
+        async def send_with_timing(message):
+            if message["type"] == "http.response.start":
+                total = time.perf_counter() - started
+                route = scope.get("route")
+                HTTP_SECONDS.observe(total, scope["method"], getattr(route, "path", "other"),
+                                     str(message["status"]))
+                headers = list(message.get("headers", []))
+                headers.append((b"server-timing", server_timing(timings, total).encode("latin-1")))
+                message = dict(message, headers=headers)
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _request_timings.reset(token)
+
+def render() -> str:
+    """Prometheus のテキスト形式（version 0.0.4）。"""
+    lines: List[str] = []
+    for metric in _REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
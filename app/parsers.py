@@ -3,37 +3,166 @@
 # ---------------------------------------------
 # ファイルからテキストを抽出する関数群。
 # ・PDF: PyMuPDF
-# ・Word: python-docx
+# ・Word: document.xml を標準ライブラリで少しずつ読む（zipfile + ElementTree.iterparse）
 # ・TXT/MD: そのまま読み込み
+# iter_text_segments() はページ/段落/ブロック単位で少しずつ返すので、
+# 巨大なファイルでも全文をメモリに載せずに済みます（取り込みはこちらを使う）。
+# 取り込みではファイルの中身（bytes / メモリマップ）を data で渡し、ハッシュ計算と同じ
+# 読み込み結果から抽出します（ファイルを開き直さない。pipeline.py）。
+# read_text_prefix() は先頭だけ必要なとき用（/preview）で、必要な分を読んだら止めます。
 # =============================================
+import codecs
+import io
 import os
+import zipfile
+from typing import Iterator, List, Optional, Tuple
+from xml.etree import ElementTree
+
 import fitz  # PyMuPDF
-import docx
 
 SUPPORTED_EXTS = {".pdf", ".docx", ".txt", ".md"}
 
-def load_text_from_file(path: str) -> str:
-    """拡張子に応じてファイルを読み込み、プレーンテキストを返す。"""
+# テキストファイルを読む単位（文字数。メモリ上の中身から読むときはバイト数）
+_TEXT_BLOCK_CHARS = 64 * 1024
+
+# (テキスト, ページ番号) ページ番号は PDF のみ（1 始まり）、それ以外は None
+Segment = Tuple[str, Optional[int]]
+
+def iter_text_segments(path: str, data=None) -> Iterator[Segment]:
+    """
+    拡張子に応じてファイルを少しずつ読み、テキスト片を順に返す。
+    全部つなげると load_text_from_file() の結果と同じになる（区切りの改行も含む）。
+    data（ファイルの中身。bytes か memoryview）を渡すと、ファイルは開かずにそこから読む。
+    """
     ext = os.path.splitext(path)[1].lower()
     if ext == ".pdf":
-        return _read_pdf(path)
+        return _iter_pdf(path, data)
     if ext == ".docx":
-        return _read_docx(path)
+        return _iter_docx_xml(path, data)
     if ext in {".txt", ".md"}:
-        return _read_text(path)
+        return _iter_text(path) if data is None else _iter_text_bytes(data)
     raise ValueError(f"Unsupported file type: {ext}")
 
-def _read_pdf(path: str) -> str:
-    doc = fitz.open(path)
-    texts = []
-    for page in doc:
-        texts.append(page.get_text("text"))
-    return "\n".join(texts)
+def load_text_from_file(path: str) -> str:
+    """拡張子に応じてファイルを読み込み、プレーンテキストを返す。"""
+    return "".join(text for text, _ in iter_text_segments(path))
+
+def read_text_prefix(path: str, nchars: int) -> Tuple[str, bool]:
+    """
+    先頭 nchars 文字程度だけ抽出する。(テキスト, ファイル全体を読み切ったか) を返す。
+    PDF は先頭ページから、DOCX は先頭段落から、テキストは先頭から必要な分だけ読む。
+    """
+    ext = os.path.splitext(path)[1].lower()
+    if ext in {".txt", ".md"}:
+        with open(path, "r", encoding="utf-8", errors="ignore") as f:
+            text = f.read(nchars + 1)
+        return text[:nchars], len(text) <= nchars
+    segments = iter_text_segments(path)
+    parts: List[str] = []
+    total = 0
+    for text, _ in segments:
+        parts.append(text)
+        total += len(text)
+        if total > nchars:
+            segments.close()
+            return "".join(parts)[:nchars], False
+    return "".join(parts), True
+
+def _iter_pdf(path: str, data=None) -> Iterator[Segment]:
+    # 1ページずつ取り出す（開いた時点では全ページを読み込まない）
+    with (fitz.open(path) if data is None else fitz.open(stream=data, filetype="pdf")) as doc:
+        for i, page in enumerate(doc):
+            text = page.get_text("text")
+            yield (text if i == 0 else "\n" + text), i + 1
 
-def _read_docx(path: str) -> str:
-    d = docx.Document(path)
-    return "\n".join(p.text for p in d.paragraphs)
+class _BufferReader(io.RawIOBase):
+    """bytes / memoryview を複製せずに読むファイルオブジェクト（zipfile に渡す）。閉じると参照を手放す。"""
 
-def _read_text(path: str) -> str:
+    def __init__(self, data):
+        self._view = memoryview(data)
+        self._pos = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._pos
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        base = {io.SEEK_SET: 0, io.SEEK_CUR: self._pos, io.SEEK_END: len(self._view)}[whence]
+        self._pos = max(0, base + offset)
+        return self._pos
+
+    def readinto(self, b) -> int:
+        n = max(0, min(len(b), len(self._view) - self._pos))
+        b[:n] = self._view[self._pos:self._pos + n]
+        self._pos += n
+        return n
+
+    def close(self):
+        if not self.closed:
+            # メモリマップの memoryview への参照を残すと、pipeline.read_file() がマップを閉じられない
+            self._view.release()
+        super().close()
+
+_W = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+
+def _iter_docx_xml(path: str, data=None) -> Iterator[Segment]:
+    """
+    document.xml を少しずつ読み、本文直下の段落を順に返す（python-docx の paragraphs 相当）。
+    文書全体を読み込まないので、先頭だけ欲しいとき（/preview）も取り込みも同じこの関数を使う。
+    data（bytes / memoryview）を渡すと、複製せずにそこから zip を読む。
+    """
+    with (open(path, "rb") if data is None else _BufferReader(data)) as raw, \
+            zipfile.ZipFile(raw) as z, z.open("word/document.xml") as f:
+        depth = 0
+        first = True
+        body = None
+        for event, elem in ElementTree.iterparse(f, events=("start", "end")):
+            if event == "start":
+                depth += 1
+                if depth == 2:
+                    body = elem
+                continue
+            depth -= 1
+            # depth: 0 = document, 1 = body, 2 = 本文直下の要素
+            if depth != 2:
+                continue
+            if elem.tag == _W + "p":
+                parts = []
+                for node in elem.iter():
+                    if node.tag == _W + "t":
+                        parts.append(node.text or "")
+                    elif node.tag == _W + "tab":
+                        parts.append("\t")
+                    elif node.tag in (_W + "br", _W + "cr"):
+                        parts.append("\n")
+                text = "".join(parts)
+                yield (text if first else "\n" + text), None
+                first = False
+            # 読み終えた要素は本文から外す（空の要素も残さないので、段落数によらずメモリは一定）
+            elem.clear()
+            if body is not None:
+                body.remove(elem)
+
+def _iter_text(path: str) -> Iterator[Segment]:
     with open(path, "r", encoding="utf-8", errors="ignore") as f:
-        return f.read()
+        for block in iter(lambda: f.read(_TEXT_BLOCK_CHARS), ""):
+            yield block, None
+
+def _iter_text_bytes(data) -> Iterator[Segment]:
+    """
+    メモリ上の中身から _iter_text() と同じテキストを返す
+    （UTF-8・不正なバイトは無視・改行は \\n にそろえる。open(..., "r") と同じ扱い）。
+    """
+    decoder = io.IncrementalNewlineDecoder(codecs.getincrementaldecoder("utf-8")(errors="ignore"), translate=True)
+    for start in range(0, len(data), _TEXT_BLOCK_CHARS):
+        text = decoder.decode(data[start:start + _TEXT_BLOCK_CHARS])
+        if text:
+            yield text, None
+    text = decoder.decode(b"", final=True)
+    if text:
+        yield text, None
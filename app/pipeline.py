@@ -0,0 +1,330 @@
+# =============================================
+# pipeline.py
+# ---------------------------------------------
+# 取り込みの「前処理」（読み込み → ハッシュ → テキスト抽出 → チャンク化）を担当。
+# ・CPU が重い抽出処理をワーカープロセスへ分散
+# ・ファイルは1回だけ読む（小さければ丸ごと、大きければメモリマップ）。
+#   ハッシュも抽出も同じ中身から行い、ファイルを開き直さない（ネットワークドライブで効く）
+# ・結果は上限付きキュー経由で1本の埋め込みステージへ流す
+# ・ワーカープロセスは取り込みのたびに起動せず、使い回す（spawn とモジュールの import は初回だけ）。
+#   少量（合計 _INPROCESS_MAX_BYTES 以下。フォルダ監視の小さなバッチなど）はこのプロセス内で処理する
+# ・抽出もチャンク化も逐次（ページ単位）なので、巨大な PDF でも
+#   メモリに載るのは数ページ分＋送信待ちのチャンクだけ
+# ※ ワーカーで import されるため、埋め込みモデルや Chroma は読み込まないこと。
+# =============================================
+import hashlib
+import mmap
+import multiprocessing as mp
+import queue
+import threading
+import time
+from collections import deque
+from contextlib import closing, contextmanager
+from typing import Iterator, List, NamedTuple, Optional, Tuple
+
+from .parsers import iter_text_segments
+
+# 1メッセージで送るチャンク数（ファイル全体をまとめて送らない）
+_CHUNKS_PER_MESSAGE = 64
+
+# これより大きいファイルは読み込まずにメモリマップする（巨大な PDF でも丸ごとは抱えない）
+_MMAP_THRESHOLD = 32 * 1024 * 1024
+
+# 合計サイズがこれ以下の取り込みはワーカーに渡さず、このプロセス内で処理する
+_INPROCESS_MAX_BYTES = 1024 * 1024
+# 使い終わって待機させておくワーカーの組の数（同時に走る取り込みジョブの分）
+_MAX_IDLE_POOLS = 2
+
+class FileTask(NamedTuple):
+    """ワーカーに渡す1ファイル分の仕事。"""
+    path: str
+    size: int
+    mtime: float
+    prev_digest: Optional[str]  # 台帳上の前回ハッシュ（新規なら None）
+
+# ワーカーからのメッセージ（pickle しやすいようにタプル）
+#   ("chunks",    path, digest, chunks, start_index, pages)
+#                 pages はチャンクごとの (開始ページ, 終了ページ)。ページの無い形式は None
+#   ("done",      path, digest, n_chunks, timings)   … このファイルの最後のメッセージ
+#   ("unchanged", path, digest, timings)             … ハッシュが前回と同じ
+#                 timings は段階ごとの所要時間（秒）{"read": ..., "hash": ..., "parse": ...}。
+#                 ワーカーで測った値を親プロセスの計測（metrics.py）に渡すためのもの
+#   ("skipped",   path, reason)             … 抽出できなかった
+#   ("error",     path, message)            … 想定外の例外
+TERMINAL_KINDS = {"done", "unchanged", "skipped", "error"}
+
+PageRange = Optional[Tuple[int, int]]
+
+class ChunkStream:
+    """
+    テキストを少しずつ受け取り、できたチャンクから順に返す逐次チャンカー。
+    分割結果は chunk_text() と同じ：
+    - 全体が max_chars 以下なら1チャンク
+    - ステップ = max_chars - overlap（ただし最低1）
+    - 末尾に達したチャンクで終わり
+    手元に残すのは「まだ後ろが来るかもしれない」max_chars 程度の文字だけ。
+    """
+
+    def __init__(self, max_chars: int, overlap: int):
+        if max_chars <= 0:
+            raise ValueError("max_chars must be > 0")
+        # overlap は 0〜max_chars-1 にクランプ
+        overlap = max(0, min(overlap, max_chars - 1))
+        self.max_chars = max_chars
+        self.step = max(1, max_chars - overlap)
+        self._buf = ""
+        self._offset = 0     # _buf 先頭の通し位置
+        self._end = 0        # 受け取った文字数
+        self._pages = deque()  # (開始位置, ページ番号)
+
+    def _page_at(self, pos: int) -> Optional[int]:
+        page = None
+        for start, p in self._pages:
+            if start > pos:
+                break
+            page = p
+        return page
+
+    def _make(self, text: str, start: int) -> Tuple[str, PageRange]:
+        first = self._page_at(start)
+        if first is None:
+            return text, None
+        return text, (first, self._page_at(start + len(text) - 1))
+
+    def feed(self, text: str, page: Optional[int] = None) -> List[Tuple[str, PageRange]]:
+        """テキスト片を追加し、確定したチャンク（このあと末尾にならないもの）を返す。"""
+        if not text:
+            return []
+        if page is not None and (not self._pages or self._pages[-1][1] != page):
+            self._pages.append((self._end, page))
+        self._buf += text
+        self._end += len(text)
+        out = []
+        pos = 0
+        # 後ろにまだ文字がある＝このチャンクは最後ではない
+        while len(self._buf) - pos > self.max_chars:
+            out.append(self._make(self._buf[pos:pos + self.max_chars], self._offset + pos))
+            pos += self.step
+        if pos:
+            self._buf = self._buf[pos:]
+            self._offset += pos
+        # 使い終わったページ境界を捨てる
+        while len(self._pages) >= 2 and self._pages[1][0] <= self._offset:
+            self._pages.popleft()
+        return out
+
+    def finish(self) -> List[Tuple[str, PageRange]]:
+        """残りを最後のチャンクとして返す。"""
+        out = [self._make(self._buf, self._offset)] if self._buf else []
+        self._buf = ""
+        return out
+
+def chunk_text(text: str, max_chars: int, overlap: int) -> List[str]:
+    """文字数ベースの安全なチャンク分割（文字列を一度に渡す版）。"""
+    stream = ChunkStream(max_chars, overlap)
+    return [c for c, _ in stream.feed(text) + stream.finish()]
+
+def file_hash(path: str) -> str:
+    """変更検知・重複回避用に SHA-256 ハッシュを作る。"""
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(8192), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+@contextmanager
+def read_file(path: str, size: int) -> Iterator[object]:
+    """
+    ファイルの中身を1回だけ読んで貸す（小さければ bytes、大きければメモリマップの memoryview）。
+    メモリマップの分は、ハッシュ計算で読んだページをそのまま抽出でも使う。
+    """
+    with open(path, "rb") as f:
+        if size < _MMAP_THRESHOLD:
+            yield f.read()
+            return
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(mm)
+        try:
+            yield view
+        finally:
+            try:
+                view.release()
+                mm.close()
+            except BufferError:
+                pass  # 抽出ライブラリがまだ参照している。参照が切れたときに閉じられる
+
+def prepare_file(task: FileTask, max_chars: int, overlap: int) -> Iterator[tuple]:
+    """1ファイルを読み込み → ハッシュ → 抽出 → チャンク化し、メッセージを順に返す。"""
+    started = time.perf_counter()
+    with read_file(task.path, task.size) as data:
+        # メモリマップの場合、実際の読み込みはハッシュ計算の中で起きる
+        timings = {"read": time.perf_counter() - started}
+        started = time.perf_counter()
+        digest = hashlib.sha256(data).hexdigest()
+        timings["hash"] = time.perf_counter() - started
+        if task.prev_digest == digest:
+            yield ("unchanged", task.path, digest, timings)
+            return
+        yield from _extract(task, data, digest, timings, max_chars, overlap)
+
+def _extract(task: FileTask, data, digest: str, timings: dict,
+             max_chars: int, overlap: int) -> Iterator[tuple]:
+    """読み込み済みの中身から抽出・チャンク化する。"""
+    # 抽出しながらチャンク化し、一定数たまるごとに送る
+    # （抽出時間には、送り先のキューが空くのを待っていた時間を含めない）
+    stream = ChunkStream(max_chars, overlap)
+    batch: List[Tuple[str, PageRange]] = []
+    sent = 0
+    parse_seconds = 0.0
+    started = time.perf_counter()
+    try:
+        with closing(iter_text_segments(task.path, data)) as segments:
+            for text, page in segments:
+                batch.extend(stream.feed(text, page))
+                while len(batch) >= _CHUNKS_PER_MESSAGE:
+                    part, batch = batch[:_CHUNKS_PER_MESSAGE], batch[_CHUNKS_PER_MESSAGE:]
+                    parse_seconds += time.perf_counter() - started
+                    yield _chunks_message(task.path, digest, part, sent)
+                    started = time.perf_counter()
+                    sent += len(part)
+    except Exception as e:
+        # 途中まで送ったチャンクは受け手側で破棄される
+        yield ("skipped", task.path, str(e))
+        return
+
+    batch.extend(stream.finish())
+    timings["parse"] = parse_seconds + time.perf_counter() - started
+    if batch:
+        yield _chunks_message(task.path, digest, batch, sent)
+        sent += len(batch)
+    yield ("done", task.path, digest, sent, timings)
+
+def _chunks_message(path: str, digest: str, part: List[Tuple[str, PageRange]], start: int) -> tuple:
+    return ("chunks", path, digest, [c for c, _ in part], start, [p for _, p in part])
+
+def _prepare_safely(task: FileTask, max_chars: int, overlap: int) -> Iterator[tuple]:
+    try:
+        yield from prepare_file(task, max_chars, overlap)
+    except Exception as e:
+        yield ("error", task.path, str(e))
+
+def _worker_main(task_q, result_q):
+    """ワーカープロセスの本体。(FileTask, max_chars, overlap) を順に処理し、None を受け取ったら終了。"""
+    while True:
+        item = task_q.get()
+        if item is None:
+            break
+        task, max_chars, overlap = item
+        for msg in _prepare_safely(task, max_chars, overlap):
+            result_q.put(msg)
+
+def iter_prepared(tasks: List[FileTask], max_chars: int, overlap: int,
+                  workers: int, queue_depth: int, cancel_event=None) -> Iterator[tuple]:
+    """
+    tasks を前処理したメッセージを、出来上がった順に返す。
+    - workers <= 1・ファイルが1件以下・合計が _INPROCESS_MAX_BYTES 以下の場合はこのプロセス内で順に処理
+    - それ以外は使い回しのワーカープロセスで並列処理し、上限付きキューで受け取る
+      （埋め込み側が詰まるとワーカーも待つので、メモリが青天井にならない）
+    - cancel_event がセットされたら、結果待ちの途中でも打ち切る（そのワーカーの組は捨てる）
+    """
+    if workers <= 1 or len(tasks) <= 1 or sum(t.size for t in tasks) <= _INPROCESS_MAX_BYTES:
+        for task in tasks:
+            yield from _prepare_safely(task, max_chars, overlap)
+        return
+
+    pool = _acquire_pool(workers, queue_depth)
+    completed = False
+    try:
+        for task in tasks:
+            pool.task_q.put((task, max_chars, overlap))
+
+        finished = set()
+        while len(finished) < len(tasks):
+            try:
+                msg = pool.result_q.get(timeout=0.5)
+            except queue.Empty:
+                if cancel_event is not None and cancel_event.is_set():
+                    return
+                if pool.alive():
+                    continue
+                # ワーカーが落ちた（抽出ライブラリのクラッシュ等）。どのファイルが残っているか
+                # 分からないので、残りはエラー扱い
+                for task in tasks:
+                    if task.path not in finished:
+                        finished.add(task.path)
+                        yield ("error", task.path, "worker process exited unexpectedly")
+                break
+            if msg[0] in TERMINAL_KINDS:
+                finished.add(msg[1])
+            yield msg
+        completed = pool.alive()
+    finally:
+        # きれいに終わった組だけ次に回す。途中で打ち切られた（呼び出し側の例外・キャンセル）組は
+        # キューに前の仕事が残っているので即停止
+        _release_pool(pool, reuse=completed)
+
+class _WorkerPool:
+    """前処理ワーカープロセスの組と、その仕事・結果のキュー。"""
+
+    def __init__(self, n_workers: int, queue_depth: int):
+        # fork だと親のスレッド（埋め込みモデル等）を引き継いで不安定なので spawn
+        ctx = mp.get_context("spawn")
+        self.key = (n_workers, queue_depth)
+        self.task_q = ctx.Queue()
+        self.result_q = ctx.Queue(maxsize=max(1, queue_depth))
+        self.procs = [
+            ctx.Process(target=_worker_main, args=(self.task_q, self.result_q), daemon=True)
+            for _ in range(n_workers)
+        ]
+        for p in self.procs:
+            p.start()
+
+    def alive(self) -> bool:
+        return all(p.is_alive() for p in self.procs)
+
+    def close(self, terminate: bool = False):
+        if terminate:
+            for p in self.procs:
+                if p.is_alive():
+                    p.terminate()
+        else:
+            for _ in self.procs:
+                self.task_q.put(None)
+        for p in self.procs:
+            p.join(timeout=5)
+        self.task_q.close()
+        self.result_q.close()
+
+_idle_pools: List[_WorkerPool] = []
+_pools_lock = threading.Lock()
+
+def _acquire_pool(n_workers: int, queue_depth: int) -> _WorkerPool:
+    """待機中の同じ大きさの組があれば使い、無ければ起動する（同時に走る取り込みには別の組）。"""
+    stale = []
+    pool = None
+    with _pools_lock:
+        for candidate in list(_idle_pools):
+            _idle_pools.remove(candidate)
+            if pool is None and candidate.key == (n_workers, queue_depth) and candidate.alive():
+                pool = candidate
+            else:
+                stale.append(candidate)
+    for candidate in stale:
+        candidate.close(terminate=not candidate.alive())
+    return pool if pool is not None else _WorkerPool(n_workers, queue_depth)
+
+def _release_pool(pool: _WorkerPool, reuse: bool):
+    if reuse:
+        with _pools_lock:
+            if len(_idle_pools) < _MAX_IDLE_POOLS:
+                _idle_pools.append(pool)
+                return
+    pool.close(terminate=not reuse)
+
+def shutdown_workers():
+    """待機中のワーカープロセスを止める（シャットダウン時）。"""
+    with _pools_lock:
+        pools = list(_idle_pools)
+        _idle_pools.clear()
+    for pool in pools:
+        pool.close()
@@ -0,0 +1,158 @@
+# =============================================
+# recent.py
+# ---------------------------------------------
+# /recent-files 用の「最近変更されたファイル」索引。
+# ・対象フォルダを走査した結果を mtime の新しい順に並べて持つ
+#   （問い合わせのたびにツリー全体を歩かない。上位 k 件は先頭から取るだけ）
+# ・走査結果は TTL が切れたら裏で取り直す（その間は前回の結果を返す）
+# ・フォルダ監視（watcher.py）からの変更通知は、次の走査を待たずに反映
+# =============================================
+import heapq
+import os
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from .config import settings
+
+# (mtime, 表示用パス)
+_Entry = Tuple[float, str]
+
+# keep（台帳での絞り込み）に候補をまとめて渡す件数
+_KEEP_BATCH = 256
+
+def _walk(root: str) -> Iterable[Tuple[str, float]]:
+    """隠しファイル・隠しフォルダを除いて (パス, mtime) を返す。"""
+    stack = [root]
+    while stack:
+        current = stack.pop()
+        try:
+            with os.scandir(current) as it:
+                for entry in it:
+                    if entry.name.startswith("."):
+                        continue
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            stack.append(entry.path)
+                        elif entry.is_file():
+                            yield entry.path, entry.stat().st_mtime
+                    except OSError:
+                        continue
+        except OSError:
+            continue
+
+class RecentFilesIndex:
+    """対象フォルダ配下のファイルを mtime 降順で引ける索引。スレッドセーフ。"""
+
+    def __init__(self, roots: List[str], ttl_seconds: float):
+        self.roots = roots
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._entries: Dict[str, _Entry] = {}          # 絶対パス → (mtime, 表示用パス)
+        self._order: List[Tuple[float, str]] = []      # (-mtime, 絶対パス) 昇順＝新しい順
+        self._updates: List[Tuple[float, str]] = []    # 走査後に通知された分（同じ形）
+        self._scanned_at: Optional[float] = None
+        self._scanning = False
+        self._ready = threading.Event()
+
+    # ---- 走査 ----
+
+    def _rescan(self):
+        try:
+            entries: Dict[str, _Entry] = {}
+            for root in self.roots:
+                for path, mtime in _walk(root):
+                    entries[os.path.abspath(path)] = (mtime, path)
+            order = sorted((-mtime, key) for key, (mtime, _) in entries.items())
+            with self._lock:
+                self._entries, self._order, self._updates = entries, order, []
+                self._scanned_at = time.time()
+        finally:
+            with self._lock:
+                self._scanning = False
+            self._ready.set()
+
+    def refresh(self, wait: bool = False):
+        """走査し直す（既に走査中なら相乗り）。wait=True なら終わるまで待つ。"""
+        with self._lock:
+            start = not self._scanning
+            self._scanning = True
+        if start:
+            if wait:
+                self._rescan()
+                return
+            threading.Thread(target=self._rescan, name="recent-files-scan", daemon=True).start()
+        if wait:
+            self._ready.wait()
+
+    def _ensure_fresh(self):
+        if self._scanned_at is None:
+            # 初回だけは走査が終わるのを待つ
+            self.refresh(wait=True)
+        elif self.ttl_seconds >= 0 and time.time() - self._scanned_at > self.ttl_seconds:
+            self.refresh()
+
+    # ---- 変更通知 ----
+
+    def note(self, path: str, mtime: Optional[float] = None):
+        """ファイルの追加・変更（mtime）または削除（None）を反映する。"""
+        key = os.path.abspath(path)
+        if not any(key == r or key.startswith(r.rstrip(os.sep) + os.sep)
+                   for r in map(os.path.abspath, self.roots)):
+            return
+        with self._lock:
+            if mtime is None:
+                self._entries.pop(key, None)
+                return
+            self._entries[key] = (mtime, path)
+            heapq.heappush(self._updates, (-mtime, key))
+
+    # ---- 問い合わせ ----
+
+    def top(self, k: int, exts: Optional[Iterable[str]] = None,
+            keep: Optional[Callable[[List[str]], Set[str]]] = None) -> List[_Entry]:
+        """
+        新しい順に、条件に合う (mtime, 表示用パス) を k 件返す。
+        keep: 表示用パスのリストを受け取り、残すものの集合を返す関数（台帳での絞り込み）。
+        1件ずつ問い合わせないよう、候補は _KEEP_BATCH 件ずつまとめて渡す。
+        """
+        self._ensure_fresh()
+        exts = {e.lower() if e.startswith(".") else "." + e.lower() for e in exts} if exts else None
+        out: List[_Entry] = []
+        seen = set()
+        candidates: List[_Entry] = []
+
+        def drain():
+            kept = keep([entry[1] for entry in candidates]) if keep is not None else None
+            for entry in candidates:
+                if len(out) >= k:
+                    break
+                if kept is None or entry[1] in kept:
+                    out.append(entry)
+            candidates.clear()
+
+        with self._lock:
+            # 走査結果と、その後の通知分を新しい順にマージしながら先頭から見る
+            for neg_mtime, key in heapq.merge(sorted(self._updates), self._order):
+                if len(out) >= k:
+                    break
+                if key in seen:
+                    continue
+                entry = self._entries.get(key)
+                if entry is None or entry[0] != -neg_mtime:
+                    continue  # 削除済み、またはより新しい通知がある
+                seen.add(key)
+                if exts is not None and os.path.splitext(key)[1].lower() not in exts:
+                    continue
+                candidates.append(entry)
+                if len(candidates) >= (_KEEP_BATCH if keep is not None else k - len(out)):
+                    drain()
+            drain()
+        return out
+
+def _recent_roots() -> List[str]:
+    roots = [r.strip() for r in settings.recent_roots.split(",") if r.strip()]
+    return roots or ["."]
+
+# アプリ全体で共有する索引
+recent_index = RecentFilesIndex(_recent_roots(), settings.recent_scan_ttl)
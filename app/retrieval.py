@@ -0,0 +1,303 @@
+# =============================================
+# retrieval.py
+# ---------------------------------------------
+# 検索（リトリーブ）処理をまとめたモジュール。
+# /search・/chat・/chat/stream から共通で使います。
+# ・mode="vector"  : 埋め込みによる意味検索（Chroma）
+# ・mode="lexical" : BM25 による語彙検索（lexical.py。埋め込み計算なしで高速）
+# ・mode="hybrid"  : 両方の順位を Reciprocal Rank Fusion で融合
+# retrieve_batch() は複数の質問をまとめて埋め込み、1回の col.query で引きます。
+# where（Chroma のメタデータ条件）や scope（フォルダ・拡張子・更新日時。scope.py）を渡すと、
+# ベクトル検索の中で絞り込みます（結果を取ってから捨てるのではないので k 件そろう）。
+# シャードに分けている場合（SHARD_BY）、ベクトル検索はスコープに入りうるシャードへ同時に問い合わせ、
+# 距離順にまとめます（shards.py）。オフラインのシャードの結果は出しません。
+# 重複検出（DEDUP_ENABLED。dedup.py）で別名になったチャンクはベクトル DB に無いので、
+# 語彙検索・スコープの ID・本文の取得では別名を代表に読み替え、結果は重複のまとまりごとに1件にします。
+# =============================================
+import json
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+from .dedup import duplicate_index
+from .lexical import lexical_index
+from .metrics import stage
+from .scope import Scope, combine_where
+from .vectorstore import get_collection, get_embedding_function, index_lock
+
+SEARCH_MODES = ("vector", "lexical", "hybrid")
+
+# RRF の定数（順位の差をどれだけなだらかにするか。論文の既定値）
+_RRF_K = 60
+
+# スコープ内のチャンクがこの数以下なら、ID を列挙して検索対象そのものを絞る
+# （Chroma のメタデータ条件で絞るより速い。多い場合は where で絞る）
+_SCOPE_IDS_LIMIT = 20000
+
+@dataclass
+class Hit:
+    """検索でヒットした1チャンク。"""
+    id: str
+    document: str
+    metadata: dict
+    distance: float
+    # モードごとのスコア（vector: コサイン距離＝小さいほど近い / lexical: BM25 / hybrid: RRF）
+    score: float = 0.0
+    # 同じ内容（ほぼ重複）のほかのファイルのパス
+    duplicates: List[str] = field(default_factory=list)
+
+def _clusters(ids: List[str]) -> Dict[str, str]:
+    """別名のチャンク ID → 代表の ID（代表・重複の無いチャンクは含まない）。"""
+    return {id_: c for id_, (c, _, _) in duplicate_index.resolve(ids).items()}
+
+def _annotate(hits: List[Hit]) -> List[Hit]:
+    """ヒットに、同じ重複のまとまりに入っているほかのファイルのパスを添える。"""
+    if not hits or not duplicate_index.active():
+        return hits
+    clusters = _clusters([h.id for h in hits])
+    paths = duplicate_index.cluster_paths([clusters.get(h.id, h.id) for h in hits])
+    for h in hits:
+        own = h.metadata.get("path")
+        h.duplicates = [p for p in dict.fromkeys(paths.get(clusters.get(h.id, h.id), [])) if p != own]
+    return hits
+
+def embed_query(query: str) -> List[float]:
+    """質問文をベクトル化する（埋め込みキャッシュも効く）。"""
+    with stage("embed_query"):
+        return get_embedding_function()([query])[0]
+
+def embed_queries(queries: List[str]) -> List[List[float]]:
+    """複数の質問を1回でベクトル化する（同じ質問は1回だけ計算）。"""
+    if not queries:
+        return []
+    with stage("embed_query"):
+        return get_embedding_function()(queries)
+
+def _vector_search_many(embeddings: List[List[float]], k: int, where: Optional[dict] = None,
+                        ids: Optional[List[str]] = None, scope: Optional[Scope] = None) -> List[List[Hit]]:
+    """
+    複数のベクトルを1回の col.query で検索。
+    where / ids はベクトル検索の中で効く絞り込み（ids は検索対象のチャンク ID）。
+    scope は問い合わせるシャードを選ぶのに使う（絞り込み自体は where / ids で行う）。
+    """
+    if not embeddings:
+        return []
+    if ids is not None and not ids:
+        return [[] for _ in embeddings]
+    # スコープ内の別名は代表に読み替えて探し、代表がスコープ外ならヒットを別名に差し替える
+    substitute: Dict[str, tuple] = {}
+    aliases = duplicate_index.resolve(ids) if ids is not None else {}
+    if aliases:
+        in_scope = set(ids)
+        for alias_id, (c, doc, meta) in aliases.items():
+            if c not in in_scope:
+                substitute.setdefault(c, (alias_id, doc, meta))
+        ids = sorted((in_scope - set(aliases)) | {c for c, _, _ in aliases.values()})
+    col = get_collection()
+    with stage("vector_search"):
+        res = col.query(query_embeddings=embeddings, n_results=k, where=where or None, ids=ids,
+                        shards=col.select(scope))
+
+    out: List[List[Hit]] = []
+    for i in range(len(embeddings)):
+        ids = res.get("ids", [[]])[i]
+        docs = res.get("documents", [[]])[i]
+        metas = res.get("metadatas", [[]])[i]
+        dists = res.get("distances", [[]])[i]
+        hits: List[Hit] = []
+        for id_, doc, meta, dist in zip(ids, docs, metas, dists):
+            distance = float(dist) if isinstance(dist, (int, float)) else 0.0
+            if id_ in substitute:
+                id_, doc, meta = substitute[id_]
+            hits.append(Hit(
+                id=id_,
+                document=doc or "",
+                metadata=meta or {},
+                distance=distance,
+                score=distance,
+            ))
+        out.append(hits)
+    return out
+
+def _vector_filter(where: Optional[dict], scope: Optional[Scope]) -> Tuple[Optional[dict], Optional[List[str]]]:
+    """
+    ベクトル検索の絞り込み条件 (where, ids) を作る。
+    スコープが狭ければ語彙インデックスの索引から ID を列挙し、広ければ where に足す。
+    """
+    if scope is None or scope.is_empty():
+        return where, None
+    ids = lexical_index.scoped_ids(scope, _SCOPE_IDS_LIMIT)
+    if ids is not None:
+        return where, ids
+    return combine_where(scope.where(), where), None
+
+def _vector_search(query: str, k: int, query_embedding: Optional[List[float]],
+                   where: Optional[dict] = None, scope: Optional[Scope] = None) -> List[Hit]:
+    if query_embedding is None:
+        query_embedding = embed_query(query)
+    vector_where, ids = _vector_filter(where, scope)
+    return _vector_search_many([query_embedding], k, vector_where, ids, scope)[0]
+
+def _fetch(ids: List[str], where: Optional[dict] = None) -> Dict[str, tuple]:
+    """
+    チャンク ID から本文とメタデータを引く（埋め込み計算は不要）。
+    where に合わないもの・オフラインのシャードにあるものは返さない。
+    別名は代表がある（オンラインの）ときに別名自身の本文を返す。where があれば別名は返さない
+    （別名のメタデータでは where を評価できない）。
+    """
+    if not ids:
+        return {}
+    aliases = duplicate_index.resolve(ids)
+    lookup = [id_ for id_ in ids if id_ not in aliases]
+    if aliases and not where:
+        lookup = list(dict.fromkeys(lookup + [c for c, _, _ in aliases.values()]))
+    col = get_collection()
+    with stage("fetch"):
+        data = col.get(ids=lookup, where=where or None, include=["documents", "metadatas"],
+                       shards=col.select()) if lookup else {}
+    found = {
+        id_: (doc or "", meta or {})
+        for id_, doc, meta in zip(data.get("ids", []), data.get("documents", []), data.get("metadatas", []))
+    }
+    if not aliases:
+        return found
+    out = {id_: found[id_] for id_ in ids if id_ in found}
+    if not where:
+        for id_, (c, doc, meta) in aliases.items():
+            if c in found:
+                out[id_] = (doc, meta)
+    return out
+
+def _lexical_depth(k: int, where: Optional[dict]) -> int:
+    # 語彙インデックスは任意の where では絞れないので、その場合は多めに取ってから落とす
+    # （scope は語彙インデックス側で採点前に絞り込める）
+    depth = k if not where else max(k * 5, 50)
+    # 重複のまとまりごとに1件にするので、別名があるなら多めに取る
+    return depth * 2 if duplicate_index.active() else depth
+
+def _lexical_search(query: str, k: int, where: Optional[dict] = None,
+                    scope: Optional[Scope] = None) -> List[Hit]:
+    with stage("lexical_search"):
+        ranked = lexical_index.search(query, _lexical_depth(k, where), scope)
+    found = _fetch([id_ for id_, _ in ranked], where)
+    clusters = _clusters([id_ for id_, _ in ranked])
+    seen = set()
+    hits: List[Hit] = []
+    for id_, score in ranked:
+        if id_ not in found:
+            continue  # 条件に合わない / 語彙インデックスとベクトル DB がずれている（削除直後など）
+        cluster = clusters.get(id_, id_)
+        if cluster in seen:
+            continue  # 同じ内容のチャンクは最上位の1件だけ
+        seen.add(cluster)
+        doc, meta = found[id_]
+        hits.append(Hit(id=id_, document=doc, metadata=meta, distance=0.0, score=score))
+        if len(hits) >= k:
+            break
+    return hits
+
+def _hybrid_depth(k: int) -> int:
+    # 融合で順位が入れ替わるので、それぞれ少し多めに取る
+    return max(k * 2, 20)
+
+def _hybrid_search(query: str, k: int, query_embedding: Optional[List[float]],
+                   where: Optional[dict] = None, scope: Optional[Scope] = None,
+                   vector_hits: Optional[List[Hit]] = None) -> List[Hit]:
+    depth = _hybrid_depth(k)
+    if vector_hits is None:
+        vector_hits = _vector_search(query, depth, query_embedding, where, scope)
+    with stage("lexical_search"):
+        lexical_ranked = lexical_index.search(query, _lexical_depth(depth, where), scope)
+    if where:
+        # 条件に合う ID だけ残す（ベクトル側は検索の中で絞り込み済み）
+        allowed = _fetch([id_ for id_, _ in lexical_ranked], where)
+        lexical_ranked = [(id_, s) for id_, s in lexical_ranked if id_ in allowed][:depth]
+
+    # 重複のまとまり（代表の ID）ごとに融合する。rep: まとまり → 結果に出すチャンク
+    clusters = _clusters([h.id for h in vector_hits] + [id_ for id_, _ in lexical_ranked])
+    fused: Dict[str, float] = {}
+    rep: Dict[str, str] = {}
+    for rank, hit in enumerate(vector_hits):
+        cluster = clusters.get(hit.id, hit.id)
+        fused[cluster] = fused.get(cluster, 0.0) + 1.0 / (_RRF_K + rank + 1)
+        rep.setdefault(cluster, hit.id)
+    seen = set()
+    for rank, (id_, _) in enumerate(lexical_ranked):
+        cluster = clusters.get(id_, id_)
+        if cluster in seen:
+            continue  # まとまりの中で最上位の順位だけ数える
+        seen.add(cluster)
+        fused[cluster] = fused.get(cluster, 0.0) + 1.0 / (_RRF_K + rank + 1)
+        rep.setdefault(cluster, id_)
+    top = sorted(fused, key=fused.get, reverse=True)[:k]
+
+    by_id = {h.id: h for h in vector_hits}
+    found = _fetch([rep[c] for c in top if rep[c] not in by_id], where)
+    hits: List[Hit] = []
+    for cluster in top:
+        id_ = rep[cluster]
+        if id_ in by_id:
+            hit = by_id[id_]
+        elif id_ in found:
+            doc, meta = found[id_]
+            hit = Hit(id=id_, document=doc, metadata=meta, distance=0.0)
+        else:
+            continue
+        hit.score = fused[cluster]
+        hits.append(hit)
+    return hits
+
+def retrieve(query: str, k: int, query_embedding: Optional[List[float]] = None,
+             mode: str = "vector", where: Optional[dict] = None,
+             scope: Optional[Scope] = None) -> List[Hit]:
+    """上位 k 件のチャンクを返す。ベクトル計算済みなら使い回す。"""
+    if mode not in SEARCH_MODES:
+        raise ValueError(f"Unknown search mode: {mode}")
+    if mode != "lexical" and query_embedding is None:
+        # 埋め込み計算はロックの外で
+        query_embedding = embed_query(query)
+    # リセット・一括削除の途中の状態は見えない
+    with index_lock.reading():
+        if mode == "lexical":
+            return _annotate(_lexical_search(query, k, where, scope))
+        if mode == "hybrid":
+            return _annotate(_hybrid_search(query, k, query_embedding, where, scope))
+        return _annotate(_vector_search(query, k, query_embedding, where, scope))
+
+# (質問, k, where, scope)
+BatchQuery = Tuple[str, int, Optional[dict], Optional[Scope]]
+
+def retrieve_batch(queries: List[BatchQuery], mode: str = "vector") -> List[List[Hit]]:
+    """
+    複数の質問をまとめて検索し、入力と同じ順で結果を返す。
+    埋め込みは1回のバッチ計算、ベクトル検索は条件（where + scope）が同じ質問ごとに1回の col.query。
+    """
+    if mode not in SEARCH_MODES:
+        raise ValueError(f"Unknown search mode: {mode}")
+    embeddings = embed_queries([q[0] for q in queries]) if mode != "lexical" else []
+
+    # 条件が同じ質問をひとまとめに（n_results はグループ内の最大に合わせ、あとで切る）
+    groups: Dict[str, List[int]] = {}
+    for i, (_, _, where, scope) in enumerate(queries):
+        key = json.dumps([where or {}, scope.__dict__ if scope is not None else {}], sort_keys=True)
+        groups.setdefault(key, []).append(i)
+
+    results: List[List[Hit]] = [[] for _ in queries]
+    with index_lock.reading():
+        if mode == "lexical":
+            for i, (q, k, where, scope) in enumerate(queries):
+                results[i] = _annotate(_lexical_search(q, k, where, scope))
+            return results
+        for indexes in groups.values():
+            _, _, where, scope = queries[indexes[0]]
+            depth = max(_hybrid_depth(queries[i][1]) if mode == "hybrid" else queries[i][1] for i in indexes)
+            vector_where, ids = _vector_filter(where, scope)
+            found = _vector_search_many([embeddings[i] for i in indexes], depth, vector_where, ids, scope)
+            for i, hits in zip(indexes, found):
+                q, k, where, scope = queries[i]
+                if mode == "hybrid":
+                    results[i] = _hybrid_search(q, k, embeddings[i], where, scope,
+                                                vector_hits=hits[:_hybrid_depth(k)])
+                else:
+                    results[i] = hits[:k]
+                _annotate(results[i])
+    return results
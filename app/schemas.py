@@ -5,36 +5,109 @@
 # バリデーションと自動ドキュメント（/docs）に役立ちます。
 # =============================================
 from pydantic import BaseModel
-from typing import List
+from typing import Any, Dict, List, Optional
 
 class IngestRequest(BaseModel):
     paths: List[str]
 
+class IngestError(BaseModel):
+    path: str
+    error: str
+
 class IngestResponse(BaseModel):
     processed_files: int
     processed_chunks: int
     skipped_files: int
+    # 差分取り込みの内訳
+    new_files: int = 0
+    updated_files: int = 0
+    unchanged_files: int = 0
+    removed_files: int = 0
+    duplicate_chunks: int = 0  # ほぼ重複として埋め込まなかったチャンク数（DEDUP_ENABLED）
+    errors: List[IngestError] = []
+
+class IngestJobStatus(BaseModel):
+    job_id: str
+    paths: List[str]
+    status: str  # queued / running / completed / failed / cancelled
+    created_at: float
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    files_discovered: int = 0
+    files_to_process: int = 0
+    files_parsed: int = 0
+    files_embedded: int = 0
+    chunks_embedded: int = 0
+    chunks_deduplicated: int = 0
+    chunks_per_sec: float = 0.0
+    eta_seconds: Optional[float] = None
+    errors: List[IngestError] = []
+    result: Optional[IngestResponse] = None
+    error: Optional[str] = None
+    deduplicated: bool = False  # 同じパスの既存ジョブを返した場合 True
 
 class SearchResult(BaseModel):
     path: str
-    score: float
+    score: float  # vector: コサイン距離（小さいほど近い）/ lexical: BM25 / hybrid: RRF
     snippet: str
     mtime: float
+    page: Optional[int] = None  # PDF のページ番号（チャンクの先頭位置）
+    duplicates: List[str] = []  # 同じ内容（ほぼ重複）のほかのファイル（DEDUP_ENABLED）
 
 class SearchResponse(BaseModel):
     query: str
     results: List[SearchResult]
 
+class SearchScope(BaseModel):
+    """検索範囲（すべて省略可。指定したものを AND で絞り込む）"""
+    dir: Optional[str] = None          # このフォルダ配下
+    exts: Optional[List[str]] = None   # 拡張子（例: ["pdf", "docx"]）
+    mtime_from: Optional[float] = None  # 更新日時（UNIX 秒）の下限
+    mtime_to: Optional[float] = None    # 更新日時（UNIX 秒）の上限
+
+class BatchSearchQuery(BaseModel):
+    query: str
+    k: int = 5
+    filter: Optional[Dict[str, Any]] = None  # Chroma のメタデータ条件（例: {"path": "..."}）
+    scope: Optional[SearchScope] = None
+
+class BatchSearchRequest(BaseModel):
+    queries: List[BatchSearchQuery]
+    mode: Optional[str] = None
+    stream: bool = False  # True なら NDJSON で1件ずつ返す
+
+class BatchSearchResponse(BaseModel):
+    results: List[SearchResponse]  # queries と同じ順
+
 class ChatRequest(BaseModel):
     query: str
     top_k: int = 5
+    mode: Optional[str] = None  # vector / lexical / hybrid（省略時は SEARCH_MODE）
+    scope: Optional[SearchScope] = None  # 検索範囲（フォルダ・拡張子・更新日時）
+    deadline_seconds: Optional[float] = None  # 回答が始まるまでの期限（省略時は LLM_DEADLINE_SECONDS）
 
 class ChatResponse(BaseModel):
     answer: str
     citations: List[SearchResult]
+    cached: bool = False  # 回答キャッシュから返した場合 True
+    # LLM に送ったプロンプトの大きさと、文脈の組み立てで省いたトークン数（見積もり）
+    prompt_chars: Optional[int] = None
+    prompt_tokens_est: Optional[int] = None
+    tokens_saved_est: Optional[int] = None
+    # 期限までに LLM の回答を得られず、抜粋の回答を返した場合 True（理由: queue_full / deadline / error）
+    degraded: bool = False
+    degraded_reason: Optional[str] = None
+    queue_ms: Optional[float] = None  # LLM の順番待ちにかかった時間
 
 class StatsResponse(BaseModel):
     collection: str
     num_embeddings: int
+    num_files: int = 0  # 台帳（manifest）に登録されたファイル数
     embed_model: str
     llm_model: str
+    embed_cache: Optional[dict] = None  # 埋め込みキャッシュのヒット率など
+    answer_cache: Optional[dict] = None  # 回答キャッシュのヒット率など
+    text_cache: Optional[dict] = None  # /preview 用テキストキャッシュのヒット率など
+    vector_index: Optional[dict] = None  # ベクトルインデックスのバックエンド・精度・配列の大きさ
+    dedup: Optional[dict] = None  # 重複検出（代表・別名のチャンク数）
+    llm_scheduler: Optional[dict] = None  # LLM の順番待ち（実行中・待ち・期限切れの数）
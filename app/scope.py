@@ -0,0 +1,90 @@
+# =============================================
+# scope.py
+# ---------------------------------------------
+# 検索範囲（スコープ）の指定と、そのためのメタデータ。
+# ・フォルダ（配下すべて）、拡張子、更新日時の範囲で絞り込める
+# ・取り込み時に、チャンクへ「祖先フォルダ」を深さごとのキーで持たせる
+#     /a/b/c.pdf → dir0="/", dir1="/a", dir2="/a/b", ext=".pdf"
+#   フォルダ指定は dir{深さ} の一致だけで判定できるので、ベクトル検索の中で
+#   （k を減らさずに）絞り込める。
+# =============================================
+import os
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Sequence
+
+def file_dir(path: str) -> str:
+    """ファイルが置かれたフォルダ（絶対パス・正規化済み）。"""
+    return os.path.normpath(os.path.dirname(os.path.abspath(path)))
+
+def ancestor_dirs(directory: str) -> List[str]:
+    """フォルダとその祖先を、ルートから順に返す（/a/b → ["/", "/a", "/a/b"]）。"""
+    directory = os.path.normpath(os.path.abspath(directory))
+    chain = []
+    while True:
+        chain.append(directory)
+        parent = os.path.dirname(directory)
+        if parent == directory:
+            break
+        directory = parent
+    return chain[::-1]
+
+def _dir_key(depth: int) -> str:
+    return f"dir{depth}"
+
+def scope_metadata(path: str) -> Dict[str, object]:
+    """チャンクに付けるスコープ用メタデータ（祖先フォルダと拡張子）。"""
+    meta: Dict[str, object] = {_dir_key(i): d for i, d in enumerate(ancestor_dirs(file_dir(path)))}
+    meta["ext"] = os.path.splitext(path)[1].lower()
+    return meta
+
+def stale_scope_keys(old_path: str, new_path: str) -> Dict[str, None]:
+    """リネームで不要になる祖先キー（None を入れると Chroma の update で消える）。"""
+    old_depth = len(ancestor_dirs(file_dir(old_path)))
+    new_depth = len(ancestor_dirs(file_dir(new_path)))
+    return {_dir_key(i): None for i in range(new_depth, old_depth)}
+
+def normalize_exts(exts: Optional[Sequence[str]]) -> List[str]:
+    return sorted({e.lower() if e.startswith(".") else "." + e.lower() for e in exts or () if e})
+
+@dataclass(frozen=True)
+class Scope:
+    """検索範囲。何も指定しなければ全体。"""
+    dir: Optional[str] = None        # このフォルダ配下
+    exts: tuple = ()                 # 拡張子（".pdf" など）のいずれか
+    mtime_from: Optional[float] = None
+    mtime_to: Optional[float] = None
+
+    @classmethod
+    def create(cls, dir: Optional[str] = None, exts: Optional[Sequence[str]] = None,
+               mtime_from: Optional[float] = None, mtime_to: Optional[float] = None) -> "Scope":
+        return cls(
+            dir=os.path.normpath(os.path.abspath(dir)) if dir else None,
+            exts=tuple(normalize_exts(exts)),
+            mtime_from=mtime_from,
+            mtime_to=mtime_to,
+        )
+
+    def is_empty(self) -> bool:
+        return self.dir is None and not self.exts and self.mtime_from is None and self.mtime_to is None
+
+    def where(self) -> Optional[dict]:
+        """Chroma の where 条件（ベクトル検索の中で効く）。"""
+        conds = []
+        if self.dir is not None:
+            conds.append({_dir_key(len(ancestor_dirs(self.dir)) - 1): self.dir})
+        if self.exts:
+            conds.append({"ext": {"$in": list(self.exts)}})
+        if self.mtime_from is not None:
+            conds.append({"mtime": {"$gte": self.mtime_from}})
+        if self.mtime_to is not None:
+            conds.append({"mtime": {"$lte": self.mtime_to}})
+        if not conds:
+            return None
+        return conds[0] if len(conds) == 1 else {"$and": conds}
+
+def combine_where(*conds: Optional[dict]) -> Optional[dict]:
+    """複数の where を AND でまとめる（None は無視）。"""
+    conds = [c for c in conds if c]
+    if not conds:
+        return None
+    return conds[0] if len(conds) == 1 else {"$and": conds}
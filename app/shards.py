@@ -0,0 +1,341 @@
+# =============================================
+# shards.py
+# ---------------------------------------------
+# ベクトルインデックスのシャード分け（SHARD_BY）。
+# ・root : SHARD_ROOTS のフォルダごとに1コレクション（どのフォルダにも入らないファイルは default）
+# ・ext  : 拡張子ごとに1コレクション
+# ・空   : 分けない（default の1つだけ。従来どおりのコレクション名）
+# ShardedIndex は VectorIndex と同じ形で、
+# ・書き込みはメタデータの path からシャードを決めて振り分ける
+# ・検索は対象のシャードへ同時に問い合わせ、距離の小さい順に上位 k 件へまとめる
+#   （対象はスコープのフォルダ・拡張子から絞る。オフラインのシャードは検索しない）
+# ・シャードごとに世代（リセット）・オフライン・開けなかった状態を持つので、
+#   1つのシャードを作り直している間も、ほかのシャードはそのまま検索できる
+# 世代の差し替え・状態の保存は vectorstore.py が行う。
+# =============================================
+import hashlib
+import heapq
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, NamedTuple, Optional, Sequence
+
+import numpy as np
+
+from .parsers import SUPPORTED_EXTS
+from .scope import Scope
+from .vector_index import VectorIndex
+
+SHARD_MODES = ("", "root", "ext")
+
+# どのシャードにも当てはまらないファイルの行き先（分けない場合はこれだけ）
+DEFAULT_SHARD = "default"
+
+class ShardUnavailable(RuntimeError):
+    """シャードを開けていない（読み込みに失敗した）ので書き込めない。"""
+
+class ShardSpec(NamedTuple):
+    id: str
+    root: Optional[str] = None   # SHARD_BY=root のフォルダ（絶対パス・正規化済み）
+    ext: Optional[str] = None    # SHARD_BY=ext の拡張子（".pdf" など）
+
+def _norm(path: str) -> str:
+    return os.path.normcase(os.path.normpath(os.path.abspath(path)))
+
+def _within(path: str, root: str) -> bool:
+    return path == root or path.startswith(root.rstrip(os.sep) + os.sep)
+
+def root_shard_id(root: str) -> str:
+    """フォルダ名 + パスのハッシュ（コレクション名に使える文字だけ）。"""
+    name = re.sub(r"[^a-z0-9]+", "-", os.path.basename(root).lower()).strip("-")[:20] or "root"
+    return f"{name}-{hashlib.sha1(root.encode('utf-8')).hexdigest()[:8]}"
+
+class ShardRouter:
+    """パス → シャード ID の振り分けと、スコープから検索対象のシャードを選ぶ。"""
+
+    def __init__(self, by: str = "", roots: Sequence[str] = ()):
+        if by not in SHARD_MODES:
+            raise ValueError(f"SHARD_BY must be one of 'root', 'ext' or empty: {by}")
+        self.by = by
+        self.specs: List[ShardSpec] = [ShardSpec(DEFAULT_SHARD)]
+        self._roots: List[ShardSpec] = []
+        if by == "root":
+            for root in sorted({_norm(r) for r in roots if r}):
+                self._roots.append(ShardSpec(root_shard_id(root), root=root))
+            # 入れ子のフォルダは深い方を優先
+            self._roots.sort(key=lambda s: len(s.root), reverse=True)
+            self.specs += sorted(self._roots, key=lambda s: s.root)
+        elif by == "ext":
+            self.specs += [ShardSpec(ext.lstrip("."), ext=ext) for ext in sorted(SUPPORTED_EXTS)]
+        self._by_ext = {s.ext: s.id for s in self.specs if s.ext}
+
+    def ids(self) -> List[str]:
+        return [s.id for s in self.specs]
+
+    def layout(self) -> dict:
+        """シャードの分け方（変わったら vectorstore.py がチャンクを移し替える）。"""
+        return {"by": self.by, "roots": [s.root for s in self._roots] if self.by == "root" else []}
+
+    def route(self, path: str) -> str:
+        if self.by == "root":
+            norm = _norm(path)
+            for spec in self._roots:
+                if _within(norm, spec.root):
+                    return spec.id
+        elif self.by == "ext":
+            return self._by_ext.get(os.path.splitext(path)[1].lower(), DEFAULT_SHARD)
+        return DEFAULT_SHARD
+
+    def select(self, scope: Optional[Scope]) -> Optional[List[str]]:
+        """スコープに入りうるシャード（None ならすべて）。"""
+        if scope is None:
+            return None
+        if self.by == "root" and scope.dir is not None:
+            d = _norm(scope.dir)
+            # フォルダを含むシャード（いちばん深いもの。無ければ default）と、フォルダの中にあるシャード
+            outer = next((s.id for s in self._roots if _within(d, s.root)), DEFAULT_SHARD)
+            return [outer] + [s.id for s in self._roots if s.id != outer and _within(s.root, d)]
+        if self.by == "ext" and scope.exts:
+            return [self._by_ext[e] for e in scope.exts if e in self._by_ext]
+        return None
+
+class Shard:
+    """シャード1つ分の状態。index が None なら開けていない（error に理由）。"""
+
+    def __init__(self, spec: ShardSpec, generation: int = 0, offline: bool = False):
+        self.spec = spec
+        self.id = spec.id
+        self.generation = generation
+        self.offline = offline
+        self.index: Optional[VectorIndex] = None
+        self.error: Optional[str] = None
+
+    @property
+    def state(self) -> str:
+        if self.index is None:
+            return "failed"
+        return "offline" if self.offline else "online"
+
+    def status(self) -> dict:
+        out = {"id": self.id, "root": self.spec.root, "ext": self.spec.ext, "state": self.state,
+               "generation": self.generation, "error": self.error}
+        if self.index is not None:
+            try:
+                out.update(self.index.stats())
+            except Exception as e:
+                out["error"] = str(e)
+        return out
+
+def _take(values, idx: List[int]):
+    if values is None:
+        return None
+    if isinstance(values, np.ndarray):
+        return values[idx]
+    return [values[i] for i in idx]
+
+def _merge_meta(old: Optional[dict], new: dict) -> dict:
+    """Chroma の update と同じ合わせ方（値が None のキーは消す）。"""
+    merged = dict(old or {})
+    for key, value in new.items():
+        if value is None:
+            merged.pop(key, None)
+        else:
+            merged[key] = value
+    return merged
+
+class ShardedIndex(VectorIndex):
+    """複数のシャードを1つの VectorIndex に見せる。"""
+
+    name = "sharded"
+
+    def __init__(self, router: ShardRouter, shards: Dict[str, Shard], workers: int = 0):
+        self.router = router
+        self.shards = shards
+        n = len(shards)
+        self._pool = ThreadPoolExecutor(max_workers=min(n, workers or n), thread_name_prefix="shard-query") \
+            if n > 1 else None
+
+    # ---- シャードの選択 ----
+
+    def route(self, path: str) -> str:
+        return self.router.route(path)
+
+    def shard(self, shard_id: str) -> Shard:
+        try:
+            return self.shards[shard_id]
+        except KeyError:
+            raise KeyError(f"Unknown shard: {shard_id}") from None
+
+    def shard_index(self, shard_id: str) -> VectorIndex:
+        shard = self.shard(shard_id)
+        if shard.index is None:
+            raise ShardUnavailable(f"Shard {shard_id} is unavailable: {shard.error}")
+        return shard.index
+
+    def shard_for(self, path: str) -> VectorIndex:
+        """path のチャンクが入るシャード（削除などをそのシャードだけで済ませる）。"""
+        return self.shard_index(self.route(path))
+
+    def writable(self, path: str) -> bool:
+        return self.shards[self.route(path)].index is not None
+
+    def select(self, scope: Optional[Scope] = None) -> List[str]:
+        """検索で問い合わせるシャード（スコープで絞り、オフライン・開けていないものは除く）。"""
+        wanted = self.router.select(scope)
+        ids = self.shards if wanted is None else wanted
+        return [sid for sid in ids if self.shards[sid].state == "online"]
+
+    def _open(self, shard_ids: Optional[List[str]] = None) -> List[Shard]:
+        ids = self.shards if shard_ids is None else shard_ids
+        return [self.shards[sid] for sid in ids if self.shards[sid].index is not None]
+
+    def _map(self, fn, shards: List[Shard]) -> list:
+        """シャードごとに fn を呼ぶ（2つ以上なら同時に）。"""
+        if len(shards) <= 1 or self._pool is None:
+            return [fn(s) for s in shards]
+        return list(self._pool.map(fn, shards))
+
+    # ---- 書き込み ----
+
+    def _group(self, metadatas: List[dict]) -> Dict[str, List[int]]:
+        groups: Dict[str, List[int]] = {}
+        for i, meta in enumerate(metadatas):
+            groups.setdefault(self.route((meta or {}).get("path", "")), []).append(i)
+        return groups
+
+    def upsert(self, ids, documents=None, metadatas=None, embeddings=None):
+        if metadatas is None:
+            raise ValueError("metadatas (path) are required to route chunks to shards")
+        for sid, idx in self._group(metadatas).items():
+            self.shard_index(sid).upsert(ids=_take(ids, idx), documents=_take(documents, idx),
+                                         metadatas=_take(metadatas, idx), embeddings=_take(embeddings, idx))
+
+    def update(self, ids, metadatas):
+        """
+        メタデータを書き換える。path が別のシャードに移る場合（リネーム）は、
+        埋め込みごと移し替える（計算し直さない）。
+        """
+        for sid, idx in self._group(metadatas).items():
+            target = self.shard_index(sid)
+            wanted = dict(zip(_take(ids, idx), _take(metadatas, idx)))
+            present = set(target.get(ids=list(wanted), include=[])["ids"] or [])
+            if present:
+                target.update(ids=[i for i in wanted if i in present],
+                              metadatas=[m for i, m in wanted.items() if i in present])
+            missing = [i for i in wanted if i not in present]
+            for shard in self._open():
+                if not missing:
+                    break
+                if shard.index is target:
+                    continue
+                data = shard.index.get(ids=missing, include=["documents", "metadatas", "embeddings"])
+                found = data.get("ids") or []
+                if not found:
+                    continue
+                target.upsert(ids=found, documents=data["documents"],
+                              metadatas=[_merge_meta(old, wanted[i]) for i, old in zip(found, data["metadatas"])],
+                              embeddings=data["embeddings"])
+                shard.index.delete(ids=found)
+                moved = set(found)
+                missing = [i for i in missing if i not in moved]
+
+    def delete(self, ids=None, where=None):
+        # どのシャードにあるか分からないので全部に（path が分かるなら shard_for() を使う）
+        for shard in self._open():
+            shard.index.delete(ids=ids, where=where)
+
+    # ---- 読み出し ----
+
+    def get(self, ids=None, where=None, limit=None, offset=None, include=("documents", "metadatas"),
+            shards: Optional[List[str]] = None):
+        """shards を渡すとそのシャードだけから読む（既定は開けているものすべて。オフラインも含む）。"""
+        include = list(include)
+        out = {"ids": [], "documents": [], "metadatas": [], "embeddings": []}
+        targets = self._open(shards)
+        if ids is None and where is None and (limit is not None or offset):
+            # 全件のページ送り：件数で読み飛ばし、必要なシャードだけ読む
+            skip, remaining = offset or 0, limit
+            parts = []
+            for shard in targets:
+                if remaining is not None and remaining <= 0:
+                    break
+                n = shard.index.count()
+                if skip >= n:
+                    skip -= n
+                    continue
+                part = shard.index.get(limit=remaining, offset=skip, include=include)
+                skip = 0
+                if remaining is not None:
+                    remaining -= len(part.get("ids") or [])
+                parts.append(part)
+        else:
+            parts = self._map(lambda s: s.index.get(ids=ids, where=where, include=include), targets)
+        for part in parts:
+            out["ids"].extend(part.get("ids") or [])
+            for key in ("documents", "metadatas", "embeddings"):
+                if key in include and part.get(key) is not None:
+                    out[key].extend(list(part[key]))
+        if ids is not None or where is not None:
+            start = offset or 0
+            end = None if limit is None else start + limit
+            out = {key: values[start:end] for key, values in out.items()}
+        for key in ("documents", "metadatas", "embeddings"):
+            if key not in include:
+                out[key] = None
+        return out
+
+    def query(self, query_embeddings, n_results=10, where=None, ids=None,
+              include=("documents", "metadatas", "distances"), shards: Optional[List[str]] = None):
+        """
+        各シャードの上位 n_results 件を、距離の小さい順に n_results 件へまとめる。
+        shards を渡すとそのシャードだけに問い合わせる（既定は select() と同じ＝オンラインのものすべて）。
+        """
+        include = list(include)
+        m = len(query_embeddings)
+        targets = self._open(self.select() if shards is None else shards)
+        if not targets:
+            return {key: [[] for _ in range(m)] for key in ["ids"] + include}
+        if len(targets) == 1:
+            return targets[0].index.query(query_embeddings=query_embeddings, n_results=n_results,
+                                          where=where, ids=ids, include=include)
+        # 並べ替えに距離が要るので、頼まれていなくても取る
+        wanted = include if "distances" in include else include + ["distances"]
+        errors: List[Exception] = []
+
+        def ask(shard: Shard):
+            try:
+                return shard.index.query(query_embeddings=query_embeddings, n_results=n_results,
+                                         where=where, ids=ids, include=wanted)
+            except Exception as e:
+                # 1つのシャードが答えられなくても、ほかのシャードの結果は返す
+                shard.error = str(e)
+                errors.append(e)
+                return None
+
+        results = [r for r in self._map(ask, targets) if r is not None]
+        if not results and errors:
+            raise errors[0]
+        out = {key: [] for key in ["ids"] + include}
+        for i in range(m):
+            candidates = []
+            for r, res in enumerate(results):
+                dists = (res.get("distances") or [[]] * m)[i] or []
+                candidates.extend((float(d), r, j) for j, d in enumerate(dists))
+            best = heapq.nsmallest(n_results, candidates)
+            out["ids"].append([results[r]["ids"][i][j] for _, r, j in best])
+            for key in include:
+                out[key].append([(results[r].get(key) or [[]] * m)[i][j] if key != "distances" else d
+                                 for d, r, j in best])
+        return out
+
+    def count(self) -> int:
+        return sum(shard.index.count() for shard in self._open())
+
+    def stats(self) -> dict:
+        shards = [shard.status() for shard in self.shards.values()]
+        return {
+            "backend": next((s["backend"] for s in shards if "backend" in s), None),
+            "count": sum(s.get("count", 0) for s in shards),
+            "shard_by": self.router.by,
+            "shards": shards,
+        }
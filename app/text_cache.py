@@ -0,0 +1,146 @@
+# =============================================
+# text_cache.py
+# ---------------------------------------------
+# 抽出済みテキスト（先頭部分）のキャッシュ。/preview を速くするためのもの。
+# ・キーは (パス, mtime, サイズ)。ファイルが変われば自然にミスになる
+# ・保存するのは先頭 text_cache_chars 文字まで（全文は持たない）
+# ・/preview で抽出したときと、取り込み（ingest.py）で先頭チャンクができたときに登録
+# ・SQLite に永続化し、件数上限を超えたら古く使われたものから捨てる
+# ・ヒットのたびには書き込まない。最終利用時刻はメモリに貯め、_TOUCH_FLUSH_EVERY 件ごと・
+#   登録（追い出し）時・close() 時にまとめて書く（embed_cache.py と同じ）
+# =============================================
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, NamedTuple, Optional
+
+from .config import settings
+
+# 最終利用時刻をまとめて書き込む件数
+_TOUCH_FLUSH_EVERY = 256
+
+class CachedText(NamedTuple):
+    text: str
+    complete: bool   # ファイル全体のテキストか（False なら先頭部分のみ）
+
+class TextCache:
+    """(path, mtime, size) → 先頭テキストの永続キャッシュ。スレッドセーフ。"""
+
+    def __init__(self, db_path: str, max_entries: int, max_chars: int):
+        parent = os.path.dirname(db_path)
+        if parent:
+            os.makedirs(parent, exist_ok=True)
+        self.max_entries = max(1, max_entries)
+        self.max_chars = max(1, max_chars)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        with self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS texts ("
+                " path TEXT PRIMARY KEY,"
+                " mtime REAL NOT NULL,"
+                " size INTEGER NOT NULL,"
+                " text TEXT NOT NULL,"
+                " complete INTEGER NOT NULL,"
+                " last_used REAL NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS texts_last_used ON texts(last_used)")
+        self._count = self._conn.execute("SELECT COUNT(*) FROM texts").fetchone()[0]
+        # まだ書き込んでいない最終利用時刻（キー → 時刻）
+        self._touched: Dict[str, float] = {}
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _key(path: str) -> str:
+        # プレビュー（絶対パス）と取り込み（指定どおりのパス）で表記が違っても当たるように
+        return os.path.abspath(path)
+
+    def get(self, path: str, mtime: float, size: int) -> Optional[CachedText]:
+        key = self._key(path)
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT text, complete FROM texts WHERE path = ? AND mtime = ? AND size = ?",
+                (key, mtime, size),
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._touched[key] = time.time()
+            if len(self._touched) >= _TOUCH_FLUSH_EVERY:
+                with self._conn:
+                    self._write_touched()
+        return CachedText(row[0], bool(row[1]))
+
+    def put(self, path: str, mtime: float, size: int, text: str, complete: bool):
+        """先頭テキストを登録。max_chars を超える分は切り、complete も False にする。"""
+        if len(text) > self.max_chars:
+            text, complete = text[:self.max_chars], False
+        key = self._key(path)
+        with self._lock, self._conn:
+            # 追い出す順番が正しくなるよう、貯めている最終利用時刻を先に書く
+            self._write_touched()
+            # 既にもっと長い（または全文の）同じ版があれば上書きしない
+            row = self._conn.execute(
+                "SELECT mtime, size, length(text), complete FROM texts WHERE path = ?", (key,)
+            ).fetchone()
+            if (row is not None and row[0] == mtime and row[1] == size
+                    and (row[3] or row[2] >= len(text)) and not complete):
+                return
+            self._conn.execute(
+                "INSERT OR REPLACE INTO texts (path, mtime, size, text, complete, last_used)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                (key, mtime, size, text, int(complete), time.time()),
+            )
+            if row is None:
+                self._count += 1
+            if self._count > self.max_entries:
+                excess = self._count - self.max_entries
+                self._conn.execute(
+                    "DELETE FROM texts WHERE path IN"
+                    " (SELECT path FROM texts ORDER BY last_used LIMIT ?)", (excess,)
+                )
+                self._count = self._conn.execute("SELECT COUNT(*) FROM texts").fetchone()[0]
+
+    def _write_touched(self):
+        # ロックとトランザクションの中で呼ぶ
+        if self._touched:
+            self._conn.executemany(
+                "UPDATE texts SET last_used = ? WHERE path = ?",
+                [(used, key) for key, used in self._touched.items()],
+            )
+            self._touched.clear()
+
+    def close(self):
+        """書き残しを書き込んで閉じる（シャットダウン時）。"""
+        with self._lock:
+            with self._conn:
+                self._write_touched()
+            self._conn.close()
+
+    def clear(self):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM texts")
+            self._count = 0
+            self._touched.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": self._count,
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": (self.hits / total) if total else 0.0,
+            }
+
+# アプリ全体で共有するテキストキャッシュ（Chroma の保存先に並べて置く）
+text_cache = TextCache(
+    os.path.join(settings.chroma_dir, "k9_text_cache.sqlite3"),
+    settings.text_cache_max_entries,
+    settings.text_cache_chars,
+)
@@ -0,0 +1,113 @@
+# =============================================
+# vector_index.py
+# ---------------------------------------------
+# ベクトルインデックスの共通の形（VectorIndex）と、Chroma による実装。
+# ・アプリ（ingest.py / retrieval.py）が使うのは upsert / update / delete / get / query / count だけ。
+#   引数と戻り値は Chroma のコレクションに合わせてある
+# ・実装は VECTOR_BACKEND で選ぶ（vectorstore.py）
+#     chroma : Chroma の HNSW（近似）
+#     array  : NumPy + メモリマップの総当たり（厳密。量子化も可。array_index.py）
+# ・バックエンドは「名前付きのインデックス」を開く・捨てる・列挙するだけの薄い入れ物
+#   （世代の差し替えは vectorstore.py が名前で行う）
+# =============================================
+from abc import ABC, abstractmethod
+from typing import List, Optional, Sequence
+
+class VectorIndex(ABC):
+    """
+    ベクトルインデックス1つ分。各メソッドの引数・戻り値は Chroma のコレクションと同じ。
+    stats() 以外は実装必須（足りない実装は作った時点で TypeError になる）。
+    """
+
+    name: str
+
+    @abstractmethod
+    def upsert(self, ids: List[str], documents: Optional[List[str]] = None,
+               metadatas: Optional[List[dict]] = None, embeddings=None):
+        """追加・置き換え。embeddings が無ければ documents から埋め込みを計算する。"""
+
+    @abstractmethod
+    def update(self, ids: List[str], metadatas: List[dict]):
+        """メタデータだけを書き換える（値が None のキーは消す）。"""
+
+    @abstractmethod
+    def delete(self, ids: Optional[List[str]] = None, where: Optional[dict] = None):
+        """ID 指定か、メタデータ条件（where）で削除する。"""
+
+    @abstractmethod
+    def get(self, ids: Optional[List[str]] = None, where: Optional[dict] = None,
+            limit: Optional[int] = None, offset: Optional[int] = None,
+            include: Sequence[str] = ("documents", "metadatas")) -> dict:
+        """{"ids": [...], "documents": [...], "metadatas": [...]} を返す（埋め込みの計算はしない）。"""
+
+    @abstractmethod
+    def query(self, query_embeddings, n_results: int = 10, where: Optional[dict] = None,
+              ids: Optional[List[str]] = None,
+              include: Sequence[str] = ("documents", "metadatas", "distances")) -> dict:
+        """質問ベクトルごとに上位 n_results 件。distances はコサイン距離（1 - 類似度）。"""
+
+    @abstractmethod
+    def count(self) -> int:
+        """登録件数。"""
+
+    def stats(self) -> dict:
+        return {"count": self.count()}
+
+class ChromaIndex(VectorIndex):
+    """Chroma のコレクションをそのまま包む。"""
+
+    def __init__(self, collection):
+        self._col = collection
+        self.name = collection.name
+
+    def upsert(self, ids, documents=None, metadatas=None, embeddings=None):
+        self._col.upsert(ids=ids, documents=documents, metadatas=metadatas, embeddings=embeddings)
+
+    def update(self, ids, metadatas):
+        self._col.update(ids=ids, metadatas=metadatas)
+
+    def delete(self, ids=None, where=None):
+        self._col.delete(ids=ids, where=where)
+
+    def get(self, ids=None, where=None, limit=None, offset=None, include=("documents", "metadatas")):
+        return self._col.get(ids=ids, where=where, limit=limit, offset=offset, include=list(include))
+
+    def query(self, query_embeddings, n_results=10, where=None, ids=None,
+              include=("documents", "metadatas", "distances")):
+        return self._col.query(query_embeddings=query_embeddings, n_results=n_results,
+                               where=where, ids=ids, include=list(include))
+
+    def count(self) -> int:
+        return self._col.count()
+
+    def stats(self) -> dict:
+        return {"backend": "chroma", "count": self.count()}
+
+class ChromaBackend:
+    """Chroma の永続クライアント。chromadb の import は重いので、作るときまで遅らせる。"""
+
+    kind = "chroma"
+
+    def __init__(self, path: str, embedding_fn):
+        import chromadb
+        from chromadb.config import Settings as ChromaSettings
+        from .embeddings import chroma_embedding_function
+        # テレメトリ無効
+        self._client = chromadb.PersistentClient(
+            path=path,
+            settings=ChromaSettings(anonymized_telemetry=False)
+        )
+        self._ef = chroma_embedding_function(embedding_fn)
+
+    def open(self, name: str) -> ChromaIndex:
+        return ChromaIndex(self._client.get_or_create_collection(
+            name=name,
+            embedding_function=self._ef,
+            metadata={"hnsw:space": "cosine"}
+        ))
+
+    def drop(self, name: str):
+        self._client.delete_collection(name)
+
+    def names(self) -> List[str]:
+        return [c if isinstance(c, str) else c.name for c in self._client.list_collections()]
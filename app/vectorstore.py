@@ -1,33 +1,407 @@
 # =============================================
 # vectorstore.py
 # ---------------------------------------------
-# ChromaDB の初期化と、コレクション（インデックス）取得を行うモジュール。
-# ・PersistentClient: ディスク永続化で再起動してもデータ保持
+# ベクトルインデックスの初期化と、コレクション（インデックス）取得を行うモジュール。
+# ・VECTOR_BACKEND で実装を選ぶ（chroma = Chroma の PersistentClient / array = array_index.py）
+#   どちらもディスクに永続化され、操作は vector_index.VectorIndex の形で揃っている
 # ・get_collection(): どこからでも同一コレクションを取得
+#   SHARD_BY を指定するとフォルダ・拡張子ごとのコレクションに分かれ、まとめて1つに見せる（shards.py）。
+#   分け方を変えて起動すると、チャンクを埋め込みごと新しいシャードへ移し替える
+# ・VECTOR_BACKEND を切り替えて起動すると、前のバックエンドの中身を一度だけ写す
+#   （埋め込みは計算し直さない。写し終えたら前のバックエンドの分は消す）
+# ・リセットは「新しい世代のコレクションを作って差し替え → 旧世代を丸ごと削除」
+#   （全 ID を読み出して消すのではなく、コレクションごと捨てるので件数によらず速い）
+#   世代・オフラインはシャードごと（1つのシャードだけリセット・作り直しができる）
+# ・検索は読み取りロック、差し替えや一括削除は書き込みロックの中で行うので、
+#   検索からは「前の状態」か「後の状態」のどちらかしか見えない
+# ・埋め込みモデルとインデックスは import 時には読み込まない（初回の利用か warmup() で）。
+#   readiness() でそれぞれの読み込み状態を返す（/ready）
 # =============================================
-import chromadb
-from chromadb.config import Settings as ChromaSettings
+import json
+import logging
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Optional
 
 from .config import settings
-from .embeddings import Embedder, ChromaEmbeddingFunction
-
-# 埋め込み器を初期化（プロセス内で共有）
-_embedder = Embedder(settings.embed_model)
-_embedding_fn = ChromaEmbeddingFunction(_embedder)
-
-# Chroma 永続クライアント作成（テレメトリ無効）
-_client = chromadb.PersistentClient(
-    path=settings.chroma_dir,
-    settings=ChromaSettings(anonymized_telemetry=False)
-)
-
-# コレクション生成（なければ作る）
-_collection = _client.get_or_create_collection(
-    name=settings.collection_name,
-    embedding_function=_embedding_fn,
-    metadata={"hnsw:space": "cosine"}
-)
-
-def get_collection():
-    """アプリ全体で共通のコレクションを返す。"""
+from .embeddings import Embedder, RemoteEmbedder, CachedEmbeddingFunction
+from .embed_cache import CacheInUse, EmbeddingCache
+from .metrics import record_stage, stage
+from .vector_index import ChromaBackend
+from .array_index import ArrayBackend
+from .shards import DEFAULT_SHARD, Shard, ShardedIndex, ShardRouter
+
+# 埋め込み器（プロセス内で共有。モデルは初回の利用時に読み込む）
+# 埋め込みサーバを使う場合はモデルを読み込まず、キャッシュもサーバ側に任せる
+# （キャッシュのディレクトリは1プロセスからの書き込みが前提のため）
+if settings.embed_server_url:
+    _embedder = RemoteEmbedder(settings.embed_model, settings.embed_server_url, settings.embed_server_timeout)
+else:
+    _embedder = Embedder(settings.embed_model)
+
+logger = logging.getLogger(__name__)
+
+# 埋め込みキャッシュを開けなかった理由（/stats に出す）
+_embed_cache_error: Optional[str] = None
+
+def _open_embed_cache() -> Optional[EmbeddingCache]:
+    global _embed_cache_error
+    if not settings.embed_cache_enabled or settings.embed_server_url:
+        return None
+    try:
+        return EmbeddingCache(settings.embed_cache_dir, settings.embed_model,
+                              settings.embed_cache_max_entries, settings.embed_cache_dtype)
+    except CacheInUse as e:
+        # 同じディレクトリをほかのワーカー（uvicorn --workers N）が使っている。このプロセスはキャッシュなしで動く
+        _embed_cache_error = str(e)
+        logger.warning("%s; running without the embedding cache", e)
+        return None
+
+# 埋め込みキャッシュ（同じ本文はモデルを通さない）
+_embed_cache = _open_embed_cache()
+_embedding_fn = CachedEmbeddingFunction(_embedder, _embed_cache)
+
+class _RWLock:
+    """読み取りは同時に何本でも、書き込みは単独。書き込み待ちがあれば新しい読み取りは待たせる。"""
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._readers = 0
+        self._writer = False
+        self._waiting_writers = 0
+
+    @contextmanager
+    def reading(self):
+        waited = None
+        with self._cond:
+            if self._writer or self._waiting_writers:
+                started = time.perf_counter()
+                while self._writer or self._waiting_writers:
+                    self._cond.wait()
+                waited = time.perf_counter() - started
+            self._readers += 1
+        if waited is not None:
+            # 差し替え・一括削除を待たされた時間（待たなかったときは記録しない）
+            record_stage("index_lock_wait", waited)
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._readers -= 1
+                if self._readers == 0:
+                    self._cond.notify_all()
+
+    @contextmanager
+    def writing(self):
+        started = time.perf_counter()
+        with self._cond:
+            self._waiting_writers += 1
+            while self._writer or self._readers:
+                self._cond.wait()
+            self._waiting_writers -= 1
+            self._writer = True
+        record_stage("index_write_lock_wait", time.perf_counter() - started)
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._writer = False
+                self._cond.notify_all()
+
+# インデックス全体（Chroma・語彙インデックス・台帳）の整合を守るロック
+index_lock = _RWLock()
+
+# シャードの分け方と、シャードごとの世代番号・オフラインはファイルに記録
+# （再起動後も同じコレクションを開く）
+_shards_file = os.path.join(settings.chroma_dir, "k9_shards.json")
+# シャード導入前の世代番号の記録（default シャードの世代として一度だけ読む）
+_generation_file = os.path.join(settings.chroma_dir, "k9_generation")
+
+def _read_legacy_generation() -> int:
+    try:
+        with open(_generation_file, "r", encoding="utf-8") as f:
+            return int(f.read().strip() or 0)
+    except (OSError, ValueError):
+        return 0
+
+def _read_shard_state() -> dict:
+    try:
+        with open(_shards_file, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {"layout": {"by": "", "roots": []},
+                "shards": {DEFAULT_SHARD: {"generation": _read_legacy_generation(), "offline": False}}}
+
+def _write_shard_state():
+    state = {
+        "layout": _collection.router.layout(),
+        "shards": {s.id: {"generation": s.generation, "offline": s.offline}
+                   for s in _collection.shards.values()},
+    }
+    tmp = _shards_file + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(state, f, ensure_ascii=False, indent=1)
+    os.replace(tmp, _shards_file)
+
+def _shard_roots() -> List[str]:
+    # SHARD_ROOTS が空なら監視フォルダ、それも空なら DATA_ROOT
+    for value in (settings.shard_roots, settings.watch_roots):
+        roots = [r.strip() for r in value.split(",") if r.strip()]
+        if roots:
+            return roots
+    return [settings.data_root]
+
+def _collection_name(shard_id: str, gen: int) -> str:
+    # default シャードの世代 0 は従来どおりの名前（既存のインデックスをそのまま使える）
+    base = settings.collection_name if shard_id == DEFAULT_SHARD else f"{settings.collection_name}__{shard_id}"
+    return base if gen == 0 else f"{base}__g{gen}"
+
+def _is_ours(name: str) -> bool:
+    return re.fullmatch(re.escape(settings.collection_name) + r"(__[a-z0-9][a-z0-9-]*)?(__g\d+)?", name) is not None
+
+def _drop_other_generations(current: set):
+    """差し替え途中で止まった場合などに残った、古い世代・使わなくなったシャードのコレクションを消す。"""
+    for name in _backend.names():
+        if name not in current and _is_ours(name):
+            try:
+                _backend.drop(name)
+            except Exception:
+                pass
+
+# どのバックエンドで書いたかを記録（切り替えて起動したときに写すため）
+_backend_file = os.path.join(settings.chroma_dir, "k9_vector_backend")
+
+def _read_backend_kind() -> str:
+    try:
+        with open(_backend_file, "r", encoding="utf-8") as f:
+            return f.read().strip()
+    except OSError:
+        # 記録が無いのは Chroma しか無かった頃のインデックスか、まっさら
+        return "chroma" if os.path.exists(os.path.join(settings.chroma_dir, "chroma.sqlite3")) else ""
+
+def _write_backend_kind(kind: str):
+    tmp = _backend_file + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(kind)
+    os.replace(tmp, _backend_file)
+
+def _create_backend(kind: str):
+    if kind == "array":
+        return ArrayBackend(os.path.join(settings.chroma_dir, "k9_vectors"), _embedding_fn,
+                            settings.array_index_dtype, settings.array_index_rescore)
+    if kind == "chroma":
+        return ChromaBackend(settings.chroma_dir, _embedding_fn)
+    raise ValueError(f"VECTOR_BACKEND must be 'chroma' or 'array': {kind}")
+
+def _migrate(source_kind: str, names: List[str], page_size: int = 2000) -> int:
+    """前のバックエンドの現世代（シャードごと）を、埋め込みごと今のバックエンドへ写す。写した件数を返す。"""
+    source = _create_backend(source_kind)
+    existing = set(source.names())
+    copied = 0
+    for name in names:
+        if name not in existing:
+            continue
+        src = source.open(name)
+        # 途中で止まった写しが残っていれば捨ててからやり直す
+        if name in _backend.names():
+            _backend.drop(name)
+        dst = _backend.open(name)
+        offset = 0
+        with stage("index_migrate"):
+            while True:
+                data = src.get(limit=page_size, offset=offset, include=["documents", "metadatas", "embeddings"])
+                ids = data.get("ids") or []
+                if not ids:
+                    break
+                dst.upsert(ids=ids, documents=data["documents"], metadatas=data["metadatas"],
+                           embeddings=data["embeddings"])
+                offset += len(ids)
+        copied += offset
+    for other in source.names():
+        if _is_ours(other):
+            try:
+                source.drop(other)
+            except Exception:
+                pass
+    return copied
+
+def _reshard(router: ShardRouter, shards: Dict[str, Shard], leftovers: Dict[str, object],
+             page_size: int = 2000) -> int:
+    """
+    分け方が変わったとき、今の振り分けと違うシャードにあるチャンクを埋め込みごと移す。移した件数を返す。
+    leftovers は新しい分け方には無いシャード（中身をすべて移す）。
+    途中で止まっても、次の起動でもう一度（upsert なので重ねても同じ）移してから消す。
+    """
+    sources = [(sid, s.index) for sid, s in shards.items() if s.index is not None] + list(leftovers.items())
+    moved = 0
+    with stage("index_reshard"):
+        for sid, src in sources:
+            offset, stale = 0, []
+            while True:
+                data = src.get(limit=page_size, offset=offset, include=["documents", "metadatas", "embeddings"])
+                ids = data.get("ids") or []
+                if not ids:
+                    break
+                offset += len(ids)
+                groups: Dict[str, List[int]] = {}
+                for i, meta in enumerate(data["metadatas"]):
+                    groups.setdefault(router.route((meta or {}).get("path", "")), []).append(i)
+                for dest, idx in groups.items():
+                    if dest == sid or shards[dest].index is None:
+                        continue
+                    shards[dest].index.upsert(ids=[ids[i] for i in idx],
+                                              documents=[data["documents"][i] for i in idx],
+                                              metadatas=[data["metadatas"][i] for i in idx],
+                                              embeddings=[data["embeddings"][i] for i in idx])
+                    stale.extend(ids[i] for i in idx)
+            # 読み終えてから消す（読みながら消すと offset がずれる）
+            for s in range(0, len(stale), page_size):
+                src.delete(ids=stale[s:s + page_size])
+            moved += len(stale)
+    return moved
+
+# バックエンドとシャードをまとめたコレクション（_open_index() で開く）
+_backend = None
+_collection: Optional[ShardedIndex] = None
+_open_lock = threading.Lock()
+_index_state = {"state": "pending", "backend": settings.vector_backend, "shard_by": settings.shard_by,
+                "open_seconds": None, "migrated": None, "resharded": None, "failed_shards": [], "error": None}
+
+def _open_index():
+    """バックエンドを作り、各シャードの現在の世代のコレクションを開く（済んでいれば何もしない）。"""
+    global _backend, _collection
+    if _collection is not None:
+        return
+    with _open_lock:
+        if _collection is not None:
+            return
+        _index_state["state"] = "loading"
+        started = time.perf_counter()
+        try:
+            kind = settings.vector_backend
+            _backend = _create_backend(kind)
+            router = ShardRouter(settings.shard_by, _shard_roots() if settings.shard_by == "root" else ())
+            state = _read_shard_state()
+            recorded = {sid: entry.get("generation", 0) for sid, entry in state["shards"].items()}
+            previous = _read_backend_kind()
+            if previous and previous != kind:
+                names = [_collection_name(sid, gen) for sid, gen in recorded.items()]
+                _index_state["migrated"] = {"from": previous, "chunks": _migrate(previous, names)}
+            _write_backend_kind(kind)
+            # シャードごとにコレクションを開く（なければ作る）。開けなかったシャードだけ使えなくする
+            shards: Dict[str, Shard] = {}
+            for spec in router.specs:
+                entry = state["shards"].get(spec.id, {})
+                shard = Shard(spec, entry.get("generation", 0), entry.get("offline", False))
+                try:
+                    shard.index = _backend.open(_collection_name(spec.id, shard.generation))
+                except Exception as e:
+                    shard.error = str(e)
+                shards[spec.id] = shard
+            if state["layout"] != router.layout():
+                leftovers = {sid: _backend.open(_collection_name(sid, gen))
+                             for sid, gen in recorded.items()
+                             if sid not in shards and _collection_name(sid, gen) in _backend.names()}
+                _index_state["resharded"] = {"from": state["layout"], "chunks": _reshard(router, shards, leftovers)}
+            collection = ShardedIndex(router, shards, settings.shard_query_workers)
+            _drop_other_generations({_collection_name(s.id, s.generation) for s in shards.values()})
+        except Exception as e:
+            _index_state.update(state="failed", error=str(e))
+            raise
+        seconds = time.perf_counter() - started
+        record_stage("load_index", seconds)
+        _collection = collection
+        _write_shard_state()
+        _index_state.update(state="ready", open_seconds=seconds, error=None,
+                            failed_shards=[s.id for s in shards.values() if s.index is None])
+
+def get_collection() -> ShardedIndex:
+    """アプリ全体で共通のコレクション（全シャードの現在の世代）を返す。"""
+    if _collection is None:
+        _open_index()
     return _collection
+
+def get_generations() -> Dict[str, int]:
+    """シャードごとの現在の世代番号。リセットのたびに増える。"""
+    if _collection is None:
+        _open_index()
+    return {s.id: s.generation for s in _collection.shards.values()}
+
+def swap_collection(on_swap=None, shards: Optional[List[str]] = None) -> int:
+    """
+    シャード（省略時はすべて）を空の新しい世代に差し替え、旧世代のコレクションを削除する。旧世代の件数を返す。
+    on_swap は差し替えと同じ書き込みロック内で呼ばれる（語彙インデックス等のクリア用）。
+    開けなかったシャードも、新しい世代を作り直せれば使えるようになる。
+    """
+    _open_index()
+    targets = [_collection.shard(sid) for sid in (shards if shards is not None else list(_collection.shards))]
+    old_names: List[str] = []
+    count = 0
+    with stage("collection_swap"), index_lock.writing():
+        for shard in targets:
+            if shard.index is not None:
+                try:
+                    count += shard.index.count()
+                except Exception:
+                    pass
+            old_names.append(_collection_name(shard.id, shard.generation))
+            shard.generation += 1
+            shard.index = _backend.open(_collection_name(shard.id, shard.generation))
+            shard.error = None
+        _write_shard_state()
+        _index_state["failed_shards"] = [s.id for s in _collection.shards.values() if s.index is None]
+        if on_swap is not None:
+            on_swap()
+    # 旧世代を参照している読み手はもういない（書き込みロックを取れた時点で抜けている）
+    for name in old_names:
+        try:
+            with stage("collection_drop"):
+                _backend.drop(name)
+        except Exception:
+            pass
+    return count
+
+def set_shard_offline(shard_id: str, offline: bool) -> dict:
+    """シャードを検索の対象から外す／戻す（書き込み・リセットはオフラインでもできる）。"""
+    _open_index()
+    shard = _collection.shard(shard_id)
+    with index_lock.writing():
+        shard.offline = offline
+        _write_shard_state()
+    return shard.status()
+
+def get_embedding_function():
+    """コレクションと同じ埋め込み関数（キャッシュ込み）を返す。"""
+    return _embedding_fn
+
+def get_embed_cache():
+    """埋め込みキャッシュ（無効なら None）を返す。"""
+    return _embed_cache
+
+def embed_cache_error() -> Optional[str]:
+    """埋め込みキャッシュを開けなかった理由（ほかのプロセスが使用中など）。"""
+    return _embed_cache_error
+
+def warmup():
+    """
+    インデックスを開き、埋め込みモデルを読み込んで温める（起動後に裏のスレッドから呼ぶ）。
+    失敗しても例外は出さず、状態は readiness() に残る（次の利用で読み込み直す）。
+    """
+    for load in (_open_index, _embedder.load):
+        try:
+            load()
+        except Exception:
+            pass
+
+def readiness() -> dict:
+    """埋め込みモデルとインデックスの読み込み状態。両方 ready なら ready=True。"""
+    index = dict(_index_state)
+    embedder = _embedder.status()
+    return {
+        "ready": index["state"] == "ready" and embedder["state"] == "ready",
+        "index": index,
+        "embedder": embedder,
+    }
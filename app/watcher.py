@@ -0,0 +1,222 @@
+# =============================================
+# watcher.py
+# ---------------------------------------------
+# 監視対象フォルダの変更を拾って、インデックスを自動で最新に保つ。
+# ・watchfiles（Linux では inotify）で作成/変更/削除/リネームを検知
+#   watchfiles が無い・使えない環境ではポーリングで代用
+# ・一定時間（debounce）内の変更はまとめて、変わったファイルだけを
+#   取り込みジョブ（jobs.py → ingest.py）に流す
+# ・リネーム/移動は内容ハッシュで突き合わせ、埋め込みはそのまま path だけ更新
+# =============================================
+import os
+import threading
+import time
+from typing import Dict, List, Optional, Set, Tuple
+
+from .config import settings
+from .ingest import rename_path, scan_files
+from .jobs import job_manager
+from .manifest import manifest, normalize_path
+from .parsers import SUPPORTED_EXTS
+from .pipeline import file_hash
+from .recent import recent_index
+
+try:
+    import watchfiles
+except ImportError:  # 無ければポーリングで動く
+    watchfiles = None
+
+# (種類, パス) 種類は "added" / "modified" / "deleted"
+Event = Tuple[str, str]
+
+def _is_supported(path: str) -> bool:
+    return os.path.splitext(path)[1].lower() in SUPPORTED_EXTS
+
+def _scan(root: str) -> Dict[str, Tuple[int, float]]:
+    """ポーリング用のスナップショット（パス → (サイズ, mtime)）。"""
+    return {path: (st.st_size, st.st_mtime) for path, st in scan_files(root)}
+
+class IndexWatcher:
+    def __init__(self, roots: List[str], debounce_ms: int, force_polling: bool, poll_interval: float):
+        self.roots = roots
+        self.debounce_ms = debounce_ms
+        self.force_polling = force_polling
+        self.poll_interval = poll_interval
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.backend = "polling" if (force_polling or watchfiles is None) else "watchfiles"
+        self.batches = 0
+        self.files_reingested = 0
+        self.files_renamed = 0
+        self.last_batch_at: Optional[float] = None
+        self.last_error: Optional[str] = None
+
+    # ---- 起動・停止 ----
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="index-watcher", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=10)
+        self._thread = None
+
+    def status(self) -> dict:
+        return {
+            "running": self._thread is not None and self._thread.is_alive(),
+            "backend": self.backend,
+            "roots": self.roots,
+            "debounce_ms": self.debounce_ms,
+            "batches": self.batches,
+            "files_reingested": self.files_reingested,
+            "files_renamed": self.files_renamed,
+            "last_batch_at": self.last_batch_at,
+            "last_error": self.last_error,
+        }
+
+    def _run(self):
+        # 停止中に起きた変更を拾うため、最初に一度だけ差分取り込み（台帳で高速にスキップ）
+        roots = [r for r in self.roots if os.path.isdir(r)]
+        if roots:
+            job_manager.submit(roots)[0].done_event.wait()
+        if self.backend == "watchfiles":
+            try:
+                self._run_watchfiles(roots)
+                return
+            except Exception as e:
+                # inotify の上限超過やネットワークドライブなど。ポーリングに切り替える
+                self.last_error = f"watchfiles failed, falling back to polling: {e}"
+                self.backend = "polling"
+        self._run_polling(roots)
+
+    def _run_watchfiles(self, roots: List[str]):
+        for changes in watchfiles.watch(
+            *roots,
+            debounce=self.debounce_ms,
+            stop_event=self._stop,
+            force_polling=self.force_polling or None,
+            raise_interrupt=False,
+        ):
+            events: Set[Event] = set()
+            for change, path in changes:
+                events.add((change.name, path))
+            self._apply(events)
+
+    def _run_polling(self, roots: List[str]):
+        snapshots = {r: _scan(r) for r in roots}
+        pending: Set[Event] = set()
+        quiet_since = time.time()
+        while not self._stop.wait(self.poll_interval):
+            for r in roots:
+                new = _scan(r)
+                old = snapshots[r]
+                for path, sig in new.items():
+                    if path not in old:
+                        pending.add(("added", path))
+                    elif old[path] != sig:
+                        pending.add(("modified", path))
+                for path in old.keys() - new.keys():
+                    pending.add(("deleted", path))
+                snapshots[r] = new
+                if new != old:
+                    quiet_since = time.time()
+            # 変更が debounce の間止まったらまとめて反映
+            if pending and (time.time() - quiet_since) * 1000 >= self.debounce_ms:
+                self._apply(pending)
+                pending = set()
+
+    # ---- 変更の反映 ----
+
+    def _apply(self, events: Set[Event]):
+        added: Set[str] = set()
+        deleted: Set[str] = set()
+        changed: Set[str] = set()
+        # 台帳・メタデータの path と同じ形（絶対パス）にそろえる
+        events = {(kind, normalize_path(path)) for kind, path in events}
+        for kind, path in events:
+            if kind == "deleted":
+                if _is_supported(path):
+                    deleted.add(path)
+                else:
+                    # フォルダごと消えた/移動した
+                    deleted.update(manifest.paths_under(path))
+            elif os.path.isdir(path):
+                # フォルダごと追加された/移動してきた
+                for f in _scan(path):
+                    added.add(f)
+            elif _is_supported(path):
+                (added if kind == "added" else changed).add(path)
+        # 同じパスが消えて再作成された（エディタの保存など）は「変更」
+        changed |= added & deleted
+        added -= changed
+        deleted -= changed
+        self._note_recent(added | changed, deleted)
+
+        renamed = self._apply_renames(deleted, added)
+        targets = sorted((added | changed | deleted) - renamed)
+        if targets:
+            job = job_manager.submit(targets)[0]
+            job.done_event.wait()
+            if job.status == "failed":
+                self.last_error = job.error
+            self.files_reingested += len(targets)
+        self.batches += 1
+        self.last_batch_at = time.time()
+
+    @staticmethod
+    def _note_recent(updated: Set[str], deleted: Set[str]):
+        """最近のファイル索引にも、次の走査を待たずに反映する。"""
+        for path in deleted:
+            recent_index.note(path, None)
+        for path in updated:
+            try:
+                recent_index.note(path, os.path.getmtime(path))
+            except OSError:
+                continue
+
+    def _apply_renames(self, deleted: Set[str], added: Set[str]) -> Set[str]:
+        """
+        消えたファイルと増えたファイルを (サイズ, ハッシュ) で突き合わせてリネームとみなす。
+        処理済みのパス（旧・新とも）を返す。
+        """
+        by_size: Dict[int, List[Tuple[str, str]]] = {}
+        for old in deleted:
+            rec = manifest.get(old)
+            if rec is not None:
+                by_size.setdefault(rec.size, []).append((old, rec.digest))
+        handled: Set[str] = set()
+        if not by_size:
+            return handled
+        for new in sorted(added):
+            try:
+                size = os.path.getsize(new)
+            except OSError:
+                continue
+            candidates = by_size.get(size)
+            if not candidates:
+                continue
+            digest = file_hash(new)
+            for i, (old, old_digest) in enumerate(candidates):
+                if old_digest == digest and rename_path(old, new):
+                    handled.update((old, new))
+                    self.files_renamed += 1
+                    del candidates[i]
+                    break
+        return handled
+
+def _watch_roots() -> List[str]:
+    roots = [r.strip() for r in settings.watch_roots.split(",") if r.strip()]
+    return roots or [settings.data_root]
+
+# アプリ全体で共有するウォッチャー（起動は main.py の startup で）
+watcher = IndexWatcher(
+    _watch_roots(),
+    settings.watch_debounce_ms,
+    settings.watch_force_polling,
+    settings.watch_poll_interval,
+)
@@ -0,0 +1,9 @@
+# =============================================
+# bench
+# ---------------------------------------------
+# 取り込み・検索・チャットの再現可能なベンチマーク。
+# ・corpus.py   : 合成コーパスの生成（txt/md/docx/pdf、日本語・英語、重複率を指定）
+# ・llm_stub.py : OpenAI 互換の LLM スタブ（トークンごとの遅延を指定）
+# ・run.py      : サーバを起動してシナリオを流し、結果を JSON で出力
+# ・compare.py  : 2つの結果 JSON の比較
+# =============================================
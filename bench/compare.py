@@ -0,0 +1,45 @@
+# =============================================
+# compare.py
+# ---------------------------------------------
+# run.py の結果 JSON を2つ並べて、主要な数値の差を表にする。
+#   python -m bench.compare before.json after.json
+# 時間は小さいほど、スループット（/sec, rps）は大きいほど良い。
+# =============================================
+import json
+import sys
+from typing import Dict, Iterator, Tuple
+
+# 比べる数値（これ以外の内訳は JSON を直接見る）
+_KEYS = ("seconds", "files_per_sec", "chunks_per_sec", "files_checked_per_sec", "peak_rss_mb", "rps", "p50", "p95", "p99")
+
+def _flatten(obj, prefix: str = "") -> Iterator[Tuple[str, float]]:
+    if isinstance(obj, dict):
+        for k, v in obj.items():
+            yield from _flatten(v, f"{prefix}.{k}" if prefix else k)
+    elif isinstance(obj, list):
+        for item in obj:
+            # 同時実行数ごとの結果は c=N で区別する
+            tag = f"c={item['concurrency']}" if isinstance(item, dict) and "concurrency" in item else "?"
+            yield from _flatten(item, f"{prefix}[{tag}]")
+    elif isinstance(obj, (int, float)) and not isinstance(obj, bool) and prefix.rsplit(".", 1)[-1] in _KEYS:
+        yield prefix, float(obj)
+
+def metrics(result: dict) -> Dict[str, float]:
+    return dict(_flatten(result.get("scenarios", {})))
+
+def main():
+    if len(sys.argv) != 3:
+        print("usage: python -m bench.compare BEFORE.json AFTER.json", file=sys.stderr)
+        sys.exit(2)
+    with open(sys.argv[1], encoding="utf-8") as f:
+        before = json.load(f)
+    with open(sys.argv[2], encoding="utf-8") as f:
+        after = json.load(f)
+    a, b = metrics(before), metrics(after)
+    print(f"{'metric':<60} {before.get('label') or 'before':>12} {after.get('label') or 'after':>12} {'change':>9}")
+    for key in sorted(a.keys() & b.keys()):
+        change = f"{(b[key] - a[key]) / a[key] * 100:+.1f}%" if a[key] else "-"
+        print(f"{key:<60} {a[key]:>12.3f} {b[key]:>12.3f} {change:>9}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+# =============================================
+# corpus.py
+# ---------------------------------------------
+# ベンチマーク用の合成コーパスを作る。
+# ・形式（txt / md / docx / pdf）、ファイル数・サイズ、日本語と英語の割合、
+#   重複率（完全一致のコピーと、一部だけ変えた版）を指定できる
+# ・seed が同じなら同じ内容になる（実行ごとに結果を比べられるように）
+# ・型番（AB-1234 など）を混ぜ、語彙検索でも当たる質問を作れるようにする
+#
+#   python -m bench.corpus --out ./bench_corpus --files 200 --size-kb 16
+# =============================================
+import argparse
+import json
+import os
+import random
+from typing import Dict, List, Sequence
+
+_JA_SUBJECTS = ["営業部", "開発チーム", "経理課", "品質保証", "顧客", "本プロジェクト", "新製品", "物流センター",
+                "人事部", "情報システム部", "取引先", "倉庫", "サポート窓口", "設計担当", "工場"]
+_JA_OBJECTS = ["請求書", "議事録", "見積書", "仕様書", "在庫", "契約", "売上報告", "障害報告", "予算",
+               "出荷計画", "作業手順", "点検記録", "検収", "稟議", "納期"]
+_JA_VERBS = ["確認しました", "更新する予定です", "共有してください", "承認されました", "見直しが必要です",
+             "提出しました", "集計しています", "延期になりました", "改善されました", "調査中です"]
+_JA_EXTRAS = ["先週の会議で", "月末までに", "関係者全員に", "前回の指摘を受けて", "来期に向けて",
+              "至急", "念のため", "例年どおり", "予定より早く", "追加の資料とあわせて"]
+
+_EN_SUBJECTS = ["The sales team", "Engineering", "Accounting", "Quality assurance", "The customer",
+                "This project", "The new product", "The warehouse", "Support", "The vendor"]
+_EN_OBJECTS = ["the invoice", "the meeting notes", "the quotation", "the specification", "the inventory",
+               "the contract", "the sales report", "the incident report", "the budget", "the shipping plan"]
+_EN_VERBS = ["reviewed", "updated", "shared", "approved", "revised", "submitted", "summarized",
+             "postponed", "improved", "investigated"]
+_EN_EXTRAS = ["last week", "before the end of the month", "with all stakeholders", "after the audit",
+              "for the next quarter", "as requested", "ahead of schedule", "with the attachments"]
+
+FORMATS = ("txt", "md", "docx", "pdf")
+
+def _model_number(rng: random.Random) -> str:
+    return f"{rng.choice('ABCDEFGHKMNPRSTX')}{rng.choice('ABCDEFGHKMNPRSTX')}-{rng.randint(1000, 9999)}"
+
+def _sentence(rng: random.Random, lang: str) -> str:
+    if lang == "ja":
+        s = f"{rng.choice(_JA_EXTRAS)}、{rng.choice(_JA_SUBJECTS)}は{rng.choice(_JA_OBJECTS)}を{rng.choice(_JA_VERBS)}。"
+    else:
+        s = f"{rng.choice(_EN_SUBJECTS)} {rng.choice(_EN_VERBS)} {rng.choice(_EN_OBJECTS)} {rng.choice(_EN_EXTRAS)}."
+    if rng.random() < 0.1:
+        s += f" ({_model_number(rng)})"
+    return s
+
+def _paragraphs(rng: random.Random, lang: str, nchars: int) -> List[str]:
+    """おおよそ nchars 文字になるまで段落を作る。"""
+    out, total = [], 0
+    while total < nchars:
+        para = ("" if lang == "ja" else " ").join(_sentence(rng, lang) for _ in range(rng.randint(3, 8)))
+        out.append(para)
+        total += len(para) + 1
+    return out
+
+def _write_txt(path: str, title: str, paras: List[str]):
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(title + "\n\n" + "\n\n".join(paras) + "\n")
+
+def _write_md(path: str, title: str, paras: List[str]):
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(f"# {title}\n\n")
+        for i, p in enumerate(paras):
+            if i and i % 4 == 0:
+                f.write(f"## {i // 4}\n\n")
+            f.write(p + "\n\n")
+
+def _write_docx(path: str, title: str, paras: List[str]):
+    import docx
+    d = docx.Document()
+    d.add_heading(title, level=1)
+    for p in paras:
+        d.add_paragraph(p)
+    d.save(path)
+
+# PDF 1ページに入れるおおよその文字数（9pt、A4）
+_PDF_CHARS_PER_PAGE = 1500
+
+def _write_pdf(path: str, title: str, paras: List[str]):
+    import fitz  # PyMuPDF
+    text = title + "\n\n" + "\n".join(paras)
+    with fitz.open() as doc:
+        for start in range(0, len(text), _PDF_CHARS_PER_PAGE):
+            page = doc.new_page()
+            rect = page.rect + (40, 40, -40, -40)
+            # "japan" は PyMuPDF 内蔵の CJK フォント（英字もそのまま書ける）
+            page.insert_textbox(rect, text[start:start + _PDF_CHARS_PER_PAGE], fontsize=9, fontname="japan")
+        doc.save(path)
+
+_WRITERS = {"txt": _write_txt, "md": _write_md, "docx": _write_docx, "pdf": _write_pdf}
+
+def generate(out_dir: str, files: int = 100, size_kb: float = 8.0, formats: Sequence[str] = ("txt", "md"),
+             ja_ratio: float = 0.7, dup_ratio: float = 0.1, dirs: int = 4, seed: int = 0) -> Dict[str, object]:
+    """
+    out_dir にコーパスを作り、内容の要約（ファイル数・文字数・重複数など）を返す。
+    dup_ratio の分は、先に作ったファイルの完全コピーか、1段落だけ差し替えた版になる。
+    """
+    rng = random.Random(seed)
+    formats = [f for f in formats if f in _WRITERS] or ["txt"]
+    os.makedirs(out_dir, exist_ok=True)
+    # 日本語はだいたい1文字3バイト（UTF-8）なので、サイズ指定を文字数に直して揃える
+    made: List[tuple] = []   # (タイトル, 段落, 言語)
+    summary = {"files": 0, "chars": 0, "exact_duplicates": 0, "near_duplicates": 0,
+               "by_format": {f: 0 for f in formats}, "by_lang": {"ja": 0, "en": 0}}
+    for i in range(files):
+        fmt = formats[i % len(formats)]
+        sub = os.path.join(out_dir, f"dir{i % max(1, dirs):02d}")
+        os.makedirs(sub, exist_ok=True)
+        if made and rng.random() < dup_ratio:
+            title, paras, lang = rng.choice(made)
+            if rng.random() < 0.5:
+                summary["exact_duplicates"] += 1
+            else:
+                paras = list(paras)
+                paras[rng.randrange(len(paras))] = _paragraphs(rng, lang, 200)[0]
+                summary["near_duplicates"] += 1
+        else:
+            lang = "ja" if rng.random() < ja_ratio else "en"
+            nchars = int(size_kb * 1024 / (3 if lang == "ja" else 1))
+            title = f"{rng.choice(_JA_OBJECTS if lang == 'ja' else _EN_OBJECTS)} {_model_number(rng)}"
+            paras = _paragraphs(rng, lang, nchars)
+            made.append((title, paras, lang))
+        _WRITERS[fmt](os.path.join(sub, f"doc_{i:05d}.{fmt}"), title, paras)
+        summary["files"] += 1
+        summary["chars"] += len(title) + sum(len(p) for p in paras)
+        summary["by_format"][fmt] += 1
+        summary["by_lang"][lang] += 1
+    return summary
+
+def make_queries(n: int, ja_ratio: float = 0.7, seed: int = 0) -> List[str]:
+    """コーパスの語彙から検索・チャット用の質問を作る。"""
+    rng = random.Random(seed + 1)
+    out = []
+    for _ in range(n):
+        if rng.random() < ja_ratio:
+            out.append(f"{rng.choice(_JA_SUBJECTS)}の{rng.choice(_JA_OBJECTS)}はどうなりましたか")
+        else:
+            out.append(f"What happened to {rng.choice(_EN_OBJECTS)} from {rng.choice(_EN_SUBJECTS).lower()}?")
+    return out
+
+def main():
+    p = argparse.ArgumentParser(description="ベンチマーク用の合成コーパスを作る")
+    p.add_argument("--out", required=True)
+    p.add_argument("--files", type=int, default=100)
+    p.add_argument("--size-kb", type=float, default=8.0)
+    p.add_argument("--formats", default="txt,md,docx,pdf")
+    p.add_argument("--ja-ratio", type=float, default=0.7)
+    p.add_argument("--dup-ratio", type=float, default=0.1)
+    p.add_argument("--dirs", type=int, default=4)
+    p.add_argument("--seed", type=int, default=0)
+    a = p.parse_args()
+    summary = generate(a.out, a.files, a.size_kb, a.formats.split(","), a.ja_ratio, a.dup_ratio, a.dirs, a.seed)
+    print(json.dumps(summary, ensure_ascii=False, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+# =============================================
+# llm_stub.py
+# ---------------------------------------------
+# ベンチマーク用の OpenAI 互換 LLM スタブ（/v1/chat/completions）。
+# ・本物のモデルの代わりに、決まった遅延で決まった数のトークンを返す
+#     最初のトークンまで ttft_ms、以降 1トークンごとに token_ms
+# ・stream=true なら SSE で 1トークンずつ、false ならまとめて返す
+# ・LLM の速さに左右されずに、サーバ側（検索・文脈の組み立て・配信）だけを測れる
+#
+#   python -m bench.llm_stub --port 1234 --ttft-ms 150 --token-ms 20 --tokens 64
+# =============================================
+import argparse
+import asyncio
+import json
+import time
+
+from fastapi import FastAPI, Request
+from fastapi.responses import StreamingResponse
+
+_TOKENS = ["文書", "によると", "、", "請求書", "は", "確認", "済み", "です", "。", " The", " report", " was", " shared", "."]
+
+def create_app(ttft_ms: float = 150.0, token_ms: float = 20.0, tokens: int = 64) -> FastAPI:
+    app = FastAPI(title="K-nine LLM stub")
+    state = {"requests": 0, "streams": 0}
+
+    def _words(n: int):
+        return [_TOKENS[i % len(_TOKENS)] for i in range(n)]
+
+    @app.get("/v1/models")
+    def models():
+        return {"object": "list", "data": [{"id": "stub", "object": "model", "owned_by": "bench"}]}
+
+    @app.get("/stats")
+    def stats():
+        return state
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(req: Request):
+        body = await req.json()
+        state["requests"] += 1
+        n = int(body.get("max_tokens") or tokens)
+        n = min(n, tokens)
+        model = body.get("model", "stub")
+        created = int(time.time())
+        words = _words(n)
+        if body.get("stream"):
+            state["streams"] += 1
+
+            async def gen():
+                await asyncio.sleep(ttft_ms / 1000)
+                for i, w in enumerate(words):
+                    if i:
+                        await asyncio.sleep(token_ms / 1000)
+                    chunk = {"id": "stub", "object": "chat.completion.chunk", "created": created, "model": model,
+                             "choices": [{"index": 0, "delta": {"content": w}, "finish_reason": None}]}
+                    yield f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n"
+                done = {"id": "stub", "object": "chat.completion.chunk", "created": created, "model": model,
+                        "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]}
+                yield f"data: {json.dumps(done)}\n\n"
+                yield "data: [DONE]\n\n"
+            return StreamingResponse(gen(), media_type="text/event-stream")
+        await asyncio.sleep((ttft_ms + token_ms * max(0, n - 1)) / 1000)
+        return {
+            "id": "stub", "object": "chat.completion", "created": created, "model": model,
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": "".join(words)},
+                         "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": 0, "completion_tokens": n, "total_tokens": n},
+        }
+
+    return app
+
+def main():
+    import uvicorn
+    p = argparse.ArgumentParser(description="OpenAI 互換の LLM スタブ")
+    p.add_argument("--host", default="127.0.0.1")
+    p.add_argument("--port", type=int, default=1234)
+    p.add_argument("--ttft-ms", type=float, default=150.0)
+    p.add_argument("--token-ms", type=float, default=20.0)
+    p.add_argument("--tokens", type=int, default=64)
+    a = p.parse_args()
+    uvicorn.run(create_app(a.ttft_ms, a.token_ms, a.tokens), host=a.host, port=a.port, log_level="warning")
+
+if __name__ == "__main__":
+    main()
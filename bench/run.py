@@ -0,0 +1,427 @@
+# =============================================
+# run.py
+# ---------------------------------------------
+# ベンチマークの実行。API サーバと LLM スタブを別プロセスで起動し、
+# HTTP 越しにシナリオを流して結果を JSON で出力します。
+# ・ingest : cold（空のインデックス）/ warm（変更なしの再取り込み）/
+#            reembed（リセット後の再取り込み。埋め込みキャッシュは温まった状態）
+#            files/sec, chunks/sec, サーバのピーク RSS（子プロセス込み）
+# ・search : /search を同時実行数ごとに流し、p50/p95/p99 とスループット
+# ・chat   : /chat の往復時間と、/chat/stream の最初のトークンまでの時間
+# サーバは毎回まっさらな CHROMA_DIR / EMBED_CACHE_DIR で起動し、回答キャッシュは切る。
+#
+#   python -m bench.run --files 200 --out results.json
+#   python -m bench.compare before.json after.json
+# =============================================
+import argparse
+import asyncio
+import json
+import os
+import platform
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from typing import Dict, List, Optional
+
+import httpx
+
+from . import corpus
+
+_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# ---- 計測の道具 ----
+
+def percentiles(values: List[float]) -> Dict[str, Optional[float]]:
+    """p50/p95/p99・平均・最大（ミリ秒。最近傍順位法）。"""
+    if not values:
+        return {"count": 0, "mean": None, "p50": None, "p95": None, "p99": None, "max": None}
+    s = sorted(values)
+
+    def pick(q: float) -> float:
+        return round(s[min(len(s) - 1, max(0, int(q * len(s) + 0.999999) - 1))], 3)
+
+    return {"count": len(s), "mean": round(sum(s) / len(s), 3),
+            "p50": pick(0.50), "p95": pick(0.95), "p99": pick(0.99), "max": round(s[-1], 3)}
+
+def _children(pid: int) -> List[int]:
+    out = []
+    try:
+        for tid in os.listdir(f"/proc/{pid}/task"):
+            with open(f"/proc/{pid}/task/{tid}/children") as f:
+                out.extend(int(c) for c in f.read().split())
+    except OSError:
+        pass
+    return out
+
+def _rss_bytes(pid: int) -> int:
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return 0
+
+def tree_rss(pid: int) -> int:
+    """プロセスとその子孫（取り込みのワーカープロセス）の RSS 合計。Linux 以外は 0。"""
+    total, stack = 0, [pid]
+    while stack:
+        p = stack.pop()
+        total += _rss_bytes(p)
+        stack.extend(_children(p))
+    return total
+
+class RssSampler:
+    """区間中のピーク RSS を一定間隔で取る（with で囲む）。"""
+
+    def __init__(self, pid: int, interval: float = 0.05):
+        self.pid = pid
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, tree_rss(self.pid))
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self.peak = tree_rss(self.pid)
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, tree_rss(self.pid))
+
+    @property
+    def peak_mb(self) -> Optional[float]:
+        return round(self.peak / 2**20, 1) if self.peak else None
+
+# ---- プロセスの起動 ----
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def _wait_http(url: str, proc: subprocess.Popen, timeout: float):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"process exited early ({proc.returncode}): {' '.join(proc.args)}")
+        try:
+            if httpx.get(url, timeout=1.0).status_code < 500:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise TimeoutError(f"{url} did not come up in {timeout}s")
+
+def _stop(proc: Optional[subprocess.Popen]):
+    if proc is None or proc.poll() is not None:
+        return
+    proc.terminate()
+    try:
+        proc.wait(timeout=15)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+
+def start_llm_stub(port: int, ttft_ms: float, token_ms: float, tokens: int) -> subprocess.Popen:
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "bench.llm_stub", "--port", str(port),
+         "--ttft-ms", str(ttft_ms), "--token-ms", str(token_ms), "--tokens", str(tokens)],
+        cwd=_ROOT,
+    )
+    _wait_http(f"http://127.0.0.1:{port}/v1/models", proc, 30)
+    return proc
+
+def start_embed_server(sock: str, env: Dict[str, str], timeout: float) -> subprocess.Popen:
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "app.embed_server", "--uds", sock],
+        cwd=_ROOT, env={**os.environ, **env},
+    )
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"process exited early ({proc.returncode}): {' '.join(proc.args)}")
+        try:
+            with httpx.Client(transport=httpx.HTTPTransport(uds=sock)) as c:
+                if c.get("http://embed/health", timeout=1.0).status_code < 500:
+                    return proc
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise TimeoutError(f"embed server did not come up in {timeout}s")
+
+def start_server(port: int, env: Dict[str, str], timeout: float) -> subprocess.Popen:
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(port), "--log-level", "warning"],
+        cwd=_ROOT, env={**os.environ, **env},
+    )
+    _wait_http(f"http://127.0.0.1:{port}/health", proc, timeout)
+    return proc
+
+# ---- シナリオ ----
+
+def _ingest_once(client: httpx.Client, pid: int, paths: List[str]) -> dict:
+    with RssSampler(pid) as rss:
+        t0 = time.perf_counter()
+        r = client.post("/ingest", json={"paths": paths})
+        elapsed = time.perf_counter() - t0
+    r.raise_for_status()
+    body = r.json()
+    files = body["processed_files"]
+    chunks = body["processed_chunks"]
+    # 変更なしで飛ばしたファイルも含めた「確認した」ファイル数（warm はこちらで比べる）
+    checked = files + body.get("unchanged_files", 0)
+    return {
+        "seconds": round(elapsed, 3),
+        "files": files,
+        "chunks": chunks,
+        "unchanged_files": body.get("unchanged_files", 0),
+        "errors": len(body.get("errors", [])),
+        "files_per_sec": round(files / elapsed, 2) if elapsed else None,
+        "chunks_per_sec": round(chunks / elapsed, 2) if elapsed else None,
+        "files_checked_per_sec": round(checked / elapsed, 2) if elapsed else None,
+        "peak_rss_mb": rss.peak_mb,
+    }
+
+def scenario_ingest(client: httpx.Client, pid: int, corpus_dir: str) -> dict:
+    out = {"cold": _ingest_once(client, pid, [corpus_dir])}
+    out["warm"] = _ingest_once(client, pid, [corpus_dir])
+    client.post("/reset").raise_for_status()
+    out["reembed"] = _ingest_once(client, pid, [corpus_dir])
+    return out
+
+async def _load(base_url: str, concurrency: int, n: int, make_request) -> dict:
+    """n 件を concurrency 本の並行ワーカーで流し、レイテンシ（ms）を集める。"""
+    latencies: List[float] = []
+    errors = 0
+    counter = iter(range(n))
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=300) as client:
+        async def worker():
+            nonlocal errors
+            for i in counter:
+                t0 = time.perf_counter()
+                try:
+                    await make_request(client, i)
+                except (httpx.HTTPError, ValueError):
+                    errors += 1
+                    continue
+                latencies.append((time.perf_counter() - t0) * 1000)
+
+        t0 = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - t0
+    return {"concurrency": concurrency, "requests": n, "errors": errors,
+            "seconds": round(elapsed, 3), "rps": round(len(latencies) / elapsed, 2) if elapsed else None,
+            "latency_ms": percentiles(latencies)}
+
+def scenario_search(base_url: str, queries: List[str], modes: List[str], levels: List[int],
+                    n: int, k: int) -> dict:
+    out = {}
+    for mode in modes:
+        async def request(client: httpx.AsyncClient, i: int, mode=mode):
+            r = await client.get("/search", params={"q": queries[i % len(queries)], "k": k, "mode": mode})
+            r.raise_for_status()
+
+        # 最初の数件は捨てる（モデルのロードや SQLite のページキャッシュ）
+        asyncio.run(_load(base_url, 1, min(5, n), request))
+        out[mode] = [asyncio.run(_load(base_url, c, n, request)) for c in levels]
+    return out
+
+def scenario_chat(base_url: str, queries: List[str], levels: List[int], n: int) -> dict:
+    # LLM の順番待ちが期限に間に合わず、抜粋の回答になった件数（速く見えても LLM を通っていない）
+    degraded = [0]
+
+    async def chat(client: httpx.AsyncClient, i: int):
+        r = await client.post("/chat", json={"query": queries[i % len(queries)]})
+        r.raise_for_status()
+        if r.json().get("degraded"):
+            degraded[0] += 1
+
+    ttfts: List[float] = []
+
+    async def stream(client: httpx.AsyncClient, i: int):
+        t0 = time.perf_counter()
+        first = None
+        async with client.stream("POST", "/chat/stream", json={"query": queries[i % len(queries)]}) as r:
+            r.raise_for_status()
+            async for line in r.aiter_lines():
+                if not line:
+                    continue
+                event = json.loads(line)
+                if first is None and event.get("type") == "token":
+                    first = (time.perf_counter() - t0) * 1000
+                if event.get("type") == "done" and event.get("degraded"):
+                    degraded[0] += 1
+        if first is not None:
+            ttfts.append(first)
+
+    out = {"chat": [], "chat_stream": []}
+    for c in levels:
+        degraded[0] = 0
+        res = asyncio.run(_load(base_url, c, n, chat))
+        res["degraded"] = degraded[0]
+        out["chat"].append(res)
+    for c in levels:
+        ttfts.clear()
+        degraded[0] = 0
+        res = asyncio.run(_load(base_url, c, n, stream))
+        res["ttft_ms"] = percentiles(ttfts)
+        res["degraded"] = degraded[0]
+        out["chat_stream"].append(res)
+    return out
+
+# ---- 実行情報 ----
+
+def _git_rev() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=_ROOT, capture_output=True,
+                              text=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+def _server_settings(env: Dict[str, str]) -> dict:
+    """サーバと同じ環境で読んだ設定のうち、性能に効くもの。"""
+    code = ("import json; from app.config import settings as s; print(json.dumps({k: getattr(s, k) for k in "
+            "('embed_model', 'max_chars_per_chunk', 'chunk_overlap_chars', 'ingest_workers', "
+            "'embed_batch_size', 'search_mode', 'embed_cache_enabled', 'context_token_budget', "
+            "'embed_server_url', 'vector_backend', 'array_index_dtype')}))")
+    try:
+        r = subprocess.run([sys.executable, "-c", code], cwd=_ROOT, env={**os.environ, **env},
+                           capture_output=True, text=True, timeout=60)
+        return json.loads(r.stdout.strip().splitlines()[-1])
+    except (OSError, subprocess.SubprocessError, ValueError, IndexError):
+        return {}
+
+def _ints(s: str) -> List[int]:
+    return [int(x) for x in s.split(",") if x.strip()]
+
+def main():
+    p = argparse.ArgumentParser(description="K-nine の取り込み・検索・チャットのベンチマーク")
+    p.add_argument("--out", help="結果 JSON の出力先（省略時は標準出力）")
+    p.add_argument("--label", default="", help="結果に残す名前（比較用）")
+    p.add_argument("--scenarios", default="ingest,search,chat")
+    # コーパス（--corpus を指定しなければ生成する）
+    p.add_argument("--corpus", help="既存のフォルダを使う")
+    p.add_argument("--files", type=int, default=100)
+    p.add_argument("--size-kb", type=float, default=8.0)
+    p.add_argument("--formats", default="txt,md,docx,pdf")
+    p.add_argument("--ja-ratio", type=float, default=0.7)
+    p.add_argument("--dup-ratio", type=float, default=0.1)
+    p.add_argument("--seed", type=int, default=0)
+    # 負荷
+    p.add_argument("--search-modes", default="vector,lexical,hybrid")
+    p.add_argument("--search-concurrency", default="1,8,32")
+    p.add_argument("--search-requests", type=int, default=200)
+    p.add_argument("--k", type=int, default=5)
+    p.add_argument("--chat-concurrency", default="1,4")
+    p.add_argument("--chat-requests", type=int, default=20)
+    # LLM スタブ（--llm-url を指定すればそちらを使う）
+    p.add_argument("--llm-url")
+    p.add_argument("--llm-ttft-ms", type=float, default=150.0)
+    p.add_argument("--llm-token-ms", type=float, default=20.0)
+    p.add_argument("--llm-tokens", type=int, default=64)
+    p.add_argument("--vector-backend", choices=["chroma", "array"], help="VECTOR_BACKEND（既定は .env のまま）")
+    p.add_argument("--array-dtype", choices=["float32", "float16", "int8"], help="ARRAY_INDEX_DTYPE")
+    p.add_argument("--embed-server", action="store_true",
+                   help="埋め込みを別プロセスの埋め込みサーバ（UNIX ソケット）で行う")
+    p.add_argument("--startup-timeout", type=float, default=300.0)
+    p.add_argument("--keep", action="store_true", help="作業フォルダ（コーパス・インデックス）を残す")
+    a = p.parse_args()
+    scenarios = {s.strip() for s in a.scenarios.split(",") if s.strip()}
+
+    work = tempfile.mkdtemp(prefix="k9-bench-")
+    llm = server = embed_server = None
+    try:
+        corpus_dir = os.path.abspath(a.corpus) if a.corpus else os.path.join(work, "corpus")
+        corpus_info = None
+        if not a.corpus:
+            corpus_info = corpus.generate(corpus_dir, a.files, a.size_kb, a.formats.split(","),
+                                          a.ja_ratio, a.dup_ratio, seed=a.seed)
+        llm_url = a.llm_url
+        if not llm_url:
+            llm_port = _free_port()
+            llm = start_llm_stub(llm_port, a.llm_ttft_ms, a.llm_token_ms, a.llm_tokens)
+            llm_url = f"http://127.0.0.1:{llm_port}/v1"
+        env = {
+            "CHROMA_DIR": os.path.join(work, "chroma"),
+            "EMBED_CACHE_DIR": os.path.join(work, "embed_cache"),
+            "DATA_ROOT": corpus_dir,
+            "RECENT_ROOTS": corpus_dir,
+            "WATCH_ENABLED": "false",
+            "ANSWER_CACHE_ENABLED": "false",
+            "LLM_BASE_URL": llm_url,
+        }
+        if a.vector_backend:
+            env["VECTOR_BACKEND"] = a.vector_backend
+        if a.array_dtype:
+            env["ARRAY_INDEX_DTYPE"] = a.array_dtype
+        if a.embed_server:
+            sock = os.path.join(work, "embed.sock")
+            embed_server = start_embed_server(sock, env, a.startup_timeout)
+            env["EMBED_SERVER_URL"] = f"unix://{sock}"
+        port = _free_port()
+        base_url = f"http://127.0.0.1:{port}"
+        t0 = time.perf_counter()
+        server = start_server(port, env, a.startup_timeout)
+        startup_s = time.perf_counter() - t0
+
+        result = {
+            "label": a.label,
+            "started_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "git": _git_rev(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "settings": _server_settings(env),
+            "args": vars(a),
+            "corpus": corpus_info or {"path": corpus_dir},
+            "server_startup_seconds": round(startup_s, 3),
+            "scenarios": {},
+        }
+        queries = corpus.make_queries(max(50, a.search_requests), a.ja_ratio, a.seed)
+        with httpx.Client(base_url=base_url, timeout=None) as client:
+            if "ingest" in scenarios:
+                result["scenarios"]["ingest"] = scenario_ingest(client, server.pid, corpus_dir)
+            elif {"search", "chat"} & scenarios:
+                client.post("/ingest", json={"paths": [corpus_dir]}).raise_for_status()
+        if "search" in scenarios:
+            result["scenarios"]["search"] = scenario_search(
+                base_url, queries, a.search_modes.split(","), _ints(a.search_concurrency),
+                a.search_requests, a.k)
+        if "chat" in scenarios:
+            result["scenarios"]["chat"] = scenario_chat(
+                base_url, queries, _ints(a.chat_concurrency), a.chat_requests)
+        result["server_rss_mb"] = round(tree_rss(server.pid) / 2**20, 1) or None
+        if embed_server is not None:
+            result["embed_server_rss_mb"] = round(tree_rss(embed_server.pid) / 2**20, 1) or None
+    finally:
+        _stop(server)
+        _stop(embed_server)
+        _stop(llm)
+        if a.keep:
+            print(f"work dir: {work}", file=sys.stderr)
+        else:
+            shutil.rmtree(work, ignore_errors=True)
+
+    text = json.dumps(result, ensure_ascii=False, indent=2)
+    if a.out:
+        with open(a.out, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+if __name__ == "__main__":
+    main()
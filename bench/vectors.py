@@ -0,0 +1,176 @@
+# =============================================
+# vectors.py
+# ---------------------------------------------
+# ベクトルインデックスのバックエンド比較（VECTOR_BACKEND / ARRAY_INDEX_DTYPE を選ぶための材料）。
+# 合成ベクトル（クラスタ状）を各バックエンドに入れ、次を測る。
+# ・recall@k  : 厳密な総当たり（float32）の上位 k 件をどれだけ拾えたか（全体 / メタデータ条件付き）
+# ・latency   : 1件ずつ問い合わせたときの p50/p95/p99
+# ・memory    : 開き直してから1件ずつの問い合わせを終えるまでに増えた RSS と、ディスク上の大きさ
+# 構成ごとに別プロセスで動かす（RSS が混ざらないように）。埋め込みモデルは使わない。
+#
+#   python -m bench.vectors --n 100000 --dim 384 --out vectors.json
+#   python -m bench.vectors --configs chroma,array:float32,array:int8 --rescore 4
+# =============================================
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List
+
+import numpy as np
+
+from .run import _rss_bytes, percentiles
+
+_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+_GROUPS = 10            # メタデータ条件付きの問い合わせは group == 3（全体の 1/10）で絞る
+_WRITE_BATCH = 2000
+
+def make_data(n: int, dim: int, queries: int, clusters: int, seed: int):
+    """クラスタ状の正規化済みベクトルと、既存ベクトルを少し崩した質問ベクトル。"""
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, dim)).astype(np.float32)
+    labels = rng.integers(0, clusters, n)
+    data = centers[labels] + 0.6 * rng.standard_normal((n, dim)).astype(np.float32)
+    data /= np.linalg.norm(data, axis=1, keepdims=True)
+    picks = rng.integers(0, n, queries)
+    q = data[picks] + 0.5 / np.sqrt(dim) * rng.standard_normal((queries, dim)).astype(np.float32)
+    q /= np.linalg.norm(q, axis=1, keepdims=True)
+    return data.astype(np.float32), q.astype(np.float32)
+
+def exact_topk(data: np.ndarray, q: np.ndarray, k: int, rows: np.ndarray = None) -> List[List[int]]:
+    sub = data if rows is None else data[rows]
+    scores = q @ sub.T
+    top = np.argsort(-scores, axis=1)[:, :k]
+    return (top if rows is None else rows[top]).tolist()
+
+def recall(found: List[List[str]], truth: List[List[int]]) -> float:
+    hit = sum(len({int(i) for i in f} & set(t)) for f, t in zip(found, truth))
+    return round(hit / max(1, sum(len(t) for t in truth)), 4)
+
+def _dir_bytes(path: str) -> int:
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+def _open_backend(kind: str, dtype: str, rescore: int, path: str):
+    sys.path.insert(0, _ROOT)
+    if kind == "chroma":
+        from app.vector_index import ChromaBackend
+        return ChromaBackend(path, None)
+    from app.array_index import ArrayBackend
+    return ArrayBackend(path, None, dtype, rescore)
+
+def run_child(a) -> dict:
+    """1構成分: 書き込み → 開き直し → 問い合わせ。"""
+    kind, _, dtype = a.child.partition(":")
+    data, q = make_data(a.n, a.dim, a.queries, a.clusters, a.seed)
+    ids = [str(i) for i in range(a.n)]
+    metas = [{"path": f"/bench/{i % 1000}.txt", "group": i % _GROUPS} for i in range(a.n)]
+
+    backend = _open_backend(kind, dtype or "float32", a.rescore, a.workdir)
+    index = backend.open("bench_vectors")
+    t0 = time.perf_counter()
+    for s in range(0, a.n, _WRITE_BATCH):
+        e = min(a.n, s + _WRITE_BATCH)
+        index.upsert(ids=ids[s:e], metadatas=metas[s:e], embeddings=data[s:e])
+    build_s = time.perf_counter() - t0
+    del index, backend, data
+
+    rss_before = _rss_bytes(os.getpid())
+    t0 = time.perf_counter()
+    backend = _open_backend(kind, dtype or "float32", a.rescore, a.workdir)
+    index = backend.open("bench_vectors")
+    open_s = time.perf_counter() - t0
+    results: Dict[str, dict] = {}
+    for label, where in (("all", None), ("filtered", {"group": 3})):
+        found, lat = [], []
+        for vec in q:
+            t = time.perf_counter()
+            res = index.query(query_embeddings=[vec.tolist()], n_results=a.k, where=where, include=["distances"])
+            lat.append((time.perf_counter() - t) * 1000)
+            found.append(res["ids"][0])
+        results[label] = {"latency_ms": percentiles(lat), "ids": found}
+    rss_delta = _rss_bytes(os.getpid()) - rss_before
+    # 同じ質問をまとめて1回で（retrieve_batch の形。スコア行列の分だけ一時的にメモリを使う）
+    t = time.perf_counter()
+    index.query(query_embeddings=q.tolist(), n_results=a.k, include=["distances"])
+    batch_ms = (time.perf_counter() - t) * 1000
+    return {
+        "build_seconds": round(build_s, 3),
+        "open_seconds": round(open_s, 3),
+        "batch_query_ms": round(batch_ms, 3),
+        "rss_delta_mb": round(rss_delta / 2**20, 1),
+        "disk_mb": round(_dir_bytes(a.workdir) / 2**20, 1),
+        "stats": index.stats(),
+        "queries": results,
+    }
+
+def main():
+    p = argparse.ArgumentParser(description="K-nine ベクトルインデックスのバックエンド比較")
+    p.add_argument("--n", type=int, default=50000, help="ベクトル数")
+    p.add_argument("--dim", type=int, default=384)
+    p.add_argument("--queries", type=int, default=200)
+    p.add_argument("--k", type=int, default=10)
+    p.add_argument("--clusters", type=int, default=64)
+    p.add_argument("--configs", default="chroma,array:float32,array:float16,array:int8",
+                   help="chroma / array:<float32|float16|int8> をカンマ区切りで")
+    p.add_argument("--rescore", type=int, default=4, help="量子化時に float32 で採点し直す候補の倍率")
+    p.add_argument("--seed", type=int, default=0)
+    p.add_argument("--out")
+    p.add_argument("--child", help=argparse.SUPPRESS)
+    p.add_argument("--workdir", help=argparse.SUPPRESS)
+    a = p.parse_args()
+
+    if a.child:
+        print(json.dumps(run_child(a)))
+        return
+
+    data, q = make_data(a.n, a.dim, a.queries, a.clusters, a.seed)
+    truth = {
+        "all": exact_topk(data, q, a.k),
+        "filtered": exact_topk(data, q, a.k, np.arange(3, a.n, _GROUPS)),
+    }
+    del data
+    result = {"args": vars(a), "cpus": os.cpu_count(), "configs": {}}
+    for config in [c.strip() for c in a.configs.split(",") if c.strip()]:
+        work = tempfile.mkdtemp(prefix="k9-vectors-")
+        try:
+            args = [sys.executable, "-m", "bench.vectors", "--child", config, "--workdir", work]
+            for name in ("n", "dim", "queries", "k", "clusters", "rescore", "seed"):
+                args += [f"--{name}", str(getattr(a, name))]
+            out = subprocess.run(args, cwd=_ROOT, capture_output=True, text=True, check=True)
+            child = json.loads(out.stdout.strip().splitlines()[-1])
+        except subprocess.CalledProcessError as e:
+            print(f"{config}: failed\n{e.stderr}", file=sys.stderr)
+            continue
+        finally:
+            shutil.rmtree(work, ignore_errors=True)
+        for label, res in child["queries"].items():
+            res["recall"] = recall(res.pop("ids"), truth[label])
+        result["configs"][config] = child
+        print(f"{config:16s} recall={child['queries']['all']['recall']:.4f}"
+              f" filtered={child['queries']['filtered']['recall']:.4f}"
+              f" p50={child['queries']['all']['latency_ms']['p50']}ms"
+              f" p95={child['queries']['all']['latency_ms']['p95']}ms"
+              f" filtered_p50={child['queries']['filtered']['latency_ms']['p50']}ms"
+              f" rss+={child['rss_delta_mb']}MB disk={child['disk_mb']}MB"
+              f" build={child['build_seconds']}s", file=sys.stderr)
+
+    text = json.dumps(result, ensure_ascii=False, indent=2)
+    if a.out:
+        with open(a.out, "w", encoding="utf-8") as f:
+            f.write(text)
+    else:
+        print(text)
+
+if __name__ == "__main__":
+    main()
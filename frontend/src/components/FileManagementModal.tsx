@@ -7,6 +7,9 @@ interface FileInfo {
     chunk_count: number;
 }
 
+// 1回に取得する件数（続きは「さらに読み込む」で取る）
+const PAGE_SIZE = 200;
+
 interface FileManagementModalProps {
     isOpen: boolean;
     onClose: () => void;
@@ -15,15 +18,24 @@ interface FileManagementModalProps {
 
 export const FileManagementModal: React.FC<FileManagementModalProps> = ({ isOpen, onClose, onReset }) => {
     const [files, setFiles] = useState<FileInfo[]>([]);
+    const [total, setTotal] = useState(0);
+    const [nextOffset, setNextOffset] = useState<number | null>(null);
     const [isLoading, setIsLoading] = useState(false);
+    const [isLoadingMore, setIsLoadingMore] = useState(false);
+
+    const fetchPage = async (offset: number) => {
+        const res = await fetch(`${API_BASE_URL}/ingested-files?offset=${offset}&limit=${PAGE_SIZE}`);
+        if (!res.ok) throw new Error('ファイル一覧の取得に失敗しました');
+        const data = await res.json();
+        setTotal(data.total);
+        setNextOffset(data.next_offset ?? null);
+        return data.files as FileInfo[];
+    };
 
     const fetchFiles = async () => {
         setIsLoading(true);
         try {
-            const res = await fetch(`${API_BASE_URL}/ingested-files`);
-            if (!res.ok) throw new Error('ファイル一覧の取得に失敗しました');
-            const data = await res.json();
-            setFiles(data.files);
+            setFiles(await fetchPage(0));
         } catch (error) {
             console.error(error);
             alert('ファイル一覧の取得に失敗しました');
@@ -32,6 +44,22 @@ export const FileManagementModal: React.FC<FileManagementModalProps> = ({ isOpen
         }
     };
 
+    const loadMore = async () => {
+        if (nextOffset === null) return;
+        setIsLoadingMore(true);
+        try {
+            // 削除した分だけ後ろの行が詰まるので、続きは今表示している件数から取る
+            const page = await fetchPage(files.length);
+            const seen = new Set(files.map(f => f.path));
+            setFiles([...files, ...page.filter(f => !seen.has(f.path))]);
+        } catch (error) {
+            console.error(error);
+            alert('ファイル一覧の取得に失敗しました');
+        } finally {
+            setIsLoadingMore(false);
+        }
+    };
+
     useEffect(() => {
         if (isOpen) {
             fetchFiles();
@@ -51,6 +79,7 @@ export const FileManagementModal: React.FC<FileManagementModalProps> = ({ isOpen
 
             // リストから削除
             setFiles(files.filter(f => f.path !== path));
+            setTotal(t => Math.max(0, t - 1));
         } catch (error) {
             console.error(error);
             alert('削除に失敗しました');
@@ -86,6 +115,16 @@ export const FileManagementModal: React.FC<FileManagementModalProps> = ({ isOpen
                             ))}
                         </ul>
                     )}
+                    {!isLoading && files.length > 0 && (
+                        <div className="file-list-more">
+                            <span className="file-meta">{files.length} / {total} 件を表示</span>
+                            {nextOffset !== null && (
+                                <button onClick={loadMore} disabled={isLoadingMore}>
+                                    {isLoadingMore ? '読み込み中...' : 'さらに読み込む'}
+                                </button>
+                            )}
+                        </div>
+                    )}
                 </div>
 
                 <div className="modal-footer">
@@ -0,0 +1,51 @@
+# =============================================
+# conftest.py
+# ---------------------------------------------
+# テスト共通の準備。
+# ・app のモジュールは import 時に台帳・語彙インデックス等の SQLite を開くので、
+#   保存先（CHROMA_DIR / EMBED_CACHE_DIR）を先に一時フォルダへ向けておく
+# ・埋め込みモデル（sentence-transformers）や LLM は使わない。
+#   取り込みを通すテストは fake_embedder で文字 2-gram のハッシュベクトルに差し替える
+#
+#   pip install -r tests/requirements.txt
+#   python -m pytest -q
+# =============================================
+import hashlib
+import os
+import sys
+import tempfile
+
+import numpy as np
+import pytest
+
+_TMP = tempfile.mkdtemp(prefix="k9-test-")
+os.environ["CHROMA_DIR"] = os.path.join(_TMP, "chroma")
+os.environ["EMBED_CACHE_DIR"] = os.path.join(_TMP, "embed_cache")
+os.environ["WATCH_ENABLED"] = "false"
+os.environ["INGEST_WORKERS"] = "1"
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+class _HashModel:
+    """SentenceTransformer の代わり。文字 2-gram をハッシュして数える正規化ベクトル（似た文は近くなる）。"""
+
+    dim = 32
+
+    def encode(self, texts, convert_to_numpy=True):
+        out = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for i in range(max(1, len(text) - 1)):
+                h = hashlib.md5(text[i:i + 2].encode("utf-8")).digest()
+                out[row, h[0] % self.dim] += 1.0
+            norm = np.linalg.norm(out[row])
+            if norm:
+                out[row] /= norm
+        return out
+
+@pytest.fixture
+def fake_embedder(monkeypatch):
+    """埋め込みモデルを _HashModel に差し替える（モデルのダウンロード・読み込みをしない）。"""
+    from app import vectorstore
+    monkeypatch.setattr(vectorstore._embedder, "_model", _HashModel())
+    monkeypatch.setattr(vectorstore._embedder, "state", "ready")
+    return vectorstore._embedder
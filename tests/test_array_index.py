@@ -0,0 +1,105 @@
+# =============================================
+# test_array_index.py
+# ---------------------------------------------
+# NumPy インデックス（array_index.py）のメタデータ条件が Chroma と同じ結果になることの確認。
+# 同じ項目を Chroma のコレクションと ArrayIndex に入れ、同じ where で引き比べる。
+# =============================================
+import chromadb
+import numpy as np
+import pytest
+
+from app.array_index import ArrayIndex
+
+METAS = [
+    {"path": "/a/x.txt", "ext": ".txt", "chunk_index": 0, "mtime": 1.5, "flag": True, "a-b": "q", "n-x": 2},
+    {"path": "/a/x.txt", "ext": ".txt", "chunk_index": 1, "mtime": 1.5, "flag": False},
+    {"path": "/a/y.pdf", "ext": ".pdf", "chunk_index": 0, "mtime": 3.0, "page": 2},
+    {"path": "/b/z.md", "ext": ".md", "chunk_index": 2, "mtime": 5, "a-b": "r", "n-x": 3.5},
+    {"path": "/b/w.txt", "chunk_index": 3, "mtime": 7.25, "flag": True, "page": 1},
+]
+IDS = [f"i{i}" for i in range(len(METAS))]
+EMBEDDINGS = np.random.RandomState(0).rand(len(IDS), 8).astype(np.float32)
+
+WHERES = [
+    {"path": "/a/x.txt"},
+    {"path": {"$eq": "/a/x.txt"}},
+    {"path": {"$ne": "/a/x.txt"}},
+    # $ne / $nin はキーの無い項目（i4 に ext が無い）にも合う
+    {"ext": {"$ne": ".txt"}},
+    {"ext": {"$nin": [".pdf"]}},
+    {"ext": {"$in": [".pdf", ".md"]}},
+    {"page": {"$ne": 1}},
+    {"page": {"$nin": [1, 2]}},
+    # 数値は int / float を区別しない
+    {"chunk_index": {"$gte": 1}},
+    {"chunk_index": {"$gt": 0.5}},
+    {"chunk_index": 0.0},
+    {"mtime": 5},
+    {"mtime": {"$lt": 5}},
+    {"mtime": {"$lte": 5}},
+    # 真偽値と数値は別物
+    {"flag": True},
+    {"flag": False},
+    {"flag": 1},
+    {"flag": {"$ne": True}},
+    {"flag": {"$in": [True]}},
+    {"flag": {"$nin": [False]}},
+    {"chunk_index": True},
+    # 文字列と数値も別物
+    {"chunk_index": "1"},
+    # 識別子でないキー
+    {"a-b": "q"},
+    {"a-b": {"$ne": "q"}},
+    {"n-x": {"$gt": 1}},
+    {"n-x": {"$ne": 2}},
+    # 組み合わせ
+    {"$and": [{"ext": ".txt"}, {"chunk_index": {"$gt": 0}}]},
+    {"$or": [{"ext": ".pdf"}, {"flag": True}]},
+    {"$or": [{"ext": {"$ne": ".txt"}}, {"page": 2}]},
+    {"$or": [{"n-x": {"$lte": 2}}, {"a-b": "r"}]},
+    {"$and": [{"$or": [{"ext": ".md"}, {"page": 1}]}, {"mtime": {"$gt": 4}}]},
+]
+
+INVALID = [
+    {"path": "/a/x.txt", "chunk_index": 1},
+    {"chunk_index": {"$gte": 1, "$lte": 2}},
+    {"ext": {"$gt": ".o"}},
+    {"ext": {"$in": [".txt", 1]}},
+    {"ext": {"$in": []}},
+    {"$and": [{"ext": ".txt"}]},
+]
+
+@pytest.fixture(scope="module")
+def chroma(tmp_path_factory):
+    client = chromadb.PersistentClient(path=str(tmp_path_factory.mktemp("chroma")))
+    col = client.create_collection("where-test", embedding_function=None, metadata={"hnsw:space": "cosine"})
+    col.upsert(ids=IDS, embeddings=EMBEDDINGS.tolist(), metadatas=METAS, documents=IDS)
+    return col
+
+@pytest.fixture(scope="module", params=["float32", "int8"])
+def array(request, tmp_path_factory):
+    ix = ArrayIndex(str(tmp_path_factory.mktemp("array")), "where-test", None, dtype=request.param)
+    ix.upsert(ids=IDS, embeddings=EMBEDDINGS.tolist(), metadatas=METAS, documents=IDS)
+    yield ix
+    ix.close()
+
+@pytest.mark.parametrize("where", WHERES, ids=[str(w) for w in WHERES])
+def test_get_matches_chroma(chroma, array, where):
+    assert sorted(array.get(where=where)["ids"]) == sorted(chroma.get(where=where)["ids"])
+
+@pytest.mark.parametrize("where", WHERES, ids=[str(w) for w in WHERES])
+def test_query_filters_like_chroma(chroma, array, where):
+    expected = chroma.get(where=where)["ids"]
+    found = array.query(query_embeddings=[EMBEDDINGS[0].tolist()], n_results=len(IDS), where=where)
+    assert sorted(found["ids"][0]) == sorted(expected)
+
+@pytest.mark.parametrize("where", INVALID, ids=[str(w) for w in INVALID])
+def test_rejects_what_chroma_rejects(chroma, array, where):
+    with pytest.raises(ValueError):
+        chroma.get(where=where)
+    with pytest.raises(ValueError):
+        array.get(where=where)
+
+def test_where_with_ids(array):
+    assert sorted(array.get(ids=["i0", "i1", "i2"], where={"ext": ".txt"})["ids"]) == ["i0", "i1"]
+    assert array.get(ids=["i4"], where={"ext": {"$ne": ".txt"}})["ids"] == ["i4"]
@@ -0,0 +1,87 @@
+# =============================================
+# test_chunking.py
+# ---------------------------------------------
+# 逐次チャンカー（pipeline.ChunkStream / chunk_text）が、
+# 元の一括版 chunk_text と同じ分割を返すことの確認。
+# =============================================
+import random
+from typing import List
+
+import pytest
+
+from app.pipeline import ChunkStream, chunk_text
+
+def _baseline_chunk_text(text: str, max_chars: int, overlap: int) -> List[str]:
+    """逐次化する前の chunk_text（比較の基準）。"""
+    n = len(text)
+    if n == 0:
+        return []
+    if max_chars <= 0:
+        raise ValueError("max_chars must be > 0")
+    if n <= max_chars:
+        return [text]
+    overlap = max(0, min(overlap, max_chars - 1))
+    step = max(1, max_chars - overlap)
+    chunks: List[str] = []
+    start = 0
+    while start < n:
+        end = min(start + max_chars, n)
+        chunk = text[start:end]
+        if chunk:
+            chunks.append(chunk)
+        if end >= n:
+            break
+        start += step
+    return chunks
+
+def _feed_in_pieces(text: str, max_chars: int, overlap: int, rng: random.Random) -> List[str]:
+    stream = ChunkStream(max_chars, overlap)
+    out = []
+    pos = 0
+    while pos < len(text):
+        size = rng.randint(1, max(1, max_chars * 2))
+        out += [c for c, _ in stream.feed(text[pos:pos + size])]
+        pos += size
+    out += [c for c, _ in stream.finish()]
+    return out
+
+@pytest.mark.parametrize("length", [0, 1, 9, 10, 11, 25, 100, 1001])
+@pytest.mark.parametrize("max_chars,overlap", [(10, 0), (10, 3), (10, 9), (10, 10), (10, 50), (10, -5), (1, 0), (7, 2)])
+def test_chunk_text_matches_baseline(length, max_chars, overlap):
+    text = "".join(chr(0x3042 + i % 80) for i in range(length))
+    assert chunk_text(text, max_chars, overlap) == _baseline_chunk_text(text, max_chars, overlap)
+
+def test_stream_fed_in_pieces_matches_baseline():
+    rng = random.Random(0)
+    for _ in range(300):
+        max_chars = rng.randint(1, 40)
+        overlap = rng.randint(-2, max_chars + 2)
+        text = "".join(rng.choice("あいうえおabc \n") for _ in range(rng.randint(0, 300)))
+        assert _feed_in_pieces(text, max_chars, overlap, rng) == _baseline_chunk_text(text, max_chars, overlap)
+
+def test_invalid_max_chars():
+    with pytest.raises(ValueError):
+        chunk_text("abc", 0, 0)
+    with pytest.raises(ValueError):
+        ChunkStream(0, 0)
+
+def test_page_ranges_cover_chunk():
+    pages = ["a" * 25, "b" * 5, "c" * 30]
+    owner = "".join(str(i + 1) * len(p) for i, p in enumerate(pages))
+    stream = ChunkStream(10, 4)
+    out = []
+    for i, page in enumerate(pages):
+        out += stream.feed(page, page=i + 1)
+    out += stream.finish()
+
+    assert [c for c, _ in out] == _baseline_chunk_text("".join(pages), 10, 4)
+    start = 0
+    for chunk, page_range in out:
+        end = start + len(chunk) - 1
+        assert page_range == (int(owner[start]), int(owner[end]))
+        start += 6
+
+def test_no_pages_gives_none():
+    stream = ChunkStream(5, 1)
+    out = stream.feed("abcdefghijkl") + stream.finish()
+    assert out and all(pages is None for _, pages in out)
@@ -0,0 +1,78 @@
+# =============================================
+# test_context.py
+# ---------------------------------------------
+# RAG の文脈組み立て（context.pack_contexts）と抜粋の回答（extractive_answer）の確認。
+# =============================================
+from app.context import estimate_tokens, extractive_answer, pack_contexts
+from app.pipeline import chunk_text
+from app.retrieval import Hit
+
+def _hit(path: str, index: int, text: str) -> Hit:
+    return Hit(id=f"{path}:{index}", document=text, metadata={"path": path, "chunk_index": index}, distance=0.0)
+
+def test_estimate_tokens():
+    assert estimate_tokens("") == 0
+    assert estimate_tokens("請求書") == 3
+    assert estimate_tokens("abcd") == 1
+    assert estimate_tokens("abcde") == 2
+    assert estimate_tokens("AB-1234 の仕様") == 2 + 3
+
+def test_adjacent_chunks_are_joined_without_the_overlap():
+    text = "".join(chr(0x3042 + i % 70) for i in range(95))
+    chunks = chunk_text(text, 30, 8)
+    # 検索順はばらばらでも、チャンク番号順につなぐ
+    hits = [_hit("/a.txt", i, chunks[i]) for i in (2, 0, 3, 1)]
+    packed = pack_contexts(hits, token_budget=10_000, max_overlap=8)
+    assert packed.contexts == [text]
+    assert packed.raw_tokens_est == sum(estimate_tokens(c) for c in chunks)
+    assert packed.packed_tokens_est == len(text)
+    assert packed.tokens_saved_est == packed.raw_tokens_est - len(text)
+
+def test_gaps_and_files_stay_separate_in_rank_order():
+    hits = [
+        _hit("/b.txt", 5, "見積書は営業部が発行します。"),
+        _hit("/a.txt", 0, "請求書の締め日は毎月25日です。"),
+        _hit("/a.txt", 2, "議事録は共有フォルダに保存します。"),
+        _hit("/b.txt", 5, "見積書は営業部が発行します。"),  # 同じチャンクが2回
+    ]
+    packed = pack_contexts(hits, token_budget=10_000, max_overlap=10)
+    assert packed.contexts == [
+        "見積書は営業部が発行します。",
+        "請求書の締め日は毎月25日です。",
+        "議事録は共有フォルダに保存します。",
+    ]
+
+def test_near_duplicates_from_other_files_are_dropped():
+    body = "在庫の棚卸しは毎月末に倉庫担当が行い、結果を経理課へ報告します。"
+    hits = [
+        _hit("/a.txt", 0, body),
+        _hit("/copy/a.txt", 0, body + "。"),
+        _hit("/c.txt", 0, "仕様書の改訂は設計担当の承認が必要です。"),
+    ]
+    packed = pack_contexts(hits, token_budget=10_000, max_overlap=10)
+    assert packed.contexts == [body, "仕様書の改訂は設計担当の承認が必要です。"]
+    # しきい値を 1 より大きくすると落とさない
+    assert len(pack_contexts(hits, 10_000, 10, dedup_threshold=1.1).contexts) == 3
+
+def test_token_budget_cuts_the_last_passage():
+    hits = [_hit(f"/{i}.txt", 0, chr(0x4e00 + i) * 100) for i in range(3)]
+    packed = pack_contexts(hits, token_budget=260, max_overlap=10)
+    assert packed.contexts[:2] == [hits[0].document, hits[1].document]
+    assert len(packed.contexts) == 3 and hits[2].document.startswith(packed.contexts[2])
+    assert packed.packed_tokens_est == 260
+
+    # 残りが 50 トークン未満なら、切れ端は入れない
+    packed = pack_contexts(hits, token_budget=240, max_overlap=10)
+    assert packed.contexts == [hits[0].document, hits[1].document]
+    assert packed.packed_tokens_est == 200
+
+def test_extractive_answer_picks_matching_sentences():
+    hits = [
+        _hit("/docs/a.txt", 0, "請求書の締め日は毎月25日です。支払いは翌月末です。"),
+        _hit("/docs/b.txt", 0, "議事録は共有フォルダに保存します。"),
+    ]
+    answer = extractive_answer("請求書の締め日はいつ？", hits, reason="queue_full", max_sentences=1)
+    header, line = answer.split("\n")
+    assert "混み合っている" in header
+    assert line == "・請求書の締め日は毎月25日です。（a.txt）"
+    assert extractive_answer("質問", []) == "手元の文書からは断定できません。"
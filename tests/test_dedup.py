@@ -0,0 +1,114 @@
+# =============================================
+# test_dedup.py
+# ---------------------------------------------
+# ほぼ重複したチャンクの検出（dedup.py）の確認。
+# ・コピー・小さな改訂版は別名になり、同じファイルの中・短いチャンクは別名にしない
+# ・代表を消すと、残っている別名の1つが代表に昇格する（取り込みでは元のベクトルを使い回す）
+# =============================================
+import os
+
+import numpy as np
+import pytest
+
+from app.config import settings
+from app.dedup import DuplicateIndex, duplicate_index
+from app.ingest import ingest_paths
+from app.manifest import manifest
+from app.vectorstore import get_collection
+
+BODY = ("請求書の締め日は毎月25日です。支払いは翌月末までに経理課から振り込みます。"
+        "見積書は営業部が発行し、金額の変更には部長の承認が必要です。")
+OTHER = ("議事録は会議の翌日までに共有フォルダへ保存します。出席者の名前と決定事項を必ず書き、"
+         "宿題には担当者と期限を添えます。")
+
+@pytest.fixture
+def index(tmp_path):
+    return DuplicateIndex(str(tmp_path / "dedup.sqlite3"), threshold=0.8)
+
+def _add(index, ids, docs, paths, shard="s"):
+    """plan → commit（ベクトルインデックスへの書き込みは省く）。代表の ID を返す。"""
+    canon, sigs = index.plan(ids, docs, paths, [shard] * len(ids))
+    index.commit(ids, docs, [{"path": p} for p in paths], [shard] * len(ids), canon, sigs)
+    return canon
+
+def test_copies_become_aliases(index):
+    canon = _add(index, ["a0", "b0", "c0", "a1"], [BODY, BODY + "以上。", OTHER, BODY],
+                 ["/a.txt", "/copy/a.txt", "/c.txt", "/a.txt"])
+    # 別ファイルのほぼ同じチャンクは別名（同じバッチの先のチャンクも代表の候補）
+    # 同じファイルの中の重複・似ていないチャンクは代表のまま
+    assert canon == [None, "a0", None, None]
+    assert index.resolve(["a0", "b0"]) == {"b0": ("a0", BODY + "以上。", {"path": "/copy/a.txt"})}
+    assert index.cluster_paths(["a0"]) == {"a0": ["/a.txt", "/copy/a.txt"]}
+
+    # 登録済みの代表にも寄せる（同じ内容の a0 / a1 のどちらか）。短いチャンクは比べない
+    canon = _add(index, ["d0", "e0", "f0"], [BODY, "短い", "短い"], ["/d.txt", "/e.txt", "/f.txt"])
+    assert canon[0] in ("a0", "a1") and canon[1:] == [None, None]
+    assert index.stats()["alias_chunks"] == 2
+    # 登録済みでも同じファイルの代表には寄せない
+    assert _add(index, ["a2"], [BODY], ["/a.txt"]) == [None]
+
+def test_other_shards_are_not_compared(index):
+    _add(index, ["a0"], [BODY], ["/a.txt"], shard="s1")
+    assert _add(index, ["b0"], [BODY], ["/b.txt"], shard="s2") == [None]
+
+def test_removing_the_canonical_promotes_an_alias(index):
+    _add(index, ["a0", "b0", "c0"], [BODY] * 3, ["/a.txt", "/b.txt", "/c.txt"])
+
+    promotions = index.remove(["a0"])
+    # 先に登録された別名が代表になり、残りの別名はその代表に付け替わる
+    assert [(p.old, p.new, p.metadata) for p in promotions] == [("a0", "b0", {"path": "/b.txt"})]
+    assert index.resolve(["b0", "c0"]) == {"c0": ("b0", BODY, {"path": "/c.txt"})}
+    assert index.cluster_paths(["b0"]) == {"b0": ["/b.txt", "/c.txt"]}
+    # 昇格した代表も LSH で引ける
+    assert _add(index, ["d0"], [BODY], ["/d.txt"]) == ["b0"]
+
+def test_promotion_returns_the_alias_text(index):
+    _add(index, ["a0", "b0"], [BODY, BODY + "以上。"], ["/a.txt", "/b.txt"])
+    [p] = index.remove(["a0"])
+    assert (p.new, p.document, p.metadata) == ("b0", BODY + "以上。", {"path": "/b.txt"})
+    assert not index.active()
+
+def test_removing_the_whole_cluster_promotes_nothing(index):
+    _add(index, ["a0", "b0", "c0"], [BODY] * 3, ["/a.txt", "/b.txt", "/c.txt"])
+    # 別名だけを消しても昇格は起きない
+    assert index.remove(["c0"]) == []
+    assert index.cluster_paths(["a0"]) == {"a0": ["/a.txt", "/b.txt"]}
+    # 一緒に消える別名は昇格させない
+    assert index.remove(["a0", "b0"]) == []
+    assert index.stats()["canonical_chunks"] == 0 and not index.active()
+
+# ---- 取り込みを通した昇格 ----
+
+def _write(path, text: str):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(text)
+
+@pytest.fixture
+def dedup_docs(tmp_path, fake_embedder, monkeypatch):
+    monkeypatch.setattr(settings, "dedup_enabled", True)
+    root = tmp_path / "dedup_docs"
+    _write(str(root / "a.txt"), BODY)
+    _write(str(root / "copy" / "a.txt"), BODY)
+    return root
+
+def test_deleting_the_canonical_file_keeps_the_copy_searchable(dedup_docs, fake_embedder, monkeypatch):
+    ingest_paths([str(dedup_docs)])
+    records = [manifest.get(str(dedup_docs / "a.txt")), manifest.get(str(dedup_docs / "copy" / "a.txt"))]
+    stored = [set(get_collection().get(ids=r.chunk_ids())["ids"]) for r in records]
+    # 片方だけがベクトル DB にあり、もう片方は別名
+    assert sorted(len(s) for s in stored) == [0, 1]
+    canonical, alias = records if stored[0] else records[::-1]
+    [old_id], [new_id] = canonical.chunk_ids(), alias.chunk_ids()
+    assert duplicate_index.resolve([new_id])[new_id][0] == old_id
+    vector = get_collection().get(ids=[old_id], include=["embeddings"])["embeddings"][0]
+
+    # 昇格したチャンクは埋め込み直さず、元の代表のベクトルを使う
+    monkeypatch.setattr(fake_embedder, "_model", None)
+    os.remove(canonical.path)
+    ingest_paths([str(dedup_docs)])
+    got = get_collection().get(ids=[old_id, new_id], include=["embeddings", "metadatas"])
+    assert got["ids"] == [new_id]
+    assert got["metadatas"][0]["path"] == alias.path
+    assert np.allclose(got["embeddings"][0], vector)
+    assert duplicate_index.resolve([new_id]) == {}
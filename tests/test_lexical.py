@@ -0,0 +1,140 @@
+# =============================================
+# test_lexical.py
+# ---------------------------------------------
+# 語彙検索（lexical.py の BM25）とハイブリッド検索の順位融合（retrieval.py の RRF）の確認。
+# =============================================
+import math
+from collections import Counter
+
+import pytest
+
+from app import retrieval
+from app.config import settings
+from app.lexical import LexicalIndex, tokenize
+from app.retrieval import Hit
+from app.scope import Scope
+
+DOCS = {
+    "a": ("/data/sales/a.txt", "請求書の締め日は毎月25日です。請求書は経理課へ。"),
+    "b": ("/data/sales/b.pdf", "見積書は営業部が発行します。"),
+    "c": ("/data/dev/c.txt", "型番 AB-1234 の仕様書は設計担当が管理します。"),
+    "d": ("/data/dev/d.txt", "請求書の様式は共有フォルダにあります。議事録もここに保存します。議事録の様式も同じです。"),
+    "e": ("/data/dev/sub/e.md", "在庫は倉庫で管理します。"),
+}
+
+def _bm25(query: str, k1=1.2, b=0.75):
+    """比較用の素朴な BM25（全文書を総当たり）。"""
+    docs = {id_: Counter(tokenize(text)) for id_, (_, text) in DOCS.items()}
+    n = len(docs)
+    avg = sum(sum(c.values()) for c in docs.values()) / n
+    scores = {}
+    for term in set(tokenize(query)):
+        df = sum(1 for c in docs.values() if term in c)
+        if not df:
+            continue
+        idf = math.log(1 + (n - df + 0.5) / (df + 0.5))
+        for id_, counts in docs.items():
+            tf = counts.get(term, 0)
+            if tf:
+                length = sum(counts.values())
+                scores[id_] = scores.get(id_, 0.0) + idf * tf * (k1 + 1) / (tf + k1 * (1 - b + b * length / avg))
+    return scores
+
+@pytest.fixture
+def index(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "lexical_max_df_ratio", 1.0)
+    ix = LexicalIndex(str(tmp_path / "lexical.sqlite3"))
+    ids = list(DOCS)
+    ix.add(ids, [DOCS[i][1] for i in ids],
+           [{"path": DOCS[i][0], "digest": i, "chunk_index": 0, "mtime": float(n)} for n, i in enumerate(ids)])
+    return ix
+
+def test_tokenize_words_and_bigrams():
+    assert tokenize("AB-1234 の設定") == ["ab-1234", "ab", "1234", "の設", "設定"]
+    assert tokenize("Ｖ２．０") == ["v2.0", "v2", "0"]
+    assert tokenize("表") == ["表"]
+
+@pytest.mark.parametrize("query", ["請求書", "議事録の様式", "ab-1234", "管理します", "存在しない語"])
+def test_scores_match_reference_bm25(index, query):
+    expected = _bm25(query)
+    got = index.search(query, 10)
+    assert [id_ for id_, _ in got] == sorted(expected, key=lambda i: (-expected[i], i))
+    for id_, score in got:
+        assert score == pytest.approx(expected[id_])
+
+def test_ranking_prefers_rare_and_repeated_terms(index):
+    # 「議事録」は d にしかなく2回出る
+    assert index.search("議事録", 1)[0][0] == "d"
+    # 型番は英数字の語として引ける（部分でも引ける）
+    assert index.search("AB-1234", 1)[0][0] == "c"
+    assert index.search("1234", 1)[0][0] == "c"
+
+def test_scope_filters_before_scoring(index):
+    assert {i for i, _ in index.search("管理", 10, Scope(dir="/data/dev"))} == {"c", "e"}
+    assert {i for i, _ in index.search("管理", 10, Scope(dir="/data/dev/sub"))} == {"e"}
+    assert {i for i, _ in index.search("請求書", 10, Scope(exts=(".txt",)))} == {"a", "d"}
+    assert index.search("請求書", 10, Scope(dir="/nowhere")) == []
+
+def test_narrow_and_wide_scope_give_the_same_scores(index):
+    # 範囲が狭い（文書側から引く）ときも、出現リスト側から引くときも採点は同じ
+    scope = Scope(dir="/data/dev")
+    wide = [(i, s) for i, s in index.search("請求書 管理", 10) if i in ("c", "d", "e")]
+    assert index.search("請求書 管理", 10, scope) == pytest.approx(wide)
+    # 全件が範囲に入る（出現リスト側から引く）
+    assert index.search("請求書", 10, Scope(dir="/data")) == pytest.approx(index.search("請求書", 10))
+
+def test_delete_updates_document_frequency(index):
+    index.delete_path("/data/dev/d.txt")
+    assert [i for i, _ in index.search("議事録", 10)] == []
+    assert {i for i, _ in index.search("請求書", 10)} == {"a"}
+    assert index.count() == 4
+
+def test_common_terms_are_skipped(index, monkeypatch):
+    # 「ます」は5件中4件に出る。割合の上限を下げると採点に使わない
+    monkeypatch.setattr(settings, "lexical_max_df_ratio", 0.5)
+    assert {i for i, _ in index.search("議事録 ます", 10)} == {"d"}
+    # ありふれた語しか無いときは、いちばん珍しい語だけで採点する
+    assert {i for i, _ in index.search("ます", 10)} == {"b", "c", "d", "e"}
+
+# ---- ハイブリッド（RRF）----
+
+class _FakeLexical:
+    def __init__(self, ranked):
+        self.ranked = ranked
+
+    def search(self, query, k, scope=None):
+        return self.ranked[:k]
+
+def _hit(id_):
+    return Hit(id=id_, document=id_, metadata={"path": f"/{id_}.txt"}, distance=0.1)
+
+@pytest.fixture
+def fuse(monkeypatch):
+    """ベクトル側・語彙側の順位を渡して _hybrid_search の融合結果を返す。"""
+    def run(vector_ids, lexical_ids, k=10, clusters=None):
+        monkeypatch.setattr(retrieval, "lexical_index", _FakeLexical([(i, 1.0) for i in lexical_ids]))
+        monkeypatch.setattr(retrieval, "_clusters", lambda ids: dict(clusters or {}))
+        monkeypatch.setattr(retrieval, "_fetch", lambda ids, where=None: {i: (i, {"path": f"/{i}.txt"}) for i in ids})
+        hits = retrieval._hybrid_search("q", k, [0.0], vector_hits=[_hit(i) for i in vector_ids])
+        return [(h.id, h.score) for h in hits]
+    return run
+
+def _rrf(*ranks):
+    return sum(1.0 / (retrieval._RRF_K + r) for r in ranks)
+
+def test_rrf_rewards_agreement(fuse):
+    out = fuse(["v1", "both", "v3"], ["l1", "both", "l3"])
+    assert out[0] == ("both", pytest.approx(_rrf(2, 2)))
+    # 片方にだけ1位で出たものは、その次（同点は先に見た方 = ベクトル側が先）
+    assert [i for i, _ in out[1:3]] == ["v1", "l1"]
+    assert dict(out)["l3"] == pytest.approx(_rrf(3))
+
+def test_rrf_lexical_only_hits_are_fetched(fuse):
+    out = fuse([], ["l1", "l2"], k=1)
+    assert out == [("l1", pytest.approx(_rrf(1)))]
+
+def test_rrf_counts_each_duplicate_cluster_once(fuse):
+    # l1 と l2 は同じ内容（代表 c）。語彙側では上位の l1 の順位だけ数え、ベクトル側の順位と足す
+    out = fuse(["l2", "v2"], ["l1", "l2", "l3"], clusters={"l1": "c", "l2": "c"})
+    assert out[0] == ("l2", pytest.approx(_rrf(1, 1)))
+    assert [i for i, _ in out] == ["l2", "v2", "l3"]
@@ -0,0 +1,115 @@
+# =============================================
+# test_llm_scheduler.py
+# ---------------------------------------------
+# LLM の順番待ち（llm_scheduler.py）の確認。
+# ・同時実行数の上限・到着順・待ち行列あふれ（queue_full）
+# ・期限切れ / 間に合わない見込み（deadline）で札が返ること
+# Ticket はイベントループの中で作るので、各テストは asyncio.run で回す。
+# =============================================
+import asyncio
+import time
+
+import pytest
+
+from app import llm_scheduler
+from app.llm_scheduler import LLMScheduler, LLMUnavailable
+
+def _deadline(seconds: float) -> float:
+    return time.monotonic() + seconds
+
+def test_queue_full_is_rejected():
+    async def main():
+        sched = LLMScheduler(limit=1, max_queue=1)
+        first = sched.submit(_deadline(10))
+        second = sched.submit(_deadline(10))
+        with pytest.raises(LLMUnavailable) as e:
+            sched.submit(_deadline(10))
+        assert e.value.reason == "queue_full"
+        assert (first.granted, second.granted) == (True, False)
+        assert sched.stats()["rejected"] == 1
+
+        # 空きができれば受け付ける
+        sched.release(first)
+        assert second.granted
+        sched.submit(_deadline(10))
+        assert sched.stats()["queued"] == 1
+    asyncio.run(main())
+
+def test_turns_are_granted_in_arrival_order():
+    async def main():
+        sched = LLMScheduler(limit=2, max_queue=5)
+        tickets = [sched.submit(_deadline(10)) for _ in range(5)]
+        assert [sched.position(t) for t in tickets] == [0, 0, 1, 2, 3]
+
+        sched.release(tickets[1])
+        assert [t.granted for t in tickets] == [True, True, True, False, False]
+        assert sched.position(tickets[4]) == 2
+        # 待つのをやめた札は行列から抜ける
+        sched.release(tickets[3])
+        assert sched.position(tickets[4]) == 1
+        # 2回目の release は何もしない
+        sched.release(tickets[1])
+        assert sched.stats()["active"] == 2
+    asyncio.run(main())
+
+def test_wait_turn_reports_positions_until_granted(monkeypatch):
+    # 順番の変化は見回りの間隔ごとに確かめるので、短くしておく
+    monkeypatch.setattr(llm_scheduler, "_POLL_SECONDS", 0.01)
+
+    async def main():
+        sched = LLMScheduler(limit=1, max_queue=5)
+        holder = sched.submit(_deadline(10))
+        waiter = sched.submit(_deadline(10))
+        later = sched.submit(_deadline(10))
+
+        async def finish_first():
+            await asyncio.sleep(0.05)
+            sched.release(holder)
+            await asyncio.sleep(0.05)
+            sched.release(waiter)
+
+        positions = []
+        task = asyncio.create_task(finish_first())
+        async for pos in sched.wait_turn(later):
+            positions.append(pos)
+        await task
+        assert positions == [2, 1]
+        assert later.granted and sched.stats()["completed"] == 2
+    asyncio.run(main())
+
+def test_deadline_expires_while_waiting():
+    async def main():
+        sched = LLMScheduler(limit=1, max_queue=5)
+        sched.submit(_deadline(10))
+        waiter = sched.submit(_deadline(0.1))
+        started = time.monotonic()
+        with pytest.raises(LLMUnavailable) as e:
+            async for _ in sched.wait_turn(waiter):
+                pass
+        assert e.value.reason == "deadline"
+        assert time.monotonic() - started < 1.0
+        # 札は返され、行列にも残らない
+        assert waiter.released and sched.position(waiter) == 0
+        assert sched.stats()["queued"] == 0 and sched.stats()["expired"] == 1
+    asyncio.run(main())
+
+def test_hopeless_wait_gives_up_without_waiting_for_the_deadline():
+    async def main():
+        sched = LLMScheduler(limit=1, max_queue=5)
+        # 1件あたり 0.2 秒かかった実績を作る
+        ticket = sched.submit(_deadline(10))
+        await asyncio.sleep(0.2)
+        sched.release(ticket)
+
+        sched.submit(_deadline(10))
+        sched.submit(_deadline(10))
+        # 3番目（2件待ち）: 見込み 0.4 秒以上 > 期限まで 0.3 秒
+        hopeless = sched.submit(_deadline(0.3))
+        assert sched.expected_wait(hopeless) >= 0.4
+        started = time.monotonic()
+        with pytest.raises(LLMUnavailable):
+            async for _ in sched.wait_turn(hopeless):
+                pass
+        assert time.monotonic() - started < 0.1
+        assert sched.stats()["queued"] == 1
+    asyncio.run(main())
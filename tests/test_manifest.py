@@ -0,0 +1,113 @@
+# =============================================
+# test_manifest.py
+# ---------------------------------------------
+# 台帳（manifest.py）による差分取り込みの確認。
+# ・stat / ハッシュが同じファイルは埋め込まない
+# ・中身が変わったファイルは古いチャンクを消して入れ直す
+# ・消えたファイルは台帳・チャンクから消す（隣の似た名前のフォルダには触れない）
+# =============================================
+import os
+
+import pytest
+
+from app.ingest import IngestProgress, ingest_paths
+from app.manifest import FileManifest, FileRecord, manifest
+from app.vectorstore import get_collection
+
+def _write(path, text: str):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(text)
+
+def _stored_ids(ids):
+    return set(get_collection().get(ids=ids)["ids"]) if ids else set()
+
+@pytest.fixture
+def docs(tmp_path, fake_embedder):
+    root = tmp_path / "docs"
+    _write(str(root / "a.txt"), "請求書の締め日は毎月25日です。" * 20)
+    _write(str(root / "sub" / "b.txt"), "議事録は共有フォルダに保存します。" * 20)
+    return root
+
+def test_second_ingest_skips_unchanged_files(docs):
+    first = ingest_paths([str(docs)])
+    assert (first.new_files, first.processed_files, first.errors) == (2, 2, [])
+    record = manifest.get(str(docs / "a.txt"))
+    assert record is not None and record.chunk_count > 0
+    assert _stored_ids(record.chunk_ids()) == set(record.chunk_ids())
+
+    # stat が同じなら開きもしない（前処理に回らない）
+    progress = IngestProgress()
+    second = ingest_paths([str(docs)], progress)
+    assert (second.unchanged_files, second.processed_files, second.processed_chunks) == (2, 0, 0)
+    assert (progress.files_discovered, progress.files_to_process) == (2, 0)
+
+def test_touched_file_is_not_reembedded(docs):
+    ingest_paths([str(docs)])
+    path = str(docs / "a.txt")
+    before = manifest.get(path)
+    os.utime(path, (before.mtime + 10, before.mtime + 10))
+
+    # mtime だけ変わったファイルはハッシュを取り直すが、埋め込みはしない
+    progress = IngestProgress()
+    stats = ingest_paths([str(docs)], progress)
+    assert (stats.unchanged_files, stats.processed_files) == (2, 0)
+    assert progress.files_to_process == 1
+    after = manifest.get(path)
+    assert after.mtime == before.mtime + 10
+    assert (after.digest, after.chunk_ids()) == (before.digest, before.chunk_ids())
+
+def test_changed_file_replaces_its_chunks(docs):
+    ingest_paths([str(docs)])
+    path = str(docs / "a.txt")
+    before = manifest.get(path)
+    _write(path, "見積書は営業部が発行します。")
+    os.utime(path, (before.mtime + 10, before.mtime + 10))
+
+    stats = ingest_paths([str(docs)])
+    assert (stats.updated_files, stats.unchanged_files) == (1, 1)
+    after = manifest.get(path)
+    assert after.digest != before.digest
+    assert _stored_ids(before.chunk_ids()) == set()
+    assert _stored_ids(after.chunk_ids()) == set(after.chunk_ids())
+
+def test_deleted_file_is_removed(docs):
+    ingest_paths([str(docs)])
+    path = str(docs / "sub" / "b.txt")
+    ids = manifest.get(path).chunk_ids()
+    os.remove(path)
+
+    stats = ingest_paths([str(docs)])
+    assert stats.removed_files == 1
+    assert manifest.get(path) is None
+    assert _stored_ids(ids) == set()
+    assert manifest.get(str(docs / "a.txt")) is not None
+
+def test_removal_stays_inside_the_folder(docs, tmp_path):
+    # "docs" の再取り込みで "docs2" 配下を消さない
+    sibling = tmp_path / "docs2" / "c.txt"
+    _write(str(sibling), "在庫は倉庫で管理します。" * 20)
+    ingest_paths([str(docs), str(sibling.parent)])
+
+    stats = ingest_paths([str(docs)])
+    assert stats.removed_files == 0
+    assert manifest.get(str(sibling)) is not None
+
+def test_relative_and_absolute_paths_are_one_entry(docs, monkeypatch):
+    monkeypatch.chdir(docs.parent)
+    ingest_paths(["docs"])
+    stats = ingest_paths([str(docs)])
+    assert (stats.new_files, stats.unchanged_files) == (0, 2)
+    assert manifest.get("docs/a.txt") is None
+
+def test_paths_under_uses_folder_boundary(tmp_path):
+    m = FileManifest(str(tmp_path / "m.sqlite3"))
+    root = os.path.join(str(tmp_path), "a")
+    paths = [os.path.join(root, "x.txt"), os.path.join(root, "b", "y.txt"), root + "b" + os.sep + "z.txt"]
+    m.upsert_many([FileRecord(p, 1, 1.0, "d", 1) for p in paths])
+
+    assert sorted(m.paths_under(root)) == sorted(paths[:2])
+    assert sorted(m.paths_under(root + os.sep)) == sorted(paths[:2])
+    assert m.existing(paths + ["/nowhere"]) == set(paths)
+    assert m.remove_under(root + os.sep) == 2
+    assert m.totals() == (1, 0)